@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Set
+
+
+logger = logging.getLogger(__name__)
+
+# Telegram не присылает в одном альбоме больше 10 элементов
+MAX_ALBUM_ITEMS = 10
+
+
+class AlbumAssembler:
+    """Собирает части медиагруппы в памяти и отдает альбом целиком
+
+    Части копятся по media_group_id, пока не наступит пауза quiet_seconds
+    без новых частей или не придут все 10 элементов. Затем альбом один раз
+    передается в on_album и сохраняется одной транзакцией.
+
+    on_album(messages, late) возвращает True, если альбом принят. Части,
+    опоздавшие после сборки, дописываются только к принятым альбомам
+    (late=True) и отбрасываются для отклоненных.
+
+    Правка части, которая еще в буфере, заменяет ее (replace); правку уже
+    собранного альбома нужно применять после settled, когда он сохранен.
+    """
+
+    def __init__(self, on_album: Callable[[List, bool], Awaitable[bool]],
+                 quiet_seconds: float = 2.0, remember: int = 1000):
+        self._on_album = on_album
+        self.quiet_seconds = quiet_seconds
+        self._parts: Dict[str, List] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Незавершенные сохранения альбома и его опоздавших частей по media_group_id
+        self._saving: Dict[str, Set[asyncio.Task]] = {}
+        # Решения по недавно собранным альбомам: media_group_id -> принят ли
+        self._decided: "OrderedDict[str, bool]" = OrderedDict()
+        self._remember = remember
+
+    def __len__(self):
+        return len(self._parts)
+
+    def add(self, message):
+        """Добавляет часть альбома в буфер"""
+        key = message.media_group_id
+
+        if key not in self._parts and (key in self._decided or key in self._inflight):
+            self._track(key, asyncio.create_task(self._deliver_late(key, message)))
+            return
+
+        parts = self._parts.setdefault(key, [])
+        parts.append(message)
+
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+        if len(parts) >= MAX_ALBUM_ITEMS:
+            self._flush(key)
+        else:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.quiet_seconds, self._flush, key)
+
+    def replace(self, message) -> bool:
+        """Заменяет часть альбома в буфере ее исправленной версией
+
+        Возвращает False, если части в буфере нет: альбом уже собран.
+        """
+        parts = self._parts.get(message.media_group_id, [])
+        for index, part in enumerate(parts):
+            if part.message_id == message.message_id:
+                parts[index] = message
+                return True
+        return False
+
+    async def settled(self, key: str):
+        """Ждет, пока сохранятся собранный альбом и его опоздавшие части"""
+        saving = self._saving.get(key)
+        if saving:
+            await asyncio.wait(set(saving))
+
+    def _track(self, key: str, task: asyncio.Task):
+        self._tasks.add(task)
+        self._saving.setdefault(key, set()).add(task)
+        task.add_done_callback(lambda done: self._untrack(key, done))
+
+    def _untrack(self, key: str, task: asyncio.Task):
+        self._tasks.discard(task)
+        saving = self._saving.get(key)
+        if saving is not None:
+            saving.discard(task)
+            if not saving:
+                del self._saving[key]
+
+    def _flush(self, key: str):
+        self._timers.pop(key, None)
+        parts = self._parts.pop(key, None)
+        if not parts:
+            return
+        task = asyncio.create_task(self._deliver(key, parts))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self._track(key, task)
+
+    async def _deliver(self, key: str, parts: List):
+        accepted = False
+        try:
+            accepted = await self._on_album(parts, False)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения альбома {key}: {type(e).__name__}: {str(e)}", exc_info=True)
+        finally:
+            self._decided[key] = bool(accepted)
+            while len(self._decided) > self._remember:
+                self._decided.popitem(last=False)
+
+    async def _deliver_late(self, key: str, message):
+        """Опоздавшая часть: ждет решения по альбому и дописывается только к принятому"""
+        inflight = self._inflight.get(key)
+        if inflight:
+            await asyncio.wait({inflight})
+
+        if not self._decided.get(key):
+            logger.info("Часть %s отклоненного альбома %s пропущена", message.message_id, key)
+            return
+        try:
+            await self._on_album([message], True)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения части альбома {key}: {type(e).__name__}: {str(e)}", exc_info=True)
+
+    async def flush_all(self):
+        """Немедленно сохраняет все собираемые альбомы (при остановке бота)"""
+        for timer in self._timers.values():
+            timer.cancel()
+        for key in list(self._parts):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,85 @@
+"""Бенчмарк записи в базу: пропускная способность group commit
+
+Параллельно сохраняет посты и отмечает их отправленными через
+Database.write при разных DB_COMMIT_BATCH. При batch_size=1 каждый
+пост коммитится отдельно (fsync на каждую запись), как до group commit.
+
+Запуск: python benchmarks/bench_db_writes.py --posts 2000 --batch-sizes 1 10 100 --output bench_db.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_pipeline import git_revision, latency_summary
+
+
+async def run(workdir: Path, batch_size: int, args) -> dict:
+    import database
+    from database import Database, Media, _mark_as_processed, _save_post
+
+    db = Database(workdir / f"batch{batch_size}.db", batch_size=batch_size, commit_delay=args.commit_delay / 1000)
+    await db.open(database.init_db, 0)
+    latencies = []
+
+    async def one(index: int):
+        started = time.perf_counter()
+        _, created = await db.write(_save_post, "bench", (-1001,), index, str(index),
+                                    [Media("photo", f"AgAC{index}", f"u{index}", index)], f"пост {index}", 0)
+        for post_id, _ in created:
+            await db.write(_mark_as_processed, post_id, index)
+        latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        # Волнами по concurrency: столько постов одновременно ждут коммита
+        for offset in range(0, args.posts, args.concurrency):
+            await asyncio.gather(*(one(index) for index in range(offset, min(args.posts, offset + args.concurrency))))
+        seconds = time.perf_counter() - started
+    finally:
+        db.close()
+
+    return {
+        "seconds": round(seconds, 4),
+        "writes_per_second": round(2 * args.posts / seconds, 1),
+        "post_latency": latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="Одновременных постов")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--commit-delay", type=float, default=2, help="DB_COMMIT_DELAY_MS")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для JSON-результата")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tgbot-bench-") as workdir:
+        results = {
+            f"batch_{batch_size}": asyncio.run(run(Path(workdir), batch_size, args))
+            for batch_size in args.batch_sizes
+        }
+
+    report = {
+        "benchmark": "db_writes",
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
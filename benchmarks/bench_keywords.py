@@ -0,0 +1,82 @@
+"""Микро-бенчмарк: KeywordMatcher против прежнего цикла по KEYWORDS
+
+Запуск: python benchmarks/bench_keywords.py [--keywords 300] [--captions 2000]
+"""
+import argparse
+import random
+import string
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from keyword_matcher import KeywordMatcher  # noqa: E402
+
+
+ALPHABET = "абвгдежзийклмнопрстуфхцчшщыэюя" + string.ascii_lowercase
+
+
+def random_word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def make_captions(rng: random.Random, keywords, count: int, hit_ratio: float):
+    captions = []
+    for _ in range(count):
+        words = [random_word(rng, rng.randint(3, 10)) for _ in range(rng.randint(20, 60))]
+        if rng.random() < hit_ratio:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords).upper())
+        captions.append(" ".join(words))
+    return captions
+
+
+def loop_match(captions, keywords):
+    """Прежняя реализация из handle_message"""
+    hits = 0
+    for caption in captions:
+        if any(keyword.lower() in caption.lower() for keyword in keywords):
+            hits += 1
+    return hits
+
+
+def matcher_match(captions, matcher):
+    hits = 0
+    for caption in captions:
+        if matcher.match(caption):
+            hits += 1
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keywords", type=int, default=300)
+    parser.add_argument("--captions", type=int, default=2000)
+    parser.add_argument("--hit-ratio", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    keywords = [random_word(rng, rng.randint(4, 9)) for _ in range(args.keywords)]
+    captions = make_captions(rng, keywords, args.captions, args.hit_ratio)
+
+    started = timeit.default_timer()
+    matcher = KeywordMatcher(keywords)
+    compile_time = timeit.default_timer() - started
+
+    assert loop_match(captions, keywords) == matcher_match(captions, matcher)
+
+    loop_time = min(timeit.repeat(lambda: loop_match(captions, keywords), number=1, repeat=args.repeat))
+    matcher_time = min(timeit.repeat(lambda: matcher_match(captions, matcher), number=1, repeat=args.repeat))
+
+    per_loop = loop_time / len(captions) * 1e6
+    per_matcher = matcher_time / len(captions) * 1e6
+    print(f"ключевых слов: {len(keywords)}, подписей: {len(captions)}")
+    print(f"компиляция KeywordMatcher: {compile_time * 1e3:.2f} мс")
+    print(f"цикл по KEYWORDS:          {per_loop:8.1f} мкс/подпись")
+    print(f"KeywordMatcher:            {per_matcher:8.1f} мкс/подпись")
+    print(f"ускорение:                 x{loop_time / matcher_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
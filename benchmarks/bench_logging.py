@@ -0,0 +1,158 @@
+"""Бенчмарк логирования: задержки event loop при всплесках сообщений
+
+Сравнивает прежнюю схему (RotatingFileHandler прямо в event loop, f-строки)
+с очередью из logger_config (QueueHandler + поток-слушатель, ленивое
+%-форматирование). Пока продюсер пишет пачки логов, фоновая задача
+каждую миллисекунду замеряет, на сколько цикл опоздал ее разбудить.
+
+Запуск: python benchmarks/bench_logging.py --bursts 200 --burst-size 200 --output bench_logging.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_pipeline import git_revision, latency_summary
+
+TICK = 0.001
+
+
+def make_file_handler(path: Path, max_bytes: int) -> RotatingFileHandler:
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=3, encoding="utf-8")
+    formatter = logging.Formatter('[%(asctime)s UTC] %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    formatter.converter = time.gmtime
+    handler.setFormatter(formatter)
+    return handler
+
+
+async def measure(logger: logging.Logger, args, lazy: bool) -> dict:
+    """Всплески логов и параллельный замер опозданий event loop"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    call_times = []
+    running = True
+
+    async def ticker():
+        while running:
+            started = loop.time()
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, loop.time() - started - TICK))
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+
+    post = {"id": 0, "route": "default", "media_group_id": "12345", "file_ids": ["AgAC"] * 4}
+    caption = "bench пост с ключевым словом и длинной подписью " * 3
+    for burst in range(args.bursts):
+        started = time.perf_counter()
+        for index in range(args.burst_size):
+            post["id"] = burst * args.burst_size + index
+            if lazy:
+                logger.info(
+                    "Пересылка: post_id=%s, route=%s, chat_id=%s, group_id=%s, files=%d, text='%.30s...'",
+                    post["id"], post["route"], -1001, post["media_group_id"], len(post["file_ids"]), caption
+                )
+                logger.debug("Отфильтрованная запись %s", post)
+            else:
+                logger.info(
+                    f"Пересылка: post_id={post['id']}, route={post['route']}, chat_id={-1001}, "
+                    f"group_id={post['media_group_id']}, files={len(post['file_ids'])}, "
+                    f"text='{caption[:30]}...'"
+                )
+                logger.debug(f"Отфильтрованная запись {post}")
+        call_times.append((time.perf_counter() - started) / args.burst_size)
+        await asyncio.sleep(args.pause)
+
+    running = False
+    await ticker_task
+    return {
+        "loop_lag": latency_summary(lags),
+        "log_call": latency_summary(call_times),
+    }
+
+
+async def run_direct(workdir: Path, args) -> dict:
+    """Прежняя схема: обработчик файла вызывается в потоке event loop"""
+    logger = logging.getLogger("bench.direct")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = make_file_handler(workdir / "direct.log", args.max_bytes)
+    logger.addHandler(handler)
+    try:
+        return await measure(logger, args, lazy=False)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+async def run_queue(workdir: Path, args) -> dict:
+    """Схема logger_config: в event loop запись только кладется в очередь"""
+    from logger_config import _QueueHandler
+
+    logger = logging.getLogger("bench.queue")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    log_queue = queue.SimpleQueue()
+    handler = make_file_handler(workdir / "queue.log", args.max_bytes)
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    queue_handler = _QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    try:
+        results = await measure(logger, args, lazy=True)
+    finally:
+        logger.removeHandler(queue_handler)
+        started = time.perf_counter()
+        listener.stop()
+        handler.close()
+    results["listener_drain_seconds"] = round(time.perf_counter() - started, 4)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=100, help="Число всплесков")
+    parser.add_argument("--burst-size", type=int, default=200, help="Записей во всплеске")
+    parser.add_argument("--pause", type=float, default=0.01, help="Пауза между всплесками, с")
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024, help="Порог ротации файла")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для JSON-результата")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tgbot-bench-") as workdir:
+        # logger_config создает data/ в текущем каталоге, поэтому работаем во временном
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            results = {
+                "direct": asyncio.run(run_direct(Path(workdir), args)),
+                "queue": asyncio.run(run_queue(Path(workdir), args)),
+            }
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "benchmark": "logging",
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Офлайн-бенчмарк конвейера бота на локальном Fake Bot API
+
+Поднимает benchmarks/fake_bot_api.py, подключает к нему Application,
+прогоняет синтетические посты и альбомы через handle_message и измеряет:
+скорость приема, задержки save_post, время разгрузки очереди отправки
+и число вызовов API на пересланный пост. Результат пишется в JSON,
+чтобы сравнивать версии между собой.
+
+Запуск: python benchmarks/bench_pipeline.py --posts 500 --albums 100 --output bench.json
+Пересылка пачками copyMessages: добавьте --dispatch-mode copy
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+SOURCE_CHAT_ID = -1001000000001
+TARGET_CHAT_ID = -1001000000002
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def latency_summary(values) -> dict:
+    """Перцентили в миллисекундах"""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p90_ms": round(percentile(values, 90) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values, default=0) * 1000, 3),
+    }
+
+
+def make_updates(posts: int, albums: int, album_size: int):
+    """Синтетические channel_post: одиночные посты и альбомы вперемешку"""
+    updates = []
+    message_id = 0
+    now = int(time.time())
+    chat = {"id": SOURCE_CHAT_ID, "type": "channel", "title": "source"}
+
+    def channel_post(**fields):
+        nonlocal message_id
+        message_id += 1
+        updates.append({
+            "update_id": len(updates) + 1,
+            "channel_post": {"message_id": message_id, "date": now, "chat": chat, **fields}
+        })
+
+    for index in range(max(posts, albums)):
+        if index < posts:
+            if index % 2:
+                channel_post(text=f"bench пост {index}")
+            else:
+                channel_post(caption=f"bench фото {index}", photo=[{
+                    "file_id": f"AgACbench{index}", "file_unique_id": f"u{index}", "width": 1, "height": 1
+                }])
+        if index < albums:
+            group = f"album{index}"
+            for item in range(album_size):
+                fields = {"caption": f"bench альбом {index}"} if item == 0 else {}
+                channel_post(media_group_id=group, photo=[{
+                    "file_id": f"AgACalbum{index}_{item}", "file_unique_id": f"a{index}_{item}",
+                    "width": 1, "height": 1
+                }], **fields)
+    return updates
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def wait_drained(database, timeout: float) -> bool:
+    """Ждет, пока в базе не останется постов в ожидании и в отправке"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        pending = await database.db.read(
+            lambda conn: conn.execute("SELECT COUNT(*) FROM posts WHERE is_processed IN (0, 3)").fetchone()[0]
+        )
+        if not pending:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run(args) -> dict:
+    from fake_bot_api import FakeBotApi
+
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ.setdefault("SOURCE_CHANNEL_ID", str(SOURCE_CHAT_ID))
+    os.environ.setdefault("TARGET_CHANNEL_ID", str(TARGET_CHAT_ID))
+
+    import database
+    import main
+    from routes import build_routes
+    from telegram import Update
+
+    main.configure()
+    # Один маршрут без задержки: посты уходят сразу после сохранения
+    main.routes = build_routes(
+        [], SOURCE_CHAT_ID, TARGET_CHAT_ID, keywords=["bench"], exclude_keywords=[],
+        whole_words=False, delay_minutes=0, additional_text="bench"
+    )
+    main.routes_by_name = {route.name: route for route in main.routes.values()}
+    main.ALBUM_QUIET_SECONDS = args.album_quiet
+    main.DISPATCH_WORKERS = args.workers
+    main.UPDATE_WORKERS = args.update_workers
+    main.GLOBAL_RATE_LIMIT = args.global_rate
+    main.CHAT_RATE_LIMIT = args.chat_rate
+    main.DISPATCH_MODE = args.dispatch_mode
+    main.RETRY_POLICY = database.RetryPolicy(base_delay=1, max_delay=5, max_attempts=args.max_attempts)
+
+    save_latencies = []
+    save_post = database.PostManager.save_post
+
+    async def timed_save_post(*a, **kw):
+        started = time.perf_counter()
+        try:
+            return await save_post(*a, **kw)
+        finally:
+            save_latencies.append(time.perf_counter() - started)
+
+    database.PostManager.save_post = timed_save_post
+
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     flood_rate=args.flood_rate, retry_after=args.retry_after)
+    await api.start()
+
+    database.db.path = Path(args.workdir) / "posts.db"
+    main.DELAY_MINUTES = 0
+
+    app = main.create_application(api.base_url)
+    scheduler_task = await main.start_application(app)
+
+    updates = [Update.de_json(data, app.bot) for data in make_updates(args.posts, args.albums, args.album_size)]
+    try:
+        started = time.perf_counter()
+        for update in updates:
+            await app.process_update(update)
+        # handle_message только ставит сообщения в очередь входящих
+        await app.bot_data["updates"].join()
+        ingest_seconds = time.perf_counter() - started
+
+        drained = await wait_drained(database, args.timeout)
+        total_seconds = time.perf_counter() - started
+
+        counts = await database.db.read(
+            lambda conn: dict(conn.execute("SELECT is_processed, COUNT(*) FROM posts GROUP BY is_processed").fetchall())
+        )
+    finally:
+        await main.stop_pipeline(app, scheduler_task)
+        await app.shutdown()
+        database.db.close()
+        await api.stop()
+
+    forwarded = counts.get(database.STATUS_SENT, 0)
+    send_calls = sum(count for method, count in api.calls.items()
+                     if method.startswith(("send", "copy", "forward", "edit")))
+    return {
+        "ingest": {
+            "updates": len(updates),
+            "seconds": round(ingest_seconds, 4),
+            "updates_per_second": round(len(updates) / ingest_seconds, 1) if ingest_seconds else None,
+        },
+        "save_post": latency_summary(save_latencies),
+        "drain": {
+            "completed": drained,
+            "seconds_after_ingest": round(total_seconds - ingest_seconds, 4),
+            "end_to_end_seconds": round(total_seconds, 4),
+        },
+        "posts": {
+            "forwarded": forwarded,
+            "dead_letter": counts.get(database.STATUS_DEAD, 0),
+            "pending": counts.get(database.STATUS_PENDING, 0),
+            "sending": counts.get(database.STATUS_SENDING, 0),
+        },
+        "api": {
+            "calls": dict(api.calls),
+            "failures": dict(api.failures),
+            "send_calls_per_forwarded_post": round(send_calls / forwarded, 3) if forwarded else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=200, help="Одиночных постов")
+    parser.add_argument("--albums", type=int, default=50, help="Альбомов")
+    parser.add_argument("--album-size", type=int, default=4)
+    parser.add_argument("--album-quiet", type=float, default=0.2, help="ALBUM_QUIET_SECONDS, с")
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка ответа Bot API, с")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--update-workers", type=int, default=8, help="UPDATE_WORKERS")
+    parser.add_argument("--dispatch-mode", choices=("send", "copy", "forward"), default="send",
+                        help="DISPATCH_MODE")
+    parser.add_argument("--global-rate", type=float, default=1000, help="GLOBAL_RATE_LIMIT")
+    parser.add_argument("--chat-rate", type=float, default=60000, help="CHAT_RATE_LIMIT")
+    parser.add_argument("--timeout", type=float, default=120, help="Предел ожидания разгрузки, с")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для JSON-результата")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tgbot-bench-") as workdir:
+        args.workdir = workdir
+        # data/ с логом бота создается в текущем каталоге, поэтому работаем во временном
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            results = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "benchmark": "pipeline",
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Бенчмарк запуска бота: импорт main и время до первого getUpdates
+
+Каждое измерение - в отдельном процессе, как при перезапуске контейнера:
+- import: время `import main`, какие тяжелые пакеты он загружает и создает
+  ли что-нибудь в рабочем каталоге (импорт не должен ничего создавать);
+- first_run: от запуска процесса бота до первого getUpdates на локальном
+  Fake Bot API с пустым каталогом (создание базы и все миграции);
+- restarts: то же с уже созданной базой.
+
+Задержка ответа Fake Bot API (--latency) имитирует сеть до api.telegram.org:
+getMe выполняется одновременно с открытием базы, deleteWebhook и
+getUpdates - после.
+
+Запуск: python benchmarks/bench_startup.py --runs 10 --latency 0.1 --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_pipeline import SOURCE_CHAT_ID, TARGET_CHAT_ID, git_revision, latency_summary  # noqa: E402
+
+# Пакеты, которые не нужны для импорта main (только для работы бота)
+HEAVY_MODULES = ("telegram", "httpx", "aiohttp", "dotenv")
+
+IMPORT_PROBE = f"""
+import json, os, sys, time
+started = time.perf_counter()
+import main
+seconds = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": seconds,
+    "loaded": [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+    "created": sorted(os.listdir(".")),
+}}))
+"""
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    env.setdefault("BOT_TOKEN", "123456:bench")
+    env.setdefault("SOURCE_CHANNEL_ID", str(SOURCE_CHAT_ID))
+    env.setdefault("TARGET_CHANNEL_ID", str(TARGET_CHAT_ID))
+    return env
+
+
+def measure_import(runs: int) -> dict:
+    """import main в чистом процессе и пустом каталоге"""
+    seconds = []
+    probe = {}
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="tgbot-import-") as workdir:
+            output = subprocess.check_output([sys.executable, "-c", IMPORT_PROBE], cwd=workdir,
+                                             env=child_env(), text=True)
+        probe = json.loads(output.strip().splitlines()[-1])
+        seconds.append(probe["seconds"])
+    return {
+        "seconds": latency_summary(seconds),
+        "heavy_modules_loaded": probe.get("loaded", []),
+        "files_created": probe.get("created", []),
+    }
+
+
+async def start_once(api, workdir: str, timeout: float) -> dict:
+    """Запускает бота и ждет первого getUpdates; возвращает смещения вызовов API от запуска, в секундах"""
+    api.first_calls.clear()
+    spawned = time.time()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(Path(__file__).resolve()), "--child", api.base_url,
+        cwd=workdir, env=child_env()
+    )
+    try:
+        deadline = time.perf_counter() + timeout
+        while "getUpdates" not in api.first_calls:
+            if process.returncode is not None or time.perf_counter() > deadline:
+                raise RuntimeError(f"Бот не дошел до getUpdates (код выхода {process.returncode})")
+            await asyncio.sleep(0.005)
+        return {method: round(at - spawned, 4) for method, at in api.first_calls.items()}
+    finally:
+        # Штатная остановка: следующий запуск открывает базу без восстановления WAL
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+
+async def run(args) -> dict:
+    from fake_bot_api import FakeBotApi
+
+    results = {"import": measure_import(args.runs)}
+
+    api = FakeBotApi(latency=args.latency)
+    await api.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="tgbot-startup-") as workdir:
+            results["first_run"] = await start_once(api, workdir, args.timeout)
+            restarts = [await start_once(api, workdir, args.timeout) for _ in range(args.runs)]
+    finally:
+        await api.stop()
+
+    results["restarts"] = {
+        method: latency_summary([offsets[method] for offsets in restarts if method in offsets])
+        for method in ("getMe", "deleteWebhook", "getUpdates")
+    }
+    return results
+
+
+def run_child(base_url: str):
+    """Процесс бота: настройки из config.py, прием обновлений - polling без HTTP-серверов"""
+    import main
+
+    main.UPDATE_MODE = "polling"
+    main.WORKER_ROLE = "all"
+    main.METRICS_PORT = 0
+    main.CONFIG_RELOAD_SECONDS = 0
+    main.ROUTES = []
+    try:
+        main.configure()
+        asyncio.run(main.run_bot(base_url))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        main.stop_logging()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Повторов импорта и перезапуска")
+    parser.add_argument("--latency", type=float, default=0.1, help="Задержка ответа Bot API, с")
+    parser.add_argument("--timeout", type=float, default=60, help="Предел ожидания getUpdates, с")
+    parser.add_argument("--output", type=Path, default=None, help="Файл для JSON-результата")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    report = {
+        "benchmark": "startup",
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "child")},
+        "results": asyncio.run(run(args)),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Локальная замена Telegram Bot API для бенчмарков и офлайн-проверок
+
+Отвечает на методы, которые использует бот, с настраиваемой задержкой,
+долей ошибок и ответов 429. Считает вызовы по методам и запоминает время
+первого вызова каждого метода.
+
+Отдельный запуск: python benchmarks/fake_bot_api.py --port 8081 --latency 0.05
+После этого бот подключается с base_url="http://127.0.0.1:8081/bot".
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakeBotApi:
+    """Минимальный Bot API: getMe, send*, sendMediaGroup, copy/forwardMessages, edit*, deleteMessages, webhook, getUpdates"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 flood_rate: float = 0.0, retry_after: int = 1, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        # Метод -> time.time() первого вызова (например, первого getUpdates после запуска бота)
+        self.first_calls: Dict[str, float] = {}
+        self.failures: Counter = Counter()
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        """Параметры запроса: JSON или форма, где сложные значения закодированы в JSON"""
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "channel", "title": "target"},
+            **fields
+        }
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    def _error(self, method: str, code: int, description: str, **parameters) -> web.Response:
+        self.failures[method] += 1
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        self.first_calls.setdefault(method, time.time())
+        params = await self._params(request)
+
+        if method == "getUpdates":
+            await asyncio.sleep(min(float(params.get("timeout") or 0), 1.0))
+            return self._ok([])
+
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if method == "getMe":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method in ("setWebhook", "deleteWebhook"):
+            return self._ok(True)
+
+        roll = self._random.random()
+        if roll < self.flood_rate:
+            return self._error(method, 429, f"Too Many Requests: retry after {self.retry_after}",
+                               retry_after=self.retry_after)
+        if roll < self.flood_rate + self.error_rate:
+            return self._error(method, 400, "Bad Request: wrong file identifier/HTTP URL specified")
+
+        chat_id = params.get("chat_id", 0)
+        if method == "sendMediaGroup":
+            return self._ok([self._message(chat_id) for _ in params.get("media", [])])
+        if method in ("copyMessages", "forwardMessages"):
+            return self._ok([{"message_id": next(self._message_ids)} for _ in params.get("message_ids", [])])
+        if method in ("deleteMessage", "deleteMessages"):
+            return self._ok(True)
+        if method.startswith("edit"):
+            return self._ok(self._message(chat_id, message_id=params.get("message_id")))
+        if method.startswith("send") or method.startswith("copy") or method.startswith("forward"):
+            return self._ok(self._message(chat_id))
+        return self._error(method, 404, "Not Found: method not found")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        server = web.Application()
+        server.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(args):
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     flood_rate=args.flood_rate, retry_after=args.retry_after)
+    await api.start(port=args.port)
+    print(f"Fake Bot API: {api.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        print(dict(api.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 400")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Индекс подписей постов источников: поиск по истории и повторная проверка ключевых слов
+
+    python main.py search куртка            # последние посты со словом (подстрокой) в подписи
+    python main.py search --forwarded куртк мужск
+    python main.py rematch --hours 72       # поставить в очередь посты под текущие ключевые слова
+    python main.py rematch --route men --dry-run
+
+В индекс попадают все посты исходных каналов, в том числе не прошедшие
+фильтр, и хранятся CAPTION_INDEX_DAYS дней. Поиск идет по подстрокам без
+учета регистра, как у ключевых слов; слова короче 3 символов не ищутся.
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import PostManager
+from dedup import ContentDeduplicator, content_fingerprints
+from metrics import MESSAGES_TOTAL
+
+
+logger = logging.getLogger(__name__)
+
+# Токенизатор trigram не находит подстроки короче 3 символов
+MIN_TERM_LENGTH = 3
+
+# Каждая N-я запись в индекс заодно удаляет из него посты старше срока хранения
+PRUNE_EVERY = 1000
+
+
+def fts_query(terms: Iterable[str], operator: str = "OR") -> str:
+    """Запрос FTS5: каждое слово ищется как подстрока, слова объединяются operator"""
+    return f" {operator} ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+class CaptionIndex:
+    """Запись постов источников в индекс подписей с ограниченным сроком хранения"""
+
+    def __init__(self, retention_seconds: int):
+        self.retention = retention_seconds
+        self._writes = 0
+
+    async def add(self, messages: List, route):
+        """Индексирует пост (одиночное сообщение, альбом или опоздавшие части альбома)"""
+        # Первая запись после запуска тоже чистит индекс: запуски бывают чаще PRUNE_EVERY постов
+        before = int(time.time()) - self.retention if self._writes % PRUNE_EVERY == 0 else 0
+        self._writes += 1
+        await PostManager.index_source(messages, route, before)
+
+
+async def rematch(route, since: int, dry_run: bool = False, dedup: Optional[ContentDeduplicator] = None
+                  ) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """Ставит в очередь посты источника маршрута после since, подходящие под его ключевые слова
+
+    Кандидаты выбираются одним запросом к полнотекстовому индексу, а целые
+    слова и исключения проверяет тот же матчер, что и при приеме. Уже
+    сохраненные посты пропускаются, повторы (dedup) - тоже, как при приеме.
+    Возвращает id найденных постов источника и (id, due_at) созданных записей.
+    """
+    keywords = {keyword.strip() for keyword in route.matcher.spec[0] if keyword.strip()}
+    short = sorted(keyword for keyword in keywords if len(keyword) < MIN_TERM_LENGTH)
+    if short:
+        logger.warning("Маршрут %s: ключевые слова %s короче %d символов и по индексу не ищутся",
+                       route.name, short, MIN_TERM_LENGTH)
+    terms = sorted(keyword for keyword in keywords if len(keyword) >= MIN_TERM_LENGTH)
+    if not terms:
+        return [], []
+
+    candidates = await PostManager.find_sources(route.name, fts_query(terms), since)
+    matched = []
+    duplicates = 0
+    for source_id, caption, file_unique_ids in candidates:
+        if not route.matcher.match(caption):
+            continue
+        # Повтор, подавленный при приеме, не сохранялся в posts: отсеивается по отпечаткам
+        post_fingerprints = content_fingerprints((file_unique_ids or "").split(), caption)
+        if dedup is not None and await dedup.is_duplicate(route.name, post_fingerprints, remember=not dry_run):
+            duplicates += 1
+            continue
+        matched.append(source_id)
+    if duplicates:
+        logger.info("Маршрут %s: по индексу подписей пропущено повторов: %d", route.name, duplicates)
+        if not dry_run:
+            MESSAGES_TOTAL.inc(duplicates, route=route.name, result="duplicate")
+    if dry_run or not matched:
+        return matched, []
+
+    created = await PostManager.enqueue_sources(matched, route)
+    MESSAGES_TOTAL.inc(len(matched), route=route.name, result="rematched")
+    logger.info("Маршрут %s: по индексу подписей найдено %d новых постов, создано записей: %d",
+                route.name, len(matched), len(created))
+    return matched, created
+
+
+def format_time(at: int) -> str:
+    return datetime.fromtimestamp(at, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+async def run_search(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="main.py search", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("terms", nargs="+", help="Слова (подстроки), которые должны быть в подписи")
+    parser.add_argument("--route", default=None, help="Только посты маршрута")
+    parser.add_argument("--forwarded", action="store_true", help="Только пересланные посты")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    short = [term for term in args.terms if len(term) < MIN_TERM_LENGTH]
+    if short:
+        parser.error(f"слова короче {MIN_TERM_LENGTH} символов не ищутся: {short}")
+
+    rows = await PostManager.search_sources(fts_query(args.terms, "AND"), args.route, args.forwarded, args.limit)
+    print(f"{'received':<16} {'route':<12} {'message':>9} {'state':<8} {'forwarded':>9}  caption")
+    for _, route, message_id, received_at, snippet, sent, forwarded in rows:
+        state = "skipped" if sent is None else "sent" if sent else "saved"
+        print(f"{format_time(received_at):<16} {route:<12.12} {message_id:>9} {state:<8} "
+              f"{forwarded or '-':>9}  {' '.join((snippet or '').split())}")
+    if len(rows) == args.limit:
+        print(f"... показаны первые {args.limit}")
+
+
+async def run_rematch(argv: List[str], routes: Dict[str, object], dedup_window_seconds: int = 0):
+    parser = argparse.ArgumentParser(prog="main.py rematch", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=72, help="Период по времени получения поста")
+    parser.add_argument("--route", action="append", default=None, help="Маршрут (можно несколько)")
+    parser.add_argument("--dry-run", action="store_true", help="Только показать, сколько постов найдется")
+    args = parser.parse_args(argv)
+
+    unknown = sorted(set(args.route or ()) - set(routes))
+    if unknown:
+        parser.error(f"маршруты {unknown} не заданы в config.py")
+    since = int(time.time() - args.hours * 3600)
+    dedup = None
+    if dedup_window_seconds:
+        # Те же отпечатки content_seen, что у работающего бота
+        dedup = ContentDeduplicator(dedup_window_seconds)
+        await dedup.load()
+    try:
+        for name in args.route or sorted(routes):
+            matched, created = await rematch(routes[name], since, dry_run=args.dry_run, dedup=dedup)
+            print(f"{name}: подходит {len(matched)} постов, поставлено в очередь записей: {len(created)}")
+    finally:
+        if dedup is not None:
+            await dedup.close()
@@ -0,0 +1,72 @@
+import asyncio
+import importlib.util
+import logging
+import os
+from pathlib import Path
+from types import ModuleType
+from typing import Awaitable, Callable, Optional, Tuple
+
+from metrics import CONFIG_RELOADS_TOTAL
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_config(path: Path) -> ModuleType:
+    """Исполняет config.py в новом модуле, не трогая уже загруженный config"""
+    spec = importlib.util.spec_from_file_location("config_reloaded", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ConfigWatcher:
+    """Следит за config.py по mtime и передает новую версию в on_change
+
+    Файл проверяется одним stat раз в interval секунд. Новая версия
+    исполняется в отдельном модуле; если она не загрузилась или on_change
+    отклонил ее (исключением), продолжает работать прежняя. Повторно та же
+    версия файла не загружается.
+    """
+
+    def __init__(self, path: Path, on_change: Callable[[ModuleType], Awaitable[None]], interval: float = 5):
+        self.path = Path(path)
+        self.interval = interval
+        self._on_change = on_change
+        self._version = self._stat()
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    async def check(self) -> bool:
+        """Загружает файл, если он изменился; True - новая версия применена"""
+        version = self._stat()
+        if version is None or version == self._version:
+            return False
+        self._version = version
+        try:
+            module = load_config(self.path)
+            await self._on_change(module)
+        except Exception as e:
+            logger.error(f"Новый {self.path.name} отклонен, работают прежние настройки: "
+                         f"{type(e).__name__}: {str(e)}")
+            CONFIG_RELOADS_TOTAL.inc(result="rejected")
+            return False
+        CONFIG_RELOADS_TOTAL.inc(result="applied")
+        return True
+
+    async def run(self):
+        """Фоновая задача: периодическая проверка файла"""
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                await self.check()
+            except asyncio.CancelledError:
+                logger.info("Слежение за настройками остановлено")
+                break
+            except Exception as e:
+                logger.error(f"Ошибка проверки настроек: {type(e).__name__}: {str(e)}", exc_info=True)
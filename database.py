@@ -0,0 +1,1715 @@
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import pytz
+
+from metrics import DB_SECONDS, DB_COMMIT_BATCH
+
+
+logger = logging.getLogger(__name__)
+
+# Настройка data
+db_path = Path("data") / "posts.db"
+archive_path = Path("data") / "posts_archive.db"
+
+
+# Значения posts.is_processed
+STATUS_PENDING = 0
+STATUS_SENT = 1
+STATUS_DEAD = 2  # Dead letter: исчерпаны попытки отправки или отправка не подтверждена
+STATUS_SENDING = 3  # Захвачен воркером на время отправки (claimed_by, lease_until)
+
+# События трассы поста в post_events
+EVENT_RECEIVED = 1  # Время публикации в исходном канале (для альбома - первой части)
+EVENT_SAVED = 2
+EVENT_DUE = 3       # Запланированное время отправки (новое - при смене задержки маршрута)
+EVENT_CLAIMED = 4   # Начало попытки отправки
+EVENT_SENT = 5
+EVENT_FAILED = 6    # Неудачная попытка или истекшая аренда
+EVENT_NAMES = {
+    EVENT_RECEIVED: "received",
+    EVENT_SAVED: "saved",
+    EVENT_DUE: "due",
+    EVENT_CLAIMED: "claimed",
+    EVENT_SENT: "sent",
+    EVENT_FAILED: "failed",
+}
+
+# Попытки записать отправленный пост: без записи он уйдет в dead letter после аренды
+MARK_PROCESSED_ATTEMPTS = 3
+
+
+class RetryPolicy(NamedTuple):
+    """Экспоненциальный backoff для неудачных отправок"""
+    base_delay: int
+    max_delay: int
+    max_attempts: int
+
+    def delay(self, attempts: int, retry_after: Optional[float] = None) -> int:
+        """Пауза перед следующей попыткой; retry_after от сервера имеет приоритет"""
+        delay = min(self.max_delay, self.base_delay * 2 ** max(attempts - 1, 0))
+        if retry_after:
+            delay = max(delay, int(retry_after) + 1)
+        return delay
+
+
+class Media(NamedTuple):
+    """Элемент поста из post_media"""
+    media_type: str               # photo, video, document, audio, animation
+    file_id: str
+    file_unique_id: Optional[str] = None
+    message_id: Optional[int] = None
+
+
+class DuePost(NamedTuple):
+    """Пост, готовый к отправке"""
+    id: int
+    route: str
+    target_chat_id: Optional[int]
+    original_message_id: Optional[int]
+    media_group_id: Optional[str]
+    caption: str
+    caption_message_id: Optional[int]     # Исходное сообщение, в котором была подпись
+    caption_entities: Optional[str]       # JSON-список MessageEntity подписи
+    post_date: str
+    created_at: Optional[int]
+    due_at: int
+    media: Tuple[Media, ...]
+
+
+class PostCopy(NamedTuple):
+    """Отправленная копия поста, которую нужно поправить вслед за исходным сообщением"""
+    post_id: int
+    route: str
+    target_chat_id: Optional[int]
+    caption_message_id: Optional[int]     # Сообщение в целевом чате с подписью поста
+    message_id: Optional[int]             # Копия измененного сообщения; None - неизвестна
+    caption: str                          # Подпись поста после правки
+    caption_entities: Optional[str]
+    has_media: bool
+    caption_changed: bool
+    media: Optional[Media]                # Новое медиа сообщения, если файл заменен
+
+
+class RetentionPolicy(NamedTuple):
+    """Хранение отправленных постов и постов из dead letter"""
+    days: int                     # Сколько дней строки остаются в posts после due_at
+    archive: Optional[Path]       # Файл архива; None - строки просто удаляются
+    batch_size: int = 500         # Строк в одной транзакции
+    vacuum_pages: int = 1000      # Страниц, возвращаемых за один incremental_vacuum
+
+
+# SQL-запросы держим константами: sqlite3 кэширует подготовленные
+# выражения по тексту запроса для каждого подключения
+SQL_CREATE_POSTS = '''
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        original_message_id INTEGER,
+        media_group_id TEXT,
+        file_ids TEXT,
+        caption TEXT,
+        post_date TEXT,
+        is_processed INTEGER DEFAULT 0,
+        forwarded_message_id INTEGER
+    )
+'''
+
+SQL_CREATE_POST_MEDIA = '''
+    CREATE TABLE post_media (
+        post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        media_type TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        file_unique_id TEXT,
+        message_id INTEGER,
+        PRIMARY KEY (post_id, position)
+    ) WITHOUT ROWID
+'''
+
+# Трасса: одна строка на событие, время в миллисекундах. Строки поста лежат рядом
+# (первичный ключ), отправленные за период ищутся по idx_post_events_at
+SQL_CREATE_POST_EVENTS = '''
+    CREATE TABLE post_events (
+        post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+        event INTEGER NOT NULL,
+        at INTEGER NOT NULL,
+        PRIMARY KEY (post_id, event, at)
+    ) WITHOUT ROWID
+'''
+
+# Исходные сообщения поста (все элементы альбома) и их копии в целевом чате.
+# Первичный ключ - индекс по id исходного сообщения: правка или удаление находит
+# все записи поста одним поиском. message_id заполняется при отправке
+SQL_CREATE_POST_MESSAGES = '''
+    CREATE TABLE post_messages (
+        source_message_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+        message_id INTEGER,
+        PRIMARY KEY (source_message_id, post_id)
+    ) WITHOUT ROWID
+'''
+
+# Исходные сообщения поста: по одному на элемент медиа, у текстового поста - само сообщение
+SQL_LINK_POST_MESSAGES = '''
+    INSERT OR IGNORE INTO post_messages (source_message_id, post_id)
+    SELECT message_id, post_id FROM post_media WHERE post_id = ? AND message_id IS NOT NULL
+    UNION ALL
+    SELECT original_message_id, id FROM posts
+    WHERE id = ? AND original_message_id IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM post_media WHERE post_id = posts.id)
+'''
+
+SQL_SET_COPY = 'UPDATE post_messages SET message_id = ? WHERE source_message_id = ? AND post_id = ?'
+
+# Записи маршрута с исходным сообщением: поиск по первичному ключу post_messages,
+# элемент альбома - по первичному ключу post_media
+SQL_SELECT_COPIES = '''
+    SELECT p.id, p.target_chat_id, p.is_processed, p.caption, p.caption_message_id,
+           p.original_message_id, p.forwarded_message_id, c.message_id, m.position, m.file_unique_id,
+           EXISTS (SELECT 1 FROM post_media WHERE post_id = p.id), p.caption_entities, p.media_group_id
+    FROM post_messages c
+    JOIN posts p ON p.id = c.post_id
+    LEFT JOIN post_media m ON m.post_id = p.id AND m.message_id = c.source_message_id
+    WHERE c.source_message_id = ? AND p.route = ?
+'''
+
+# Подпись и медиа поста после отправки: сравниваются с отправленным снимком
+SQL_SELECT_SENT_CONTENT = '''
+    SELECT p.caption, p.caption_entities, m.media_type, m.file_id, m.file_unique_id, m.message_id
+    FROM posts p
+    LEFT JOIN post_media m ON m.post_id = p.id
+    WHERE p.id = ?
+    ORDER BY m.position
+'''
+
+SQL_UPDATE_POST_CAPTION = '''
+    UPDATE posts SET caption = ?, caption_message_id = ?, caption_entities = ?
+    WHERE id = ?
+'''
+
+SQL_REPLACE_MEDIA = '''
+    UPDATE post_media SET media_type = ?, file_id = ?, file_unique_id = ?
+    WHERE post_id = ? AND position = ?
+'''
+
+SQL_UPDATE_SOURCE_EDIT = '''
+    UPDATE source_posts SET caption = ?, caption_entities = ?
+    WHERE route = ? AND media_group_id = ? AND caption_message_id = ?
+'''
+
+SQL_REPLACE_SOURCE_MEDIA = '''
+    UPDATE source_media SET media_type = ?, file_id = ?, file_unique_id = ?
+    WHERE source_id = (SELECT id FROM source_posts WHERE route = ? AND media_group_id = ?) AND message_id = ?
+'''
+
+SQL_DELETE_POST_MESSAGE = 'DELETE FROM post_messages WHERE source_message_id = ? AND post_id = ?'
+
+SQL_DELETE_MEDIA_MESSAGE = 'DELETE FROM post_media WHERE post_id = ? AND message_id = ?'
+
+# Пост без исходных сообщений удаляется целиком (медиа и трасса - каскадом)
+SQL_DELETE_EMPTY_POST = '''
+    DELETE FROM posts
+    WHERE id = ? AND NOT EXISTS (SELECT 1 FROM post_messages WHERE post_id = ?)
+'''
+
+SQL_DELETE_SOURCE_MESSAGE = '''
+    DELETE FROM source_media
+    WHERE source_id = (SELECT id FROM source_posts WHERE route = ? AND media_group_id = ?) AND message_id = ?
+'''
+
+SQL_DELETE_SOURCE_POST = '''
+    DELETE FROM source_posts
+    WHERE route = ? AND media_group_id = ? AND NOT EXISTS (SELECT 1 FROM source_media WHERE source_id = source_posts.id)
+'''
+
+SQL_INSERT_EVENT = 'INSERT OR IGNORE INTO post_events (post_id, event, at) VALUES (?, ?, ?)'
+
+SQL_SELECT_GROUP = '''
+    SELECT id, caption FROM posts
+    WHERE route = ? AND target_chat_id = ? AND media_group_id = ?
+'''
+
+SQL_UPDATE_CAPTION = '''
+    UPDATE posts SET caption = ?, caption_message_id = ?, caption_entities = ?
+    WHERE id = ?
+'''
+
+SQL_INSERT_POST = '''
+    INSERT INTO posts
+    (route, target_chat_id, original_message_id, media_group_id, caption,
+     caption_message_id, caption_entities, post_date, created_at, due_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SQL_SELECT_MEDIA_IDS = 'SELECT file_id FROM post_media WHERE post_id = ?'
+
+SQL_INSERT_MEDIA = '''
+    INSERT INTO post_media
+    (post_id, position, media_type, file_id, file_unique_id, message_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Страница наступивших постов по ключу (due_at, id) > последнего выданного:
+# диапазонный поиск по индексу idx_posts_due (id в нем - хвост ключа), без OFFSET.
+# Медиа подтягиваются тем же запросом по первичному ключу post_media
+SQL_SELECT_DUE_PAGE = '''
+    SELECT
+        p.id,
+        p.route,
+        p.target_chat_id,
+        p.original_message_id,
+        p.media_group_id,
+        p.caption,
+        p.caption_message_id,
+        p.caption_entities,
+        p.post_date,
+        p.created_at,
+        p.due_at,
+        m.media_type,
+        m.file_id,
+        m.file_unique_id,
+        m.message_id
+    FROM (
+        SELECT id, route, target_chat_id, original_message_id, media_group_id, caption,
+               caption_message_id, caption_entities, post_date, created_at, due_at
+        FROM posts
+        WHERE is_processed = 0 AND due_at <= ?
+        AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+        AND (due_at, id) > (?, ?)
+        ORDER BY due_at, id
+        LIMIT ?
+    ) p
+    LEFT JOIN post_media m ON m.post_id = p.id
+    ORDER BY p.due_at, p.id, m.position
+'''
+
+# Новая задержка маршрута для ожидающих постов; строки маршрута ищутся по idx_posts_group
+# Посты в backoff ждут своей попытки; новое время - не в прошлом
+SQL_RESCHEDULE_ROUTE = '''
+    UPDATE posts SET due_at = MAX(created_at + ?, ?)
+    WHERE route = ? AND is_processed = 0 AND created_at IS NOT NULL AND next_attempt_at IS NULL
+'''
+
+SQL_TRACE_RESCHEDULED = '''
+    INSERT OR IGNORE INTO post_events (post_id, event, at)
+    SELECT id, 3, due_at * 1000 FROM posts
+    WHERE route = ? AND is_processed = 0 AND created_at IS NOT NULL AND next_attempt_at IS NULL
+'''
+
+# Этапы отправленных за период постов: одна строка на пост, события агрегируются
+# по первичному ключу post_events; тип медиа - по первичному ключу post_media
+SQL_SELECT_TRACES = '''
+    SELECT
+        s.post_id,
+        p.route,
+        (SELECT CASE COUNT(*) WHEN 0 THEN 'text' WHEN 1 THEN MIN(media_type) ELSE 'album' END
+         FROM post_media WHERE post_id = s.post_id),
+        MIN(CASE WHEN e.event = 1 THEN e.at END),
+        MIN(CASE WHEN e.event = 2 THEN e.at END),
+        MAX(CASE WHEN e.event = 3 THEN e.at END),
+        MIN(CASE WHEN e.event = 4 THEN e.at END),
+        MAX(CASE WHEN e.event = 4 THEN e.at END),
+        s.at,
+        SUM(e.event = 6)
+    FROM post_events s
+    JOIN posts p ON p.id = s.post_id
+    JOIN post_events e ON e.post_id = s.post_id
+    WHERE s.event = 5 AND s.at >= ?
+    GROUP BY s.post_id
+'''
+
+SQL_SELECT_POST_EVENTS = 'SELECT event, at FROM post_events WHERE post_id = ? ORDER BY at, event'
+
+SQL_SELECT_POST = '''
+    SELECT id, route, target_chat_id, media_group_id, is_processed, attempts, last_error,
+           forwarded_message_id, claimed_by
+    FROM posts WHERE id = ?
+'''
+
+# Ожидающие и отправляемые посты по индексу idx_posts_due
+SQL_SELECT_PENDING = '''
+    SELECT id, route, media_group_id, is_processed, due_at, next_attempt_at, attempts, last_error, claimed_by
+    FROM posts
+    WHERE is_processed IN (0, 3)
+    ORDER BY is_processed, due_at
+    LIMIT ?
+'''
+
+SQL_SELECT_SCHEDULE = '''
+    SELECT MAX(due_at, COALESCE(next_attempt_at, 0)), id
+    FROM posts
+    WHERE is_processed = 0
+'''
+
+# Счетчики для метрик: по индексу idx_posts_due, отправленные строки не читаются
+SQL_COUNT_STATES = '''
+    SELECT is_processed, COUNT(*), COALESCE(SUM(next_attempt_at > ?), 0)
+    FROM posts
+    WHERE is_processed IN (0, 2, 3)
+    GROUP BY is_processed
+'''
+
+# Устаревшие строки выбираются по индексу idx_posts_due; одна транзакция - одна пачка
+SQL_SELECT_EXPIRED = '''
+    SELECT id FROM main.posts
+    WHERE is_processed IN (1, 2) AND due_at < ?
+    ORDER BY is_processed, due_at
+    LIMIT ?
+'''
+
+# Медиа удаляются каскадно (PRAGMA foreign_keys=ON)
+SQL_DELETE_EXPIRED = f'DELETE FROM main.posts WHERE id IN ({SQL_SELECT_EXPIRED})'
+
+# Таблицы, переносимые в архив: (таблица, таблица архива, колонка id поста, уникальный ключ)
+ARCHIVE_TABLES = (
+    ("posts", "posts_archive", "id", "id"),
+    ("post_media", "post_media_archive", "post_id", "post_id, position"),
+    ("post_events", "post_events_archive", "post_id", "post_id, event, at"),
+    ("post_messages", "post_messages_archive", "post_id", "source_message_id, post_id"),
+)
+
+# Отпечатки уже сохраненного содержимого (file_unique_id, хэш текста) по маршрутам
+SQL_CREATE_CONTENT_SEEN = '''
+    CREATE TABLE content_seen (
+        route TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        seen_at INTEGER NOT NULL,
+        PRIMARY KEY (route, fingerprint)
+    ) WITHOUT ROWID
+'''
+
+SQL_SELECT_SEEN = 'SELECT seen_at FROM content_seen WHERE route = ? AND fingerprint = ? AND seen_at >= ?'
+
+SQL_SELECT_SEEN_SINCE = '''
+    SELECT route, fingerprint, seen_at FROM content_seen
+    WHERE seen_at >= ?
+    ORDER BY seen_at DESC
+    LIMIT ?
+'''
+
+SQL_UPSERT_SEEN = '''
+    INSERT INTO content_seen (route, fingerprint, seen_at) VALUES (?, ?, ?)
+    ON CONFLICT (route, fingerprint) DO UPDATE SET seen_at = excluded.seen_at
+'''
+
+SQL_DELETE_SEEN_BEFORE = 'DELETE FROM content_seen WHERE seen_at < ?'
+
+# Индекс подписей всех постов исходных каналов, в том числе не прошедших фильтр:
+# по нему находятся старые посты для новых ключевых слов и ищется история.
+# Пост источника - одиночное сообщение или альбом целиком, медиа - как в post_media
+SQL_CREATE_SOURCE_POSTS = '''
+    CREATE TABLE source_posts (
+        id INTEGER PRIMARY KEY,
+        route TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        media_group_id TEXT NOT NULL,
+        caption TEXT,
+        caption_message_id INTEGER,
+        caption_entities TEXT,
+        received_at INTEGER NOT NULL
+    )
+'''
+
+SQL_CREATE_SOURCE_MEDIA = '''
+    CREATE TABLE source_media (
+        source_id INTEGER NOT NULL REFERENCES source_posts(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        media_type TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        file_unique_id TEXT,
+        message_id INTEGER,
+        PRIMARY KEY (source_id, position)
+    ) WITHOUT ROWID
+'''
+
+# Полнотекстовый индекс поверх source_posts (external content). Токенизатор trigram
+# ищет подстроки без учета регистра - так же, как ключевые слова в KeywordMatcher
+SQL_CREATE_SOURCE_FTS = '''
+    CREATE VIRTUAL TABLE source_fts USING fts5(
+        caption, content='source_posts', content_rowid='id', tokenize='trigram'
+    )
+'''
+
+# Триггеры держат source_fts в согласии с source_posts
+SQL_CREATE_SOURCE_TRIGGERS = (
+    '''
+    CREATE TRIGGER source_posts_ai AFTER INSERT ON source_posts BEGIN
+        INSERT INTO source_fts (rowid, caption) VALUES (new.id, new.caption);
+    END
+    ''',
+    '''
+    CREATE TRIGGER source_posts_ad AFTER DELETE ON source_posts BEGIN
+        INSERT INTO source_fts (source_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+    END
+    ''',
+    '''
+    CREATE TRIGGER source_posts_au AFTER UPDATE OF caption ON source_posts BEGIN
+        INSERT INTO source_fts (source_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+        INSERT INTO source_fts (rowid, caption) VALUES (new.id, new.caption);
+    END
+    ''',
+)
+
+SQL_SELECT_SOURCE = 'SELECT id, caption FROM source_posts WHERE route = ? AND media_group_id = ?'
+
+SQL_INSERT_SOURCE = '''
+    INSERT INTO source_posts
+    (route, message_id, media_group_id, caption, caption_message_id, caption_entities, received_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+SQL_UPDATE_SOURCE_CAPTION = '''
+    UPDATE source_posts SET caption = ?, caption_message_id = ?, caption_entities = ?
+    WHERE id = ?
+'''
+
+SQL_SELECT_SOURCE_MEDIA_IDS = 'SELECT file_id FROM source_media WHERE source_id = ?'
+
+SQL_INSERT_SOURCE_MEDIA = '''
+    INSERT INTO source_media
+    (source_id, position, media_type, file_id, file_unique_id, message_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Медиа и полнотекстовый индекс удаляются триггером и каскадом
+SQL_DELETE_SOURCES_BEFORE = 'DELETE FROM source_posts WHERE received_at < ?'
+
+# Посты источника маршрута, подходящие под запрос FTS и еще не сохраненные в posts.
+# Кандидаты выбираются индексом source_fts, наличие в posts - по idx_posts_source
+SQL_SELECT_SOURCE_MATCHES = '''
+    SELECT s.id, s.caption,
+           (SELECT group_concat(file_unique_id, ' ') FROM source_media WHERE source_id = s.id)
+    FROM source_fts
+    JOIN source_posts s ON s.id = source_fts.rowid
+    WHERE source_fts MATCH ? AND s.route = ? AND s.received_at >= ?
+    AND NOT EXISTS (SELECT 1 FROM posts p WHERE p.route = s.route AND p.media_group_id = s.media_group_id)
+    ORDER BY s.received_at
+'''
+
+# Пост источника ставится в очередь так же, как при сохранении: запись на целевой канал.
+# Уже существующая запись (idx_posts_group) пропускается
+SQL_ENQUEUE_SOURCE = '''
+    INSERT OR IGNORE INTO posts
+    (route, target_chat_id, original_message_id, media_group_id, caption,
+     caption_message_id, caption_entities, post_date, created_at, due_at)
+    SELECT route, ?, message_id, media_group_id, caption, caption_message_id, caption_entities, ?, ?,
+           MAX(received_at + ?, ?)
+    FROM source_posts WHERE id = ?
+'''
+
+SQL_ENQUEUE_SOURCE_MEDIA = '''
+    INSERT INTO post_media (post_id, position, media_type, file_id, file_unique_id, message_id)
+    SELECT ?, position, media_type, file_id, file_unique_id, message_id
+    FROM source_media WHERE source_id = ?
+'''
+
+SQL_SELECT_SOURCE_TIMES = '''
+    SELECT p.due_at, s.received_at FROM posts p, source_posts s
+    WHERE p.id = ? AND s.id = ?
+'''
+
+# Поиск по истории: самые свежие совпадения и судьба каждого поста в posts
+# (отправлен, ожидает, пропущен фильтром); posts ищутся по idx_posts_source
+SQL_SEARCH_SOURCES = '''
+    SELECT s.id, s.route, s.message_id, s.received_at,
+           snippet(source_fts, 0, '[', ']', '...', 64),
+           (SELECT MAX(p.is_processed = 1) FROM posts p
+            WHERE p.route = s.route AND p.media_group_id = s.media_group_id),
+           (SELECT MAX(p.forwarded_message_id) FROM posts p
+            WHERE p.route = s.route AND p.media_group_id = s.media_group_id)
+    FROM source_fts
+    JOIN source_posts s ON s.id = source_fts.rowid
+    WHERE source_fts MATCH ? AND (? IS NULL OR s.route = ?)
+    AND (? = 0 OR EXISTS (SELECT 1 FROM posts p
+                          WHERE p.route = s.route AND p.media_group_id = s.media_group_id AND p.is_processed = 1))
+    ORDER BY s.received_at DESC
+    LIMIT ?
+'''
+
+# Захват поста перед отправкой: одно UPDATE с условием на статус атомарно и между
+# процессами, поэтому из нескольких воркеров пост достается только одному
+SQL_CLAIM = '''
+    UPDATE posts
+    SET is_processed = 3, claimed_by = ?, lease_until = ?
+    WHERE id = ? AND is_processed = 0
+'''
+
+# Аренды воркеров, упавших во время отправки; выбираются по индексу idx_posts_due
+SQL_SELECT_EXPIRED_LEASES = '''
+    SELECT due_at, id FROM posts
+    WHERE is_processed = 3 AND (lease_until < ? OR claimed_by = ?)
+'''
+
+SQL_SELECT_ATTEMPTS = 'SELECT attempts FROM posts WHERE id = ? AND is_processed = 3'
+
+SQL_MARK_FAILED = '''
+    UPDATE posts
+    SET attempts = ?, next_attempt_at = ?, last_error = ?, is_processed = ?,
+        claimed_by = NULL, lease_until = NULL
+    WHERE id = ?
+'''
+
+# Захваченный пост сразу в dead letter (например, его маршрут удален из config.py
+# или его аренда истекла, и неизвестно, дошла ли отправка)
+SQL_MARK_DEAD = '''
+    UPDATE posts
+    SET is_processed = 2, last_error = ?, next_attempt_at = NULL, claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND is_processed = 3
+'''
+
+# Отправленный пост отмечается, даже если его аренда истекла и он уже в dead letter
+SQL_MARK_PROCESSED = '''
+    UPDATE posts
+    SET is_processed = 1, forwarded_message_id = ?, next_attempt_at = NULL,
+        claimed_by = NULL, lease_until = NULL
+    WHERE id = ? AND (is_processed IN (0, 3) OR is_processed = 2 AND last_error = 'LeaseExpired')
+'''
+
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class WriteRequest(NamedTuple):
+    fn: Callable
+    args: tuple
+    future: asyncio.Future
+    exclusive: bool
+
+
+# Сигнал потоку записи: закоммитить очередь и завершиться
+_STOP = object()
+
+
+class Database:
+    """Долгоживущие подключения к SQLite: один поток записи и пул потоков чтения
+
+    Все запросы выполняются вне event loop, поэтому fsync и блокировки
+    базы не останавливают polling и отправку постов.
+
+    Записи копятся в очереди, и поток записи коммитит их пачками (group
+    commit): до batch_size операций, ожидая новые не дольше commit_delay
+    секунд. Каждая операция выполняется в своем SAVEPOINT, поэтому ошибка
+    одной не откатывает соседние. Future вызывающего завершается после
+    коммита всей пачки, и один fsync приходится на пачку, а не на пост.
+    """
+
+    def __init__(self, path: Path, readers: int = 2, batch_size: int = 100, commit_delay: float = 0.002):
+        self.path = Path(path)
+        self.readers = readers
+        self.batch_size = batch_size
+        self.commit_delay = commit_delay
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+        self._reader: Optional[ThreadPoolExecutor] = None
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        """Открывает подключение с настройками, которые задаются один раз"""
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Коммит пачки переживает и сбой питания; fsync на пачку, а не на каждый пост
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA foreign_keys=ON")     # Включить внешние ключи
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _init_thread(self, read_only: bool):
+        """Создает подключение, закрепленное за потоком"""
+        conn = self._connect(read_only)
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+
+    def _call(self, fn: Callable, *args):
+        return fn(self._local.conn, *args)
+
+    def _run_writer(self):
+        """Поток записи: забирает операции из очереди и коммитит их пачками"""
+        self._init_thread(False)
+        conn = self._local.conn
+        carry = None
+        while True:
+            request = carry if carry is not None else self._queue.get()
+            carry = None
+            if request is _STOP:
+                break
+            if request.exclusive:
+                self._run_exclusive(conn, request)
+                continue
+
+            batch = [request]
+            deadline = time.monotonic() + self.commit_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is _STOP or request.exclusive:
+                    carry = request  # Выполнится после коммита пачки
+                    break
+                batch.append(request)
+            self._commit_batch(conn, batch)
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: List[WriteRequest]):
+        results = []
+        try:
+            conn.execute("BEGIN")
+            for request in batch:
+                conn.execute("SAVEPOINT batch_item")
+                try:
+                    results.append((request.future, request.fn(conn, *request.args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO batch_item")
+                    results.append((request.future, None, e))
+                conn.execute("RELEASE batch_item")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(request.future, None, e) for request in batch]
+        self._resolve(results, batch=True)
+
+    def _run_exclusive(self, conn: sqlite3.Connection, request: WriteRequest):
+        """Операция вне пачки, в своей транзакции (схема, ATTACH, VACUUM, checkpoint)"""
+        try:
+            with conn:  # commit при успехе, rollback при исключении
+                result = (request.future, request.fn(conn, *request.args), None)
+        except Exception as e:
+            result = (request.future, None, e)
+        self._resolve([result], batch=False)
+
+    def _resolve(self, results: List[Tuple[asyncio.Future, Any, Optional[Exception]]], batch: bool):
+        """Передает результаты в event loop одним вызовом на пачку"""
+        try:
+            self._loop.call_soon_threadsafe(self._set_results, results, batch)
+        except RuntimeError:
+            pass  # Цикл уже закрыт: ждать результатов некому
+
+    @staticmethod
+    def _set_results(results: List[Tuple[asyncio.Future, Any, Optional[Exception]]], batch: bool):
+        if batch:
+            DB_COMMIT_BATCH.observe(len(results))
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _prepare_file(self):
+        """Создает файл базы и выставляет режимы, которые хранятся в самом файле"""
+        self.path.parent.mkdir(exist_ok=True)
+
+        # journal_mode=WAL и auto_vacuum сохраняются в файле базы, достаточно выставить один раз
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")  # Улучшенная производительность
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                # Существующую базу переводит в новый режим только полный VACUUM (однократно)
+                started = time.perf_counter()
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                logger.info("Включен incremental vacuum, VACUUM занял %.1f с", time.perf_counter() - started)
+        finally:
+            conn.close()
+
+    async def open(self, schema: Callable, *args):
+        """Запускает поток записи и пул чтения и применяет схему
+
+        Вся работа с файлом идет вне event loop, поэтому открытие базы и
+        миграции могут выполняться одновременно с сетевыми запросами.
+        """
+        await asyncio.to_thread(self._prepare_file)
+
+        self._loop = asyncio.get_running_loop()
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._run_writer, name="db-writer", daemon=True)
+        self._writer.start()
+        self._reader = ThreadPoolExecutor(
+            max_workers=self.readers, thread_name_prefix="db-reader",
+            initializer=self._init_thread, initargs=(True,)
+        )
+        await self.write_exclusive(schema, *args)
+
+    async def read(self, fn: Callable, *args):
+        """Выполняет fn(conn, *args) в потоке чтения"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, self._call, fn, *args)
+
+    def _submit(self, fn: Callable, args: tuple, exclusive: bool) -> asyncio.Future:
+        if self._queue is None:
+            raise RuntimeError("База данных не открыта")
+        future = self._loop.create_future()
+        self._queue.put(WriteRequest(fn, args, future, exclusive))
+        return future
+
+    async def write(self, fn: Callable, *args):
+        """Выполняет fn(conn, *args) в потоке записи; возвращает результат после коммита
+
+        fn выполняется внутри общей транзакции пачки и не должен сам вызывать commit.
+        """
+        return await self._submit(fn, args, exclusive=False)
+
+    async def write_exclusive(self, fn: Callable, *args):
+        """Выполняет fn(conn, *args) отдельно от пачек, в собственной транзакции
+
+        Для операций, которые нельзя выполнять внутри транзакции: ATTACH,
+        VACUUM, контрольные точки WAL, миграции со своими BEGIN/COMMIT.
+        """
+        return await self._submit(fn, args, exclusive=True)
+
+    async def flush(self):
+        """Дожидается коммита всех записей, поставленных в очередь до вызова"""
+        if self._queue is not None:
+            await self.write(lambda conn: None)
+
+    def size(self) -> int:
+        """Размер файла базы вместе с WAL в байтах"""
+        return sum(path.stat().st_size for path in (self.path, self.path.with_name(self.path.name + "-wal"))
+                   if path.exists())
+
+    def close(self):
+        """Коммитит очередь записи, дожидается запросов и закрывает подключения"""
+        if self._writer:
+            self._queue.put(_STOP)
+            self._writer.join()
+        if self._reader:
+            self._reader.shutdown(wait=True)
+        self._writer = self._reader = self._queue = None
+
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+def _migrate_due_at(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 1: целочисленные created_at/due_at и индексы вместо strftime"""
+    conn.execute("ALTER TABLE posts ADD COLUMN created_at INTEGER")
+    conn.execute("ALTER TABLE posts ADD COLUMN due_at INTEGER")
+    conn.execute("UPDATE posts SET created_at = CAST(strftime('%s', post_date) AS INTEGER)")
+    conn.execute("UPDATE posts SET due_at = created_at + ?", (delay_seconds,))
+
+    # Перед уникальным индексом сливаем дубли одной медиагруппы в самую раннюю запись
+    duplicates = conn.execute('''
+        SELECT media_group_id FROM posts
+        GROUP BY media_group_id
+        HAVING COUNT(*) > 1
+    ''').fetchall()
+    for (media_group_id,) in duplicates:
+        rows = conn.execute(
+            'SELECT id, file_ids, caption FROM posts WHERE media_group_id = ? ORDER BY id',
+            (media_group_id,)
+        ).fetchall()
+        file_ids = []
+        caption = None
+        for _, file_ids_json, row_caption in rows:
+            for file_id in json.loads(file_ids_json) if file_ids_json else []:
+                if file_id not in file_ids:
+                    file_ids.append(file_id)
+            caption = caption or row_caption
+        conn.execute('UPDATE posts SET file_ids = ?, caption = ? WHERE id = ?',
+                     (json.dumps(file_ids), caption, rows[0][0]))
+        conn.execute('DELETE FROM posts WHERE media_group_id = ? AND id != ?',
+                     (media_group_id, rows[0][0]))
+
+    conn.execute("CREATE INDEX idx_posts_due ON posts(is_processed, due_at)")
+    conn.execute("CREATE UNIQUE INDEX idx_posts_media_group ON posts(media_group_id)")
+
+
+def _migrate_retry_state(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 2: состояние повторных попыток отправки"""
+    conn.execute("ALTER TABLE posts ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE posts ADD COLUMN next_attempt_at INTEGER")
+    conn.execute("ALTER TABLE posts ADD COLUMN last_error TEXT")
+
+
+def _migrate_routes(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 3: маршрут и целевой канал у каждой записи
+
+    Записи, созданные до маршрутов, относятся к маршруту default; пустой
+    target_chat_id означает первый целевой канал маршрута.
+    """
+    conn.execute("ALTER TABLE posts ADD COLUMN route TEXT NOT NULL DEFAULT 'default'")
+    conn.execute("ALTER TABLE posts ADD COLUMN target_chat_id INTEGER")
+    conn.execute("DROP INDEX idx_posts_media_group")
+    conn.execute("CREATE UNIQUE INDEX idx_posts_group ON posts(route, target_chat_id, media_group_id)")
+
+
+# Медиа старых записей: тип известен только по префиксу file_id
+LEGACY_MEDIA_PREFIXES = {
+    "AgAC": "photo",
+    "BAAC": "video",
+    "BQAC": "document",
+    "CQAC": "audio",
+}
+
+
+def _migrate_post_media(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 4: медиа в таблице post_media с явным типом вместо JSON в file_ids"""
+    conn.execute(SQL_CREATE_POST_MEDIA)
+    unknown = 0
+    rows = conn.execute("SELECT id, file_ids FROM posts WHERE file_ids IS NOT NULL").fetchall()
+    for post_id, file_ids_json in rows:
+        try:
+            file_ids = json.loads(file_ids_json)
+        except json.JSONDecodeError:
+            file_ids = []
+        for position, file_id in enumerate(file_ids):
+            media_type = LEGACY_MEDIA_PREFIXES.get(file_id[:4])
+            if media_type is None:
+                media_type = "unknown"
+                unknown += 1
+            conn.execute(SQL_INSERT_MEDIA, (post_id, position, media_type, file_id, None, None))
+    if unknown:
+        logger.warning("post_media: у %d файлов старых записей тип не определен, они не будут отправлены",
+                       unknown)
+
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        conn.execute("ALTER TABLE posts DROP COLUMN file_ids")
+    else:
+        conn.execute("UPDATE posts SET file_ids = NULL")
+
+
+def _migrate_content_seen(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 5: отпечатки содержимого для подавления повторов"""
+    conn.execute(SQL_CREATE_CONTENT_SEEN)
+    conn.execute("CREATE INDEX idx_content_seen_at ON content_seen(seen_at)")
+
+
+def _migrate_caption_source(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 6: сообщение с подписью и ее форматирование для copyMessages
+
+    У старых записей колонки пустые: подпись дописывается к первому
+    скопированному сообщению без исходного форматирования.
+    """
+    conn.execute("ALTER TABLE posts ADD COLUMN caption_message_id INTEGER")
+    conn.execute("ALTER TABLE posts ADD COLUMN caption_entities TEXT")
+
+
+def _migrate_leases(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 7: захват постов воркерами на время отправки"""
+    conn.execute("ALTER TABLE posts ADD COLUMN claimed_by TEXT")
+    conn.execute("ALTER TABLE posts ADD COLUMN lease_until INTEGER")
+
+
+def _migrate_post_events(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 8: трасса этапов поста для отчета о задержках"""
+    conn.execute(SQL_CREATE_POST_EVENTS)
+    conn.execute("CREATE INDEX idx_post_events_at ON post_events(event, at)")
+
+
+def _migrate_source_index(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 9: полнотекстовый индекс подписей постов источников
+
+    Индекс заполняется с момента обновления: в posts есть только прошедшие
+    фильтр посты и нет канала-источника, поэтому прошлое не переносится.
+    """
+    conn.execute(SQL_CREATE_SOURCE_POSTS)
+    conn.execute("CREATE UNIQUE INDEX idx_source_posts_group ON source_posts(route, media_group_id)")
+    conn.execute("CREATE INDEX idx_source_posts_received ON source_posts(received_at)")
+    conn.execute(SQL_CREATE_SOURCE_MEDIA)
+    conn.execute(SQL_CREATE_SOURCE_FTS)
+    for trigger in SQL_CREATE_SOURCE_TRIGGERS:
+        conn.execute(trigger)
+    conn.execute("CREATE INDEX idx_posts_source ON posts(route, media_group_id)")
+
+
+def _migrate_post_messages(conn: sqlite3.Connection, delay_seconds: int):
+    """Версия 10: исходные сообщения постов и их копии для правок и удалений
+
+    Копии заполняются для отправленных постов из одного сообщения; у старых
+    альбомов известна только копия первого элемента, и их правки не переносятся.
+    """
+    conn.execute(SQL_CREATE_POST_MESSAGES)
+    # Для каскадного удаления и архива по id поста
+    conn.execute("CREATE INDEX idx_post_messages_post ON post_messages(post_id)")
+    conn.execute('''
+        INSERT OR IGNORE INTO post_messages (source_message_id, post_id)
+        SELECT message_id, post_id FROM post_media WHERE message_id IS NOT NULL
+    ''')
+    conn.execute('''
+        INSERT OR IGNORE INTO post_messages (source_message_id, post_id)
+        SELECT original_message_id, id FROM posts
+        WHERE original_message_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM post_media WHERE post_id = posts.id)
+    ''')
+    conn.execute('''
+        UPDATE post_messages SET message_id = (SELECT forwarded_message_id FROM posts WHERE id = post_id)
+        WHERE post_id IN (SELECT post_id FROM post_messages GROUP BY post_id HAVING COUNT(*) = 1)
+    ''')
+
+
+# Миграции применяются по порядку, номер версии хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migrate_due_at,
+    _migrate_retry_state,
+    _migrate_routes,
+    _migrate_post_media,
+    _migrate_content_seen,
+    _migrate_caption_source,
+    _migrate_leases,
+    _migrate_post_events,
+    _migrate_source_index,
+    _migrate_post_messages,
+]
+
+
+def init_db(conn: sqlite3.Connection, delay_seconds: int):
+    """Инициализация базы данных и миграция схемы на месте"""
+    conn.execute(SQL_CREATE_POSTS)
+    conn.commit()
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        migration(conn, delay_seconds)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+        logger.info(f"Схема базы обновлена до версии {number}")
+
+
+db = Database(db_path)
+
+
+def _extract_media(message) -> Optional[Media]:
+    """Возвращает медиа сообщения с его типом"""
+    if message.photo:
+        media_type, attachment = "photo", message.photo[-1]
+    elif message.video:
+        media_type, attachment = "video", message.video
+    elif message.animation:  # У GIF заполнен и document, поэтому проверяем раньше
+        media_type, attachment = "animation", message.animation
+    elif message.document:
+        media_type, attachment = "document", message.document
+    elif message.audio:
+        media_type, attachment = "audio", message.audio
+    else:
+        return None
+    return Media(media_type, attachment.file_id, attachment.file_unique_id, message.message_id)
+
+
+def _extract_caption(messages: List) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """Подпись поста: первая непустая подпись или текст среди его сообщений
+
+    Возвращает (подпись, id сообщения с подписью, ее entities в JSON).
+    """
+    for message in messages:
+        if message.caption or message.text:
+            entities = message.caption_entities if message.caption else message.entities
+            entities_json = json.dumps([entity.to_dict() for entity in entities]) if entities else None
+            return message.caption or message.text, message.message_id, entities_json
+    # У одиночного поста подпись всегда строка, у части альбома ее может не быть
+    return ("" if not messages[0].media_group_id else None), None, None
+
+
+def _save_post(conn: sqlite3.Connection, route: str, targets: Tuple[int, ...], message_id: int,
+               media_group_id: str, new_media: List[Media], caption: Optional[str],
+               delay_seconds: int, caption_message_id: Optional[int] = None,
+               caption_entities: Optional[str] = None,
+               received_at: Optional[float] = None) -> Tuple[int, List[Tuple[int, int]]]:
+    """Сохраняет пост для каждого целевого канала маршрута
+
+    Возвращает итоговое число медиа в посте и (id, due_at) созданных записей.
+    """
+    cursor = conn.cursor()
+    now = datetime.now(pytz.utc)
+    created_at = int(now.timestamp())
+    due_at = created_at + delay_seconds
+
+    created = []
+    media_count = len(new_media)
+    for target_chat_id in targets:
+        # Проверяем существующую запись (часть альбома, пришедшая после сохранения группы)
+        cursor.execute(SQL_SELECT_GROUP, (route, target_chat_id, media_group_id))
+        existing = cursor.fetchone()
+
+        if existing:
+            # Дописываем новые элементы в конец альбома
+            post_id, existing_caption = existing
+            file_ids = [row[0] for row in cursor.execute(SQL_SELECT_MEDIA_IDS, (post_id,))]
+            media = [item for item in new_media if item.file_id not in file_ids]
+            position = len(file_ids)
+            media_count = position + len(media)
+
+            # Обновляем caption только если его еще нет
+            if not existing_caption and caption:
+                cursor.execute(SQL_UPDATE_CAPTION, (caption, caption_message_id, caption_entities, post_id))
+        else:
+            # Создаем новую запись
+            cursor.execute(SQL_INSERT_POST, (
+                route,
+                target_chat_id,
+                message_id,
+                media_group_id,
+                caption,
+                caption_message_id,
+                caption_entities,
+                now.strftime('%Y-%m-%d %H:%M:%S'),
+                created_at,
+                due_at
+            ))
+            post_id = cursor.lastrowid
+            media = new_media
+            position = 0
+            created.append((post_id, due_at))
+            saved_at = int(now.timestamp() * 1000)
+            cursor.executemany(SQL_INSERT_EVENT, [
+                (post_id, EVENT_RECEIVED, int(received_at * 1000) if received_at else saved_at),
+                (post_id, EVENT_SAVED, saved_at),
+                (post_id, EVENT_DUE, saved_at + delay_seconds * 1000),
+            ])
+
+        cursor.executemany(SQL_INSERT_MEDIA, [
+            (post_id, position + index, item.media_type, item.file_id, item.file_unique_id, item.message_id)
+            for index, item in enumerate(media)
+        ])
+        cursor.execute(SQL_LINK_POST_MESSAGES, (post_id, post_id))
+
+    return media_count, created
+
+
+def _index_source(conn: sqlite3.Connection, route: str, message_id: int, media_group_id: str,
+                  new_media: List[Media], caption: Optional[str], caption_message_id: Optional[int],
+                  caption_entities: Optional[str], received_at: int, before: int):
+    """Добавляет пост источника в индекс подписей; части альбома дописываются к нему"""
+    existing = conn.execute(SQL_SELECT_SOURCE, (route, media_group_id)).fetchone()
+    if existing:
+        source_id, existing_caption = existing
+        file_ids = [row[0] for row in conn.execute(SQL_SELECT_SOURCE_MEDIA_IDS, (source_id,))]
+        media = [item for item in new_media if item.file_id not in file_ids]
+        position = len(file_ids)
+        if not existing_caption and caption:
+            conn.execute(SQL_UPDATE_SOURCE_CAPTION, (caption, caption_message_id, caption_entities, source_id))
+    else:
+        source_id = conn.execute(SQL_INSERT_SOURCE, (
+            route, message_id, media_group_id, caption, caption_message_id, caption_entities, received_at
+        )).lastrowid
+        media = new_media
+        position = 0
+
+    conn.executemany(SQL_INSERT_SOURCE_MEDIA, [
+        (source_id, position + index, item.media_type, item.file_id, item.file_unique_id, item.message_id)
+        for index, item in enumerate(media)
+    ])
+    if before:
+        conn.execute(SQL_DELETE_SOURCES_BEFORE, (before,))
+
+
+def _enqueue_sources(conn: sqlite3.Connection, source_ids: List[int], targets: Tuple[int, ...],
+                     delay_seconds: int) -> List[Tuple[int, int]]:
+    """Ставит посты источника в очередь отправки; возвращает (id, due_at) созданных записей
+
+    Время отправки - как если бы пост прошел фильтр при получении, но не раньше текущего.
+    """
+    now = datetime.now(pytz.utc)
+    created_at = int(now.timestamp())
+    saved_at = int(now.timestamp() * 1000)
+    created = []
+    for source_id in source_ids:
+        for target_chat_id in targets:
+            cursor = conn.execute(SQL_ENQUEUE_SOURCE, (
+                target_chat_id, now.strftime('%Y-%m-%d %H:%M:%S'), created_at, delay_seconds, created_at,
+                source_id
+            ))
+            if not cursor.rowcount:
+                continue
+            post_id = cursor.lastrowid
+            conn.execute(SQL_ENQUEUE_SOURCE_MEDIA, (post_id, source_id))
+            conn.execute(SQL_LINK_POST_MESSAGES, (post_id, post_id))
+            due_at, received_at = conn.execute(SQL_SELECT_SOURCE_TIMES, (post_id, source_id)).fetchone()
+            conn.executemany(SQL_INSERT_EVENT, [
+                (post_id, EVENT_RECEIVED, received_at * 1000),
+                (post_id, EVENT_SAVED, saved_at),
+                (post_id, EVENT_DUE, due_at * 1000),
+            ])
+            created.append((post_id, due_at))
+    return created
+
+
+def _get_due_page(conn: sqlite3.Connection, now: int, after: Tuple[int, int], limit: int) -> List[DuePost]:
+    posts = []
+    current = None
+    # Строки одного поста идут подряд: по одной на элемент медиа (или одна без медиа)
+    for row in conn.execute(SQL_SELECT_DUE_PAGE, (now, now, *after, limit)):
+        media_type, file_id, file_unique_id, message_id = row[11:]
+        if current is None or current.id != row[0]:
+            current = DuePost(*row[:11], media=[])
+            posts.append(current)
+        if file_id is not None:
+            current.media.append(Media(media_type, file_id, file_unique_id, message_id))
+    return [post._replace(caption=post.caption or "", media=tuple(post.media)) for post in posts]
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _mark_as_processed(conn: sqlite3.Connection, post_id: int, forwarded_message_id: Optional[int],
+                       copies: Sequence[Tuple[int, int]] = (), sent: Optional[DuePost] = None) -> List[PostCopy]:
+    """Отмечает пост отправленным
+
+    sent - снимок поста, с которого собрана отправка. Правки, пришедшие после его
+    чтения из очереди (пост ждал в диспетчере или уже отправлялся), изменили только
+    запись: они возвращаются копиями, которые нужно поправить в целевом чате.
+    """
+    if not conn.execute(SQL_MARK_PROCESSED, (forwarded_message_id, post_id)).rowcount:
+        return []
+    conn.execute(SQL_INSERT_EVENT, (post_id, EVENT_SENT, _now_ms()))
+    conn.executemany(SQL_SET_COPY, [(message_id, source_message_id, post_id)
+                                    for source_message_id, message_id in copies])
+    if sent is None:
+        return []
+    return _edits_after_send(conn, sent, forwarded_message_id, dict(copies))
+
+
+def _edits_after_send(conn: sqlite3.Connection, sent: DuePost, forwarded_message_id: Optional[int],
+                      copies: Dict[int, int]) -> List[PostCopy]:
+    rows = conn.execute(SQL_SELECT_SENT_CONTENT, (sent.id,)).fetchall()
+    caption, caption_entities = rows[0][0] or "", rows[0][1]
+    caption_changed = caption != sent.caption or caption_entities != sent.caption_entities
+    edits = []
+    for item, (_, _, media_type, file_id, file_unique_id, message_id) in zip(sent.media, rows):
+        copy_id = copies.get(message_id)
+        if file_id is None or item.file_unique_id == file_unique_id or copy_id is None:
+            continue
+        # Замена файла в сообщении с подписью передает и подпись
+        edits.append(PostCopy(
+            sent.id, sent.route, sent.target_chat_id, forwarded_message_id, copy_id, caption, caption_entities,
+            True, caption_changed and copy_id == forwarded_message_id,
+            Media(media_type, file_id, file_unique_id, message_id)
+        ))
+    if caption_changed and not any(edit.caption_changed for edit in edits):
+        edits.append(PostCopy(
+            sent.id, sent.route, sent.target_chat_id, forwarded_message_id, None, caption, caption_entities,
+            rows[0][3] is not None, True, None
+        ))
+    return edits
+
+
+def _claim(conn: sqlite3.Connection, post_ids: List[int], worker_id: str, lease_until: int) -> List[int]:
+    claimed = [post_id for post_id in post_ids
+               if conn.execute(SQL_CLAIM, (worker_id, lease_until, post_id)).rowcount]
+    at = _now_ms()
+    conn.executemany(SQL_INSERT_EVENT, [(post_id, EVENT_CLAIMED, at) for post_id in claimed])
+    return claimed
+
+
+def _reclaim_expired(conn: sqlite3.Connection, now: int, worker_id: str) -> List[int]:
+    expired = [post_id for _, post_id in conn.execute(SQL_SELECT_EXPIRED_LEASES, (now, worker_id))]
+    _mark_as_dead(conn, expired, "LeaseExpired")
+    return expired
+
+
+def _mark_as_failed(conn: sqlite3.Connection, post_id: int, error_name: str,
+                    retry_after: Optional[float], policy: RetryPolicy) -> Tuple[Optional[int], Optional[int]]:
+    """Возвращает (новый статус, время следующей попытки); статус None - пост уже не захвачен"""
+    row = conn.execute(SQL_SELECT_ATTEMPTS, (post_id,)).fetchone()
+    if row is None:
+        return None, None
+
+    conn.execute(SQL_INSERT_EVENT, (post_id, EVENT_FAILED, _now_ms()))
+    # Flood wait - не вина поста, такая попытка не засчитывается
+    attempts = row[0] if retry_after else row[0] + 1
+    if attempts >= policy.max_attempts:
+        conn.execute(SQL_MARK_FAILED, (attempts, None, error_name, STATUS_DEAD, post_id))
+        return STATUS_DEAD, None
+
+    next_attempt_at = int(time.time()) + policy.delay(attempts, retry_after)
+    conn.execute(SQL_MARK_FAILED, (attempts, next_attempt_at, error_name, STATUS_PENDING, post_id))
+    return STATUS_PENDING, next_attempt_at
+
+
+def _mark_as_dead(conn: sqlite3.Connection, post_ids: List[int], reason: str) -> int:
+    at = _now_ms()
+    dead = [post_id for post_id in post_ids if conn.execute(SQL_MARK_DEAD, (reason, post_id)).rowcount]
+    conn.executemany(SQL_INSERT_EVENT, [(post_id, EVENT_FAILED, at) for post_id in dead])
+    return len(dead)
+
+
+def _apply_edit(conn: sqlite3.Connection, route: str, media_group_id: str, message_id: int,
+                media: Optional[Media], caption: Optional[str], caption_entities: Optional[str]
+                ) -> Tuple[int, List[PostCopy]]:
+    """Переносит правку исходного сообщения в записи маршрута и индекс подписей
+
+    Неотправленные записи меняются на месте. Возвращает их число и копии
+    отправленных постов, которые нужно поправить в целевых чатах. Пост, который
+    уже отправляется, получит правку после отправки (см. _mark_as_processed).
+    """
+    updated = 0
+    copies = []
+    for (post_id, target_chat_id, status, old_caption, caption_message_id, original_message_id,
+         forwarded_message_id, copy_id, position, file_unique_id, has_media, old_entities, _) in conn.execute(
+            SQL_SELECT_COPIES, (message_id, route)).fetchall():
+        # Подпись поста - в сообщении caption_message_id (у старых записей - в первом)
+        holds_caption = (caption_message_id == message_id or
+                         caption_message_id is None and (message_id == original_message_id or not old_caption))
+        caption_changed = holds_caption and (caption or "") != (old_caption or "")
+        media_changed = (media is not None and position is not None and
+                         media.file_unique_id != file_unique_id)
+        if not caption_changed and not media_changed:
+            continue
+
+        if caption_changed:
+            conn.execute(SQL_UPDATE_POST_CAPTION, (caption, message_id, caption_entities, post_id))
+        if media_changed:
+            conn.execute(SQL_REPLACE_MEDIA, (media.media_type, media.file_id, media.file_unique_id,
+                                             post_id, position))
+        if status == STATUS_SENT:
+            copies.append(PostCopy(
+                post_id, route, target_chat_id, forwarded_message_id, copy_id,
+                (caption if caption_changed else old_caption) or "",
+                caption_entities if caption_changed else old_entities,
+                bool(has_media), caption_changed, media if media_changed else None
+            ))
+        else:
+            updated += 1
+
+    conn.execute(SQL_UPDATE_SOURCE_EDIT, (caption, caption_entities, route, media_group_id, message_id))
+    if media is not None:
+        conn.execute(SQL_REPLACE_SOURCE_MEDIA, (media.media_type, media.file_id, media.file_unique_id,
+                                                route, media_group_id, message_id))
+    return updated, copies
+
+
+def _apply_delete(conn: sqlite3.Connection, route: str, message_id: int) -> Tuple[int, List[Tuple[int, int]]]:
+    """Убирает удаленное исходное сообщение из неотправленных записей и индекса подписей
+
+    Запись, у которой не осталось исходных сообщений, удаляется. Возвращает
+    число измененных записей и (target_chat_id, message_id) копий в целевых чатах.
+    """
+    updated = 0
+    copies = []
+    # Группа поста в индексе подписей; у одиночного сообщения - его id
+    groups = {str(message_id)}
+    for post_id, target_chat_id, status, *_, copy_id, position, _, _, _, media_group_id in conn.execute(
+            SQL_SELECT_COPIES, (message_id, route)).fetchall():
+        groups.add(media_group_id)
+        if status == STATUS_SENT:
+            if copy_id is not None:
+                copies.append((target_chat_id, copy_id))
+            continue
+        if status == STATUS_SENDING:
+            # Отправка уже идет: копию можно будет удалить только повторной командой
+            logger.warning("Пост %s отправляется, удаление сообщения %s пропущено", post_id, message_id)
+            continue
+        conn.execute(SQL_DELETE_POST_MESSAGE, (message_id, post_id))
+        if position is not None:
+            conn.execute(SQL_DELETE_MEDIA_MESSAGE, (post_id, message_id))
+        conn.execute(SQL_DELETE_EMPTY_POST, (post_id, post_id))
+        updated += 1
+
+    for media_group_id in groups:
+        conn.execute(SQL_DELETE_SOURCE_MESSAGE, (route, media_group_id, message_id))
+        conn.execute(SQL_DELETE_SOURCE_POST, (route, media_group_id))
+    return updated, copies
+
+
+def _count_states(conn: sqlite3.Connection, now: int) -> Dict[str, int]:
+    counts = {'pending': 0, 'backoff': 0, 'sending': 0, 'dead': 0}
+    for status, total, in_backoff in conn.execute(SQL_COUNT_STATES, (now,)):
+        if status == STATUS_DEAD:
+            counts['dead'] = total
+        elif status == STATUS_SENDING:
+            counts['sending'] = total
+        else:
+            counts['pending'] = total - in_backoff
+            counts['backoff'] = in_backoff
+    return counts
+
+
+def _archive_table(conn: sqlite3.Connection, table: str, archive_table: str,
+                   post_column: str, unique_key: str) -> str:
+    """Готовит таблицу архива; возвращает INSERT для переноса устаревших строк
+
+    Таблица архива повторяет колонки исходной: новые колонки после миграций
+    добавляются в нее автоматически.
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+    archived = {row[1] for row in conn.execute(f"PRAGMA archive.table_info({archive_table})")}
+    if not archived:
+        conn.execute(f"CREATE TABLE archive.{archive_table} AS SELECT * FROM main.{table} WHERE 0")
+        conn.execute(f"ALTER TABLE archive.{archive_table} ADD COLUMN archived_at INTEGER")
+        # Если сбой пришелся между коммитами двух файлов, повторный перенос не создаст дублей
+        conn.execute(f"CREATE UNIQUE INDEX archive.idx_{archive_table}_key ON {archive_table}({unique_key})")
+    else:
+        for column in columns:
+            if column not in archived:
+                conn.execute(f"ALTER TABLE archive.{archive_table} ADD COLUMN {column}")
+
+    column_list = ", ".join(columns)
+    return f'''
+        INSERT OR IGNORE INTO archive.{archive_table} ({column_list}, archived_at)
+        SELECT {column_list}, ? FROM main.{table} WHERE {post_column} IN ({SQL_SELECT_EXPIRED})
+    '''
+
+
+def _attach_archive(conn: sqlite3.Connection, path: Path) -> List[str]:
+    """Подключает файл архива к соединению записи; возвращает INSERT для каждой таблицы"""
+    if "archive" not in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        conn.execute("ATTACH DATABASE ? AS archive", (str(path),))
+        conn.execute("PRAGMA archive.journal_mode=WAL")
+    return [_archive_table(conn, *spec) for spec in ARCHIVE_TABLES]
+
+
+def _archive_batch(conn: sqlite3.Connection, cutoff: int, policy: RetentionPolicy) -> int:
+    """Переносит (или удаляет) одну пачку устаревших строк; возвращает их число"""
+    if policy.archive is not None:
+        archived_at = int(time.time())
+        for insert in _attach_archive(conn, policy.archive):
+            conn.execute(insert, (archived_at, cutoff, policy.batch_size))
+    return conn.execute(SQL_DELETE_EXPIRED, (cutoff, policy.batch_size)).rowcount
+
+
+def _compact(conn: sqlite3.Connection, pages: int) -> Tuple[int, int]:
+    """Возвращает свободные страницы файлу и сбрасывает WAL
+
+    Выполняется вне транзакции; возвращает (свободных страниц, непереписанных кадров WAL).
+    """
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return free_pages, max(0, log_frames - checkpointed) if busy else 0
+
+
+def _find_seen(conn: sqlite3.Connection, route: str, fingerprints: List[str], since: int) -> Dict[str, int]:
+    found = {}
+    for fingerprint in fingerprints:
+        row = conn.execute(SQL_SELECT_SEEN, (route, fingerprint, since)).fetchone()
+        if row:
+            found[fingerprint] = row[0]
+    return found
+
+
+def _remember_seen(conn: sqlite3.Connection, route: str, fingerprints: List[str], seen_at: int, before: int):
+    conn.executemany(SQL_UPSERT_SEEN, [(route, fingerprint, seen_at) for fingerprint in fingerprints])
+    if before:
+        conn.execute(SQL_DELETE_SEEN_BEFORE, (before,))
+
+
+def _reschedule_route(conn: sqlite3.Connection, route: str, delay_seconds: int) -> int:
+    rescheduled = conn.execute(SQL_RESCHEDULE_ROUTE, (delay_seconds, int(time.time()), route)).rowcount
+    conn.execute(SQL_TRACE_RESCHEDULED, (route,))
+    return rescheduled
+
+
+def _fetch_all(conn: sqlite3.Connection, sql: str, *params) -> List[tuple]:
+    return conn.execute(sql, params).fetchall()
+
+
+class PostManager:
+    @staticmethod
+    async def clear_db():
+        """Очищает базу данных (только для тестов!)"""
+        try:
+            await db.write(lambda conn: conn.execute('DELETE FROM posts'))
+            logger.warning("База данных очищена!")
+        except Exception as e:
+            logger.error(f"Ошибка очистки БД: {type(e).__name__}: {str(e)}", exc_info=True)
+
+    @staticmethod
+    async def save_post(messages: List, route) -> List[Tuple[int, int]]:
+        """Сохраняет пост (одиночное сообщение или собранный альбом) одной транзакцией
+
+        Для каждого целевого канала маршрута создается своя запись.
+        Возвращает (id, due_at) созданных записей.
+        """
+        first = messages[0]
+        try:
+            media_group_id = first.media_group_id or str(first.message_id)
+
+            # Порядок элементов альбома - по message_id
+            messages = sorted(messages, key=lambda message: message.message_id)
+            media = [item for item in map(_extract_media, messages) if item]
+            caption, caption_message_id, caption_entities = _extract_caption(messages)
+            received_at = min(message.date for message in messages).timestamp()
+
+            with DB_SECONDS.time(operation="save_post"):
+                media_count, created = await db.write(_save_post, route.name, route.targets,
+                                                      messages[0].message_id, media_group_id, media,
+                                                      caption, route.delay_minutes * 60,
+                                                      caption_message_id, caption_entities, received_at)
+            logger.info("Сохранен пост %s, маршрут %s, группа %s, файлов: %d, caption: '%s'",
+                        messages[0].message_id, route.name, media_group_id, media_count, caption)
+            return created
+
+        except Exception as e:
+            logger.error(f"Ошибка сохранения поста {first.message_id}: "
+                         f"{type(e).__name__}: {str(e)}", exc_info=True)
+            return []
+
+    @staticmethod
+    async def index_source(messages: List, route, before: int = 0):
+        """Добавляет пост источника в индекс подписей; before - заодно удалить записи старше"""
+        first = messages[0]
+        try:
+            messages = sorted(messages, key=lambda message: message.message_id)
+            media = [item for item in map(_extract_media, messages) if item]
+            caption, caption_message_id, caption_entities = _extract_caption(messages)
+            received_at = int(min(message.date for message in messages).timestamp())
+
+            with DB_SECONDS.time(operation="index_source"):
+                await db.write(_index_source, route.name, messages[0].message_id,
+                               first.media_group_id or str(first.message_id), media,
+                               caption, caption_message_id, caption_entities, received_at, before)
+        except Exception as e:
+            logger.error(f"Ошибка индексации поста {first.message_id}: "
+                         f"{type(e).__name__}: {str(e)}", exc_info=True)
+
+    @staticmethod
+    async def find_sources(route: str, query: str, since: int) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        """(id, подпись, file_unique_id файлов через пробел) постов источника маршрута после since,
+        подходящих под запрос FTS
+
+        Посты, уже сохраненные для отправки, не возвращаются.
+        """
+        with DB_SECONDS.time(operation="find_sources"):
+            return await db.read(_fetch_all, SQL_SELECT_SOURCE_MATCHES, query, route, since)
+
+    @staticmethod
+    async def enqueue_sources(source_ids: List[int], route) -> List[Tuple[int, int]]:
+        """Ставит посты источника в очередь отправки маршрута; возвращает (id, due_at) записей"""
+        return await db.write(_enqueue_sources, source_ids, route.targets, route.delay_minutes * 60)
+
+    @staticmethod
+    async def search_sources(query: str, route: Optional[str], forwarded_only: bool, limit: int) -> List[tuple]:
+        """Поиск по индексу подписей, самые свежие совпадения первыми
+
+        Строка: (id, route, message_id, received_at, фрагмент подписи,
+        отправлен ли пост - None, если он не прошел фильтр, id пересланного сообщения).
+        """
+        return await db.read(_fetch_all, SQL_SEARCH_SOURCES, query, route, route, int(forwarded_only), limit)
+
+    @staticmethod
+    async def apply_edit(message, route) -> Tuple[int, List[PostCopy]]:
+        """Переносит правку исходного сообщения в базу
+
+        Возвращает число измененных неотправленных записей и копии
+        отправленных постов, которые нужно поправить в целевых чатах.
+        """
+        caption, _, caption_entities = _extract_caption([message])
+        with DB_SECONDS.time(operation="apply_edit"):
+            return await db.write(_apply_edit, route.name, message.media_group_id or str(message.message_id),
+                                  message.message_id, _extract_media(message), caption, caption_entities)
+
+    @staticmethod
+    async def apply_delete(route, message_ids: List[int]) -> Tuple[int, List[Tuple[int, int]]]:
+        """Убирает удаленные исходные сообщения из неотправленных записей
+
+        Возвращает число измененных записей и (target_chat_id, message_id) копий
+        отправленных постов.
+        """
+        updated = 0
+        copies = []
+        for message_id in message_ids:
+            count, found = await db.write(_apply_delete, route.name, message_id)
+            updated += count
+            copies.extend(found)
+        return updated, copies
+
+    @staticmethod
+    async def iter_due_posts(page_size: int = 100) -> AsyncIterator[DuePost]:
+        """Необработанные посты, время отправки которых наступило, страницами по page_size
+
+        Следующая страница читается, только когда выдана предыдущая, поэтому
+        в памяти не больше одной страницы при любом размере очереди. Посты,
+        ставшие due после начала обхода, достанутся следующему вызову.
+        Ошибка чтения передается вызывающему: планировщик повторит проход.
+        """
+        now = int(time.time())
+        after = (-1, -1)
+        while True:
+            with DB_SECONDS.time(operation="due_page"):
+                page = await db.read(_get_due_page, now, after, page_size)
+            for post in page:
+                yield post
+            if len(page) < page_size:
+                return
+            after = (page[-1].due_at, page[-1].id)
+
+    @staticmethod
+    async def get_schedule() -> List[Tuple[int, str]]:
+        """Возвращает (due_at, id) всех необработанных постов"""
+        return await db.read(_fetch_all, SQL_SELECT_SCHEDULE)
+
+    @staticmethod
+    async def claim(post_ids: List[int], worker_id: str, lease_seconds: int) -> List[int]:
+        """Захватывает посты для отправки; возвращает id тех, что достались этому воркеру
+
+        Захват коммитится до возврата, поэтому пост, захваченный здесь, не
+        отправит ни один другой процесс, пока не истечет аренда.
+        """
+        return await db.write(_claim, post_ids, worker_id, int(time.time()) + lease_seconds)
+
+    @staticmethod
+    async def reclaim_expired(worker_id: str = "") -> List[int]:
+        """Снимает аренду с постов, захваченных упавшим воркером или прежним запуском worker_id
+
+        Такая отправка могла как состояться, так и нет. Повтор мог бы продублировать
+        пост, поэтому посты уходят в dead letter (LeaseExpired). Возвращает их id.
+        """
+        reclaimed = await db.write(_reclaim_expired, int(time.time()), worker_id)
+        if reclaimed:
+            logger.error("Аренда %d постов истекла во время отправки, они перенесены в dead letter: %s",
+                         len(reclaimed), reclaimed)
+        return reclaimed
+
+    @staticmethod
+    async def reschedule_route(route: str, delay_seconds: int) -> int:
+        """Пересчитывает due_at ожидающих постов маршрута; возвращает их число
+
+        Посты в backoff не трогаются: их время задает следующая попытка.
+        """
+        return await db.write(_reschedule_route, route, delay_seconds)
+
+    @staticmethod
+    async def count_states() -> Dict[str, int]:
+        """Число постов в ожидании, в backoff, в отправке и в dead letter"""
+        return await db.read(_count_states, int(time.time()))
+
+    @staticmethod
+    async def load_seen(since: int, limit: int) -> List[Tuple[str, str, int]]:
+        """Возвращает (route, fingerprint, seen_at) содержимого, сохраненного после since"""
+        return await db.read(lambda conn: conn.execute(SQL_SELECT_SEEN_SINCE, (since, limit)).fetchall())
+
+    @staticmethod
+    async def find_seen(route: str, fingerprints: List[str], since: int) -> Dict[str, int]:
+        """Возвращает seen_at для отпечатков, сохраненных после since"""
+        return await db.read(_find_seen, route, fingerprints, since)
+
+    @staticmethod
+    async def remember_seen(route: str, fingerprints: List[str], seen_at: int, before: int = 0):
+        """Записывает отпечатки; before - заодно удалить записи старше этого времени"""
+        await db.write(_remember_seen, route, fingerprints, seen_at, before)
+
+    @staticmethod
+    async def mark_as_processed(post_id: int, forwarded_message_id: Optional[int],
+                                copies: Sequence[Tuple[int, int]] = (),
+                                sent: Optional[DuePost] = None) -> List[PostCopy]:
+        """Помечает пост как обработанный
+
+        copies - (id исходного сообщения, id его копии в целевом чате) для правок и удалений.
+        sent - отправленный снимок поста; возвращаются правки, которые он не застал.
+
+        Пост уже в целевом чате, поэтому запись повторяется MARK_PROCESSED_ATTEMPTS раз;
+        если она так и не удалась, ошибка передается вызывающему, а пост после
+        истечения аренды уходит в dead letter, а не на повторную отправку.
+        """
+        for attempt in range(1, MARK_PROCESSED_ATTEMPTS + 1):
+            try:
+                edits = await db.write(_mark_as_processed, post_id, forwarded_message_id, list(copies), sent)
+                logger.info("Пост %s помечен как обработанный", post_id)
+                return edits
+            except Exception as e:
+                if attempt == MARK_PROCESSED_ATTEMPTS:
+                    logger.critical(f"Пост {post_id} отправлен, но не отмечен: {type(e).__name__}: {str(e)}",
+                                    exc_info=True)
+                    raise
+                logger.error(f"Ошибка при обновлении поста {post_id}, попытка {attempt}: "
+                             f"{type(e).__name__}: {str(e)}")
+                await asyncio.sleep(attempt)
+
+    @staticmethod
+    async def mark_as_dead(post_ids: List[int], reason: str) -> int:
+        """Переносит захваченные посты в dead letter без новых попыток; возвращает их число"""
+        return await db.write(_mark_as_dead, post_ids, reason)
+
+    @staticmethod
+    async def mark_as_failed(post_id: int, error: Exception, policy: RetryPolicy) -> Optional[int]:
+        """Записывает неудачную попытку отправки
+
+        Возвращает время следующей попытки или None, если пост ушел в dead letter
+        (или его аренда истекла и им уже распоряжается другой воркер).
+        """
+        retry_after = getattr(error, "retry_after", None)
+        if hasattr(retry_after, "total_seconds"):
+            retry_after = retry_after.total_seconds()
+        try:
+            status, next_attempt_at = await db.write(_mark_as_failed, post_id, type(error).__name__,
+                                                     retry_after, policy)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении поста: {type(e).__name__}: {str(e)}", exc_info=True)
+            return None
+
+        if status is None:
+            logger.warning("Пост %s: аренда истекла до конца попытки, результат не записан", post_id)
+        elif next_attempt_at is None:
+            logger.error(f"Пост {post_id} перемещен в dead letter: {type(error).__name__}")
+        else:
+            logger.warning("Пост %s: повторная попытка через %d с",
+                           post_id, next_attempt_at - int(time.time()))
+        return next_attempt_at
+
+    @staticmethod
+    async def apply_retention(policy: RetentionPolicy) -> Dict[str, int]:
+        """Архивирует устаревшие посты пачками и сжимает файл базы
+
+        Каждая пачка - отдельная транзакция в потоке записи, поэтому отметки
+        об отправке и новые посты успевают записаться между пачками.
+        Возвращает число перенесенных строк и освобожденные байты.
+        """
+        cutoff = int(time.time()) - policy.days * 86400
+        size_before = db.size()
+        archived = 0
+        while True:
+            batch = await db.write_exclusive(_archive_batch, cutoff, policy)
+            archived += batch
+            if batch < policy.batch_size:
+                break
+            await asyncio.sleep(0)
+
+        # Освобождаем страницы порциями, пока они есть
+        free_pages, wal_left = await db.write_exclusive(_compact, policy.vacuum_pages)
+        while free_pages:
+            previous = free_pages
+            free_pages, wal_left = await db.write_exclusive(_compact, policy.vacuum_pages)
+            if free_pages >= previous:
+                break
+
+        size_after = db.size()
+        report = {
+            "archived": archived,
+            "size_before": size_before,
+            "size_after": size_after,
+            "reclaimed": max(0, size_before - size_after),
+            "wal_frames_left": wal_left,
+        }
+        if archived or report["reclaimed"]:
+            logger.info("Хранение: перенесено %d постов старше %d дн., освобождено %d КБ (%d -> %d КБ)",
+                        archived, policy.days, report["reclaimed"] // 1024,
+                        size_before // 1024, report["size_after"] // 1024)
+        return report
+
+    @staticmethod
+    async def get_traces(since: float) -> List[tuple]:
+        """Этапы постов, отправленных после since
+
+        Строка: (id, route, тип медиа, received, saved, due, первый claimed,
+        последний claimed, sent, число неудач); время в миллисекундах.
+        """
+        return await db.read(_fetch_all, SQL_SELECT_TRACES, int(since * 1000))
+
+    @staticmethod
+    async def get_post_trace(post_id: int) -> Tuple[Optional[tuple], List[Tuple[int, int]]]:
+        """Строка поста и его события (event, at) по времени"""
+        post = await db.read(lambda conn: conn.execute(SQL_SELECT_POST, (post_id,)).fetchone())
+        return post, await db.read(_fetch_all, SQL_SELECT_POST_EVENTS, post_id)
+
+    @staticmethod
+    async def get_pending(limit: int) -> List[tuple]:
+        """Ожидающие и отправляемые посты по времени отправки"""
+        return await db.read(_fetch_all, SQL_SELECT_PENDING, limit)
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Set, Tuple
+
+from database import PostManager
+from metrics import DEDUP_LOOKUPS_TOTAL
+
+
+logger = logging.getLogger(__name__)
+
+# Каждая N-я запись отпечатков заодно удаляет из базы вышедшие из окна
+PRUNE_EVERY = 1000
+
+
+def content_fingerprints(file_unique_ids: Iterable[Optional[str]], text: Optional[str]) -> List[str]:
+    """Отпечатки содержимого: file_unique_id файлов, а если их нет - хэш текста
+
+    file_unique_id одинаков у всех копий файла, подпись не учитывается.
+    Текст сравнивается без учета регистра и пробелов.
+    """
+    result = ["f:" + file_unique_id for file_unique_id in file_unique_ids if file_unique_id]
+    if not result:
+        normalized = " ".join((text or "").casefold().split())
+        if normalized:
+            result.append("t:" + hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest())
+    return result
+
+
+def fingerprints(messages: List) -> List[str]:
+    """Отпечатки содержимого поста (см. content_fingerprints)"""
+    file_unique_ids = []
+    for message in messages:
+        attachment = message.effective_attachment
+        if isinstance(attachment, (list, tuple)):  # Фото: берем самый большой размер
+            attachment = attachment[-1] if attachment else None
+        file_unique_ids.append(getattr(attachment, "file_unique_id", None))
+    text = next((m.caption or m.text for m in messages if m.caption or m.text), "")
+    return content_fingerprints(file_unique_ids, text)
+
+
+class ContentDeduplicator:
+    """Подавление повторов: пост пропускается, если все его отпечатки уже сохранялись
+
+    Отпечатки хранятся в таблице content_seen, а перед ней - LRU-кэш в памяти,
+    загружаемый при старте. Пока из кэша не вытеснялись записи внутри окна,
+    он полный: промах означает новое содержимое, и база не читается.
+    """
+
+    def __init__(self, window_seconds: int, cache_size: int = 100000):
+        self.window = window_seconds
+        self.cache_size = cache_size
+        # (route, fingerprint) -> seen_at; порядок - по времени записи, старые в начале
+        self._cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        # seen_at самой свежей вытесненной записи: пока она в окне, кэш неполный
+        self._evicted_until = 0
+        self._writes = 0
+        self._tasks: Set[asyncio.Task] = set()
+        # Отпечатки, запись которых в базу еще не закоммичена
+        self._unsaved: Set[Tuple[str, str]] = set()
+
+    def __len__(self):
+        return len(self._cache)
+
+    async def load(self):
+        """Заполняет кэш отпечатками из окна, самые свежие - в первую очередь"""
+        rows = await PostManager.load_seen(int(time.time()) - self.window, self.cache_size + 1)
+        if len(rows) > self.cache_size:
+            self._evicted_until = rows[self.cache_size][2]
+            rows = rows[:self.cache_size]
+        for route, fingerprint, seen_at in reversed(rows):
+            self._cache[(route, fingerprint)] = seen_at
+        logger.info("Загружено %d отпечатков содержимого", len(self._cache))
+
+    def _expire(self, border: int):
+        while self._cache:
+            key, seen_at = next(iter(self._cache.items()))
+            if seen_at >= border:
+                break
+            del self._cache[key]
+
+    def _known(self, key: Tuple[str, str]) -> bool:
+        return key in self._cache or key in self._unsaved
+
+    def _put(self, key: Tuple[str, str], seen_at: int):
+        self._cache[key] = seen_at
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            _, evicted_at = self._cache.popitem(last=False)
+            self._evicted_until = max(self._evicted_until, evicted_at)
+
+    async def is_duplicate(self, route: str, post_fingerprints: List[str], remember: bool = True) -> bool:
+        """True, если все отпечатки уже встречались в окне; иначе запоминает новые
+
+        remember=False - только проверка, без записи (например, для пробного прогона).
+        """
+        if not post_fingerprints:
+            return False
+        now = int(time.time())
+        border = now - self.window
+        self._expire(border)
+
+        missing = [fp for fp in post_fingerprints if not self._known((route, fp))]
+        if missing and self._evicted_until >= border:
+            DEDUP_LOOKUPS_TOTAL.inc(source="db")
+            found = await PostManager.find_seen(route, missing, border)
+            # Пока шел запрос, то же содержимое могло быть записано другим постом
+            missing = [fp for fp in missing if fp not in found and not self._known((route, fp))]
+        else:
+            DEDUP_LOOKUPS_TOTAL.inc(source="cache")
+        if not missing:
+            return True
+        if not remember:
+            return False
+
+        for fingerprint in missing:
+            self._put((route, fingerprint), now)
+            self._unsaved.add((route, fingerprint))
+        # Запись идет в фоне и попадает в ту же пачку коммита, что и сам пост
+        task = asyncio.create_task(self._remember(route, missing, now, border))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return False
+
+    async def _remember(self, route: str, new_fingerprints: List[str], seen_at: int, border: int):
+        self._writes += 1
+        before = border if self._writes % PRUNE_EVERY == 0 else 0
+        try:
+            await PostManager.remember_seen(route, new_fingerprints, seen_at, before)
+        except Exception as e:
+            logger.error(f"Ошибка записи отпечатков: {type(e).__name__}: {str(e)}", exc_info=True)
+        finally:
+            self._unsaved.difference_update((route, fingerprint) for fingerprint in new_fingerprints)
+
+    async def close(self):
+        """Дожидается фоновой записи отпечатков"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Sequence, Set, Tuple, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, cost: float = 1):
+        """Забирает cost токенов и ждет, пока недостача восполнится
+
+        Запрос больше capacity (альбом или пачка сообщений одним вызовом)
+        не урезается: корзина уходит в минус на всю стоимость, и вызов
+        ждет (cost - tokens) / rate.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._lock:  # Ожидающие обслуживаются по очереди
+            self._refill(loop.time())
+            self._tokens -= cost
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
+
+
+Job = Callable[[], Awaitable[None]]
+
+
+class Dispatcher:
+    """Параллельная отправка постов с учетом лимитов Telegram
+
+    Посты для одного чата отправляются строго по очереди, разные чаты
+    обслуживаются параллельно, но не более чем workers отправок сразу.
+    Перед каждой отправкой берутся токены из общей корзины бота и из
+    корзины целевого чата, поэтому очередь разгружается с максимальной
+    скоростью, которую допускает API, без flood wait.
+    """
+
+    def __init__(self, workers: int = 4, global_rate: float = 25,
+                 chat_rate_per_minute: float = 20):
+        self._workers = asyncio.Semaphore(workers)
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate_per_minute / 60
+        self._chat_capacity = chat_rate_per_minute
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._lanes: Dict[int, Deque[Tuple[Tuple[str, ...], Job, int]]] = {}
+        self._lane_tasks: Dict[int, asyncio.Task] = {}
+        self._pending: Set[str] = set()
+        # Когда завершилась последняя отправка ключа: защищает от выборок,
+        # прочитанных из базы до того, как отправка была отмечена
+        self._finished: Dict[str, float] = {}
+        self._finished_limit = 1000
+        # Выставляется после каждой завершенной отправки, см. wait_below
+        self._progress = asyncio.Event()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @staticmethod
+    def snapshot() -> float:
+        """Метка времени, которую нужно взять до чтения наступивших постов из базы"""
+        return asyncio.get_running_loop().time()
+
+    def accepts(self, key: str, snapshot: Optional[float] = None) -> bool:
+        """True, если пост не в очереди и его выборка из базы не устарела
+
+        snapshot - результат snapshot() до чтения из базы: пост, отправка которого
+        завершилась позже, в выборке устарел и повторно не ставится.
+        """
+        if key in self._pending:
+            return False
+        return snapshot is None or self._finished.get(key, float("-inf")) < snapshot
+
+    def submit(self, chat_id: int, key: Union[str, Sequence[str]], job: Job, cost: int = 1,
+               snapshot: Optional[float] = None) -> bool:
+        """Ставит отправку в очередь чата; False, если пост уже в очереди
+
+        key - ключ поста или ключи всех постов, которые job отправляет одним вызовом.
+        cost - сколько сообщений появится в чате (для альбома - число элементов).
+        snapshot - см. accepts().
+        """
+        keys = (key,) if isinstance(key, str) else tuple(key)
+        if not all(self.accepts(one, snapshot) for one in keys):
+            return False
+        self._pending.update(keys)
+
+        self._lanes.setdefault(chat_id, deque()).append((keys, job, cost))
+        if chat_id not in self._lane_tasks:
+            self._lane_tasks[chat_id] = asyncio.create_task(self._run_lane(chat_id))
+        return True
+
+    async def wait_below(self, limit: int):
+        """Ждет, пока в очереди останется меньше limit постов
+
+        Источник постов придерживает следующую порцию, пока очередь не разгрузится.
+        """
+        while len(self._pending) >= limit:
+            self._progress.clear()
+            await self._progress.wait()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_capacity)
+        return bucket
+
+    async def _run_lane(self, chat_id: int):
+        """Обслуживает очередь одного чата, сохраняя порядок отправки"""
+        lane = self._lanes[chat_id]
+        bucket = self._chat_bucket(chat_id)
+        try:
+            while lane:
+                keys, job, cost = lane.popleft()
+                try:
+                    # Лимит чата ждем до захвата воркера, чтобы не занимать его впустую
+                    await bucket.acquire(cost)
+                    async with self._workers:
+                        await self._global.acquire(cost)
+                        await job()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка отправки {', '.join(keys)} в чат {chat_id}: "
+                                 f"{type(e).__name__}: {str(e)}", exc_info=True)
+                finally:
+                    self._pending.difference_update(keys)
+                    self._forget_finished()
+                    finished_at = asyncio.get_running_loop().time()
+                    for key in keys:
+                        self._finished[key] = finished_at
+                    self._progress.set()
+        finally:
+            del self._lanes[chat_id]
+            del self._lane_tasks[chat_id]
+
+    def _forget_finished(self, keep_seconds: float = 300):
+        """Удаляет старые отметки завершения: выборки такой давности не бывают"""
+        if len(self._finished) < self._finished_limit:
+            return
+        border = asyncio.get_running_loop().time() - keep_seconds
+        self._finished = {key: at for key, at in self._finished.items() if at >= border}
+        self._finished_limit = max(1000, 2 * len(self._finished))
+
+    async def close(self, timeout: float = 10):
+        """Останавливает отправку; неотправленные посты останутся в базе
+
+        Очереди чатов сбрасываются, а начатые отправки дожидаются завершения
+        (не дольше timeout): прерванная отправка не подтверждена и ушла бы в dead letter.
+        """
+        for lane in self._lanes.values():
+            lane.clear()
+        tasks = list(self._lane_tasks.values())
+        if tasks:
+            _, running = await asyncio.wait(tasks, timeout=timeout)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+        self._progress.set()
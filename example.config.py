@@ -1,6 +1,6 @@
 # Настройки бота
 DELAY_MINUTES = 20 # Задержка перед пересылкой в минутах
-CHECK_INTERVAL = 1 # Интервал проверки новых постов в минутах
+CHECK_INTERVAL = 1 # Пауза перед повторной отправкой после ошибки в минутах
 
 # Текст для добавления к постам
 ADDITIONAL_TEXT = "Для заказа пишите админу канала. Срок доставки: 2-3 дня"
@@ -11,3 +11,105 @@ KEYWORDS = [
     "мужч",
     "унисекс"
 ]
+
+# Слова-исключения: пост с ними не пересылается, даже если есть ключевое слово
+EXCLUDE_KEYWORDS = []
+
+# True - ключевые слова совпадают только целым словом, а не частью слова
+KEYWORDS_WHOLE_WORDS = False
+
+# Пауза без новых частей альбома (в секундах), после которой альбом сохраняется целиком
+ALBUM_QUIET_SECONDS = 2
+
+# Отправка: число параллельных отправок в разные чаты и лимиты Telegram
+DISPATCH_WORKERS = 4
+GLOBAL_RATE_LIMIT = 25 # Сообщений в секунду на бота (лимит Telegram - около 30)
+CHAT_RATE_LIMIT = 20 # Сообщений в минуту в один канал (лимит Telegram - около 20)
+
+# Прием: число входящих сообщений, обрабатываемых параллельно (части одного альбома - по очереди),
+# и предел очереди входящих; при заполнении прием приостанавливается, а webhook отвечает 503
+UPDATE_WORKERS = 8
+UPDATE_QUEUE_SIZE = 1000
+
+# Индекс подписей всех постов исходных каналов (и не прошедших фильтр) хранится CAPTION_INDEX_DAYS дней
+# (0 - не вести). При изменении ключевых слов в config.py посты за REMATCH_HOURS проверяются заново
+CAPTION_INDEX_DAYS = 7
+REMATCH_HOURS = 72
+
+# Повторные попытки: пауза начинается с CHECK_INTERVAL и удваивается до RETRY_MAX_DELAY_MINUTES,
+# после MAX_SEND_ATTEMPTS неудач пост больше не отправляется (dead letter)
+MAX_SEND_ATTEMPTS = 5
+RETRY_MAX_DELAY_MINUTES = 60
+
+# Маршруты пересылки. Если список пуст, используется один маршрут
+# из SOURCE_CHANNEL_ID/TARGET_CHANNEL_ID (.env) с общими настройками выше.
+# Параметры, не указанные в маршруте, берутся из общих настроек.
+ROUTES = [
+    # {
+    #     "name": "men",                   # Имя маршрута (хранится в базе, не меняйте у работающего маршрута)
+    #     "source": -100123456789,         # ID исходного канала
+    #     "targets": [-100987654321],      # ID целевых каналов
+    #     "keywords": ["мужск", "мужч"],
+    #     "exclude_keywords": [],
+    #     "delay_minutes": 20,
+    #     "additional_text": "Для заказа пишите админу канала",
+    # },
+]
+
+# Получение обновлений: "polling" или "webhook"
+UPDATE_MODE = "polling"
+WEBHOOK_URL = "" # Внешний адрес, например "https://bot.example.com"; пусто - не регистрировать в Telegram
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+
+# Метрики Prometheus на METRICS_LISTEN:METRICS_PORT/metrics; 0 - отключены
+METRICS_LISTEN = "0.0.0.0"
+METRICS_PORT = 0 # Например, 9108
+
+# Логирование: общий уровень, уровни отдельных модулей и формат JSON (одна запись - одна строка)
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {"httpx": "WARNING"} # httpx пишет строку на каждый запрос к Bot API
+LOG_JSON = False
+
+# Хранение: отправленные посты и dead letter старше RETENTION_DAYS переносятся
+# в data/posts_archive.db (или удаляются при RETENTION_ARCHIVE = False), после чего
+# база сжимается. Проверка раз в RETENTION_INTERVAL_MINUTES; 0 дней - отключено
+RETENTION_DAYS = 30
+RETENTION_ARCHIVE = True
+RETENTION_INTERVAL_MINUTES = 60
+
+# Запись в базу пачками: до DB_COMMIT_BATCH операций в одном коммите,
+# новые операции ждем не дольше DB_COMMIT_DELAY_MS миллисекунд
+DB_COMMIT_BATCH = 100
+DB_COMMIT_DELAY_MS = 2
+
+# Повторы: пост не пересылается, если все его файлы (или текст без медиа) уже были
+# сохранены по этому маршруту за последние DEDUP_WINDOW_HOURS часов; 0 - отключено
+DEDUP_WINDOW_HOURS = 72
+DEDUP_CACHE_SIZE = 100000 # Отпечатков в памяти; при переполнении проверка обращается к базе
+
+# Накопившиеся посты читаются из базы страницами по DUE_PAGE_SIZE; следующая
+# страница читается, когда в очереди отправки останется меньше DUE_PAGE_SIZE постов
+DUE_PAGE_SIZE = 100
+
+# Способ отправки: "send" - пост собирается заново из файлов (send_photo, send_media_group, ...);
+# "copy" - исходные сообщения копируются с форматированием, наступившие посты одного канала
+# уходят одним вызовом copyMessages (до 100 сообщений), а ADDITIONAL_TEXT дописывается правкой подписи;
+# "forward" - то же через forwardMessages, с пометкой "Переслано из" и без ADDITIONAL_TEXT
+DISPATCH_MODE = "send"
+
+# Несколько процессов с общей data/posts.db: "all" - прием и отправка (один процесс),
+# "ingest" - только прием обновлений, "dispatch" - только отправка (таких может быть несколько).
+# Перед отправкой пост захватывается процессом на LEASE_SECONDS; если процесс упал,
+# пост после истечения аренды уходит в dead letter (не повторяется). Процессы all и
+# dispatch перечитывают расписание из базы раз в SCHEDULE_REFRESH_SECONDS (так находятся
+# и посты команды rematch). Имя процесса - WORKER_ID в .env
+WORKER_ROLE = "all"
+LEASE_SECONDS = 300
+SCHEDULE_REFRESH_SECONDS = 10
+
+# config.py проверяется раз в CONFIG_RELOAD_SECONDS и при изменении применяется без перезапуска:
+# ключевые слова, задержки, ADDITIONAL_TEXT, ROUTES, повторы, DISPATCH_MODE и уровни логов.
+# Ошибочная версия отклоняется, и бот работает с прежними настройками; 0 - не следить
+CONFIG_RELOAD_SECONDS = 5
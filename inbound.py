@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable
+
+from metrics import INBOUND_WAIT_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class InboundQueue:
+    """Параллельная обработка входящих сообщений с порядком внутри ключа
+
+    Сообщения с разными ключами обрабатываются параллельно, но не более
+    workers сразу. Сообщения с одним ключом (части одной медиагруппы)
+    обрабатываются строго по очереди в порядке поступления.
+
+    В очереди не больше limit сообщений: submit ждет, пока освободится
+    место. Application обрабатывает обновления по одному, поэтому, пока
+    submit ждет, новые обновления копятся в update_queue, а когда
+    заполнится и она, прием останавливается (polling не запрашивает
+    getUpdates, webhook отвечает 503 и Telegram повторит доставку).
+    """
+
+    def __init__(self, workers: int = 8, limit: int = 1000):
+        self._workers = asyncio.Semaphore(workers)
+        self.limit = limit
+        self._lanes: Dict[Hashable, Deque[Job]] = {}
+        self._lane_tasks: Dict[Hashable, asyncio.Task] = {}
+        self._size = 0
+        # Выставляется после каждого обработанного сообщения, см. submit и join
+        self._progress = asyncio.Event()
+
+    def __len__(self):
+        return self._size
+
+    async def submit(self, key: Hashable, job: Job):
+        """Ставит обработку в очередь ключа; ждет, если очередь заполнена"""
+        if self._size >= self.limit:
+            started = time.perf_counter()
+            while self._size >= self.limit:
+                self._progress.clear()
+                await self._progress.wait()
+            INBOUND_WAIT_SECONDS.observe(time.perf_counter() - started)
+        self._size += 1
+
+        self._lanes.setdefault(key, deque()).append(job)
+        if key not in self._lane_tasks:
+            self._lane_tasks[key] = asyncio.create_task(self._run_lane(key))
+
+    async def _run_lane(self, key: Hashable):
+        """Обрабатывает сообщения одного ключа по очереди"""
+        lane = self._lanes[key]
+        try:
+            while lane:
+                job = lane.popleft()
+                try:
+                    async with self._workers:
+                        await job()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка обработки сообщения {key}: {type(e).__name__}: {str(e)}", exc_info=True)
+                finally:
+                    self._size -= 1
+                    self._progress.set()
+        finally:
+            del self._lanes[key]
+            del self._lane_tasks[key]
+
+    async def join(self):
+        """Ждет обработки всех принятых сообщений (при остановке бота)"""
+        while self._lane_tasks:
+            await asyncio.gather(*self._lane_tasks.values(), return_exceptions=True)
@@ -0,0 +1,68 @@
+import re
+from typing import Dict, Iterable, Optional
+
+
+def _trie_pattern(node: dict) -> str:
+    """Строит regex по префиксному дереву: общий префикс проверяется один раз
+
+    Более длинные продолжения идут раньше конца слова, поэтому
+    совпадение, как и раньше, получается самым длинным из ключевых слов.
+    """
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in node.items() if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        return "(?:" + body + ")?" if len(branches) > 1 or len(body) > 1 else body + "?"
+    return body
+
+
+class KeywordMatcher:
+    """Ключевые слова, скомпилированные в одно регулярное выражение
+
+    Текст приводится к casefold один раз, после чего один проход regex
+    проверяет сразу все ключевые слова. Исключающие слова компилируются
+    в отдельное выражение и отменяют совпадение.
+    """
+
+    def __init__(self, keywords: Iterable[str], exclude: Iterable[str] = (), whole_words: bool = False):
+        keywords, exclude = tuple(keywords), tuple(exclude)
+        # Исходные настройки: по ним при перезагрузке config.py матчер используется повторно
+        self.spec = (keywords, exclude, whole_words)
+        self._keywords: Dict[str, str] = {}
+        for keyword in keywords:
+            if keyword.strip():
+                self._keywords.setdefault(keyword.strip().casefold(), keyword)
+
+        self._include = self._compile(self._keywords, whole_words)
+        self._exclude = self._compile({k.strip().casefold() for k in exclude if k.strip()}, whole_words)
+
+    @staticmethod
+    def _compile(words: Iterable[str], whole_words: bool) -> Optional[re.Pattern]:
+        """Одно выражение по всем словам в форме префиксного дерева"""
+        trie: dict = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}  # Конец слова
+        if not trie:
+            return None
+        pattern = _trie_pattern(trie)
+        if whole_words:
+            pattern = rf"(?<!\w)(?:{pattern})(?!\w)"
+        return re.compile(pattern)
+
+    def match(self, text: Optional[str]) -> Optional[str]:
+        """Возвращает сработавшее ключевое слово или None"""
+        if not text or self._include is None:
+            return None
+
+        folded = text.casefold()
+        if self._exclude is not None and self._exclude.search(folded):
+            return None
+
+        found = self._include.search(folded)
+        if found is None:
+            return None
+        return self._keywords[found.group(0)]
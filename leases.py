@@ -0,0 +1,35 @@
+import asyncio
+import logging
+from typing import List
+
+from database import PostManager
+from metrics import LEASES_RECLAIMED_TOTAL, SEND_RESULTS_TOTAL
+
+
+logger = logging.getLogger(__name__)
+
+
+async def reclaim_leases(worker_id: str = "") -> List[int]:
+    """Переносит в dead letter посты с истекшей арендой (и захваченные прежним запуском worker_id)
+
+    Отправка таких постов могла дойти до Telegram: повтор нарушил бы правило
+    «не больше одного раза», поэтому они не возвращаются в очередь.
+    """
+    reclaimed = await PostManager.reclaim_expired(worker_id)
+    if reclaimed:
+        LEASES_RECLAIMED_TOTAL.inc(len(reclaimed))
+        SEND_RESULTS_TOTAL.inc(len(reclaimed), result="dead", error="LeaseExpired")
+    return reclaimed
+
+
+async def run_lease_reclaim(interval_seconds: float):
+    """Фоновая задача: снимает аренду с постов воркеров, упавших во время отправки"""
+    while True:
+        try:
+            await asyncio.sleep(interval_seconds)
+            await reclaim_leases()
+        except asyncio.CancelledError:
+            logger.info("Снятие истекших аренд остановлено")
+            break
+        except Exception as e:
+            logger.error(f"Ошибка снятия истекших аренд: {type(e).__name__}: {str(e)}", exc_info=True)
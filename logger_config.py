@@ -1,23 +1,76 @@
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import time
 from pathlib import Path
+from typing import Dict, Optional
 
 
-# Настройка data
+# Настройка data (каталог создается при настройке логирования, а не при импорте)
 log_path = Path("data") / "bot.log"
-log_path.parent.mkdir(exist_ok=True)
 
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: удобно для сборщиков логов"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке
+
+    Стандартный prepare() применяет форматтер еще в event loop; здесь
+    подставляются только аргументы сообщения и текст исключения, а
+    итоговую строку (текстовую или JSON) собирает поток-слушатель.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)  # Другие обработчики получают запись без изменений
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
-def setup_logging():
-    """Настройка логирования с UTC-временем и ротацией файлов"""
-    formatter = logging.Formatter(
-        '[%(asctime)s UTC] %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    formatter.converter = time.gmtime  # Используем UTC время
+
+def setup_logging(level: str = "INFO", levels: Optional[Dict[str, str]] = None, json_format: bool = False):
+    """Настройка логирования с UTC-временем и ротацией файлов
+
+    Обработчики работают в отдельном потоке (QueueListener): вызов logger.info
+    в event loop только кладет запись в очередь, запись в файл и ротация
+    происходят вне цикла. levels - уровни для отдельных модулей,
+    например {"httpx": "WARNING"}.
+    """
+    global _listener
+
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '[%(asctime)s UTC] %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+        formatter.converter = time.gmtime  # Используем UTC время
 
     # Файловый обработчик (основные логи)
+    log_path.parent.mkdir(exist_ok=True)
     file_handler = RotatingFileHandler(
         log_path,
         maxBytes=5*1024*1024,  # 5 MB
@@ -25,15 +78,38 @@ def setup_logging():
         encoding='utf-8'
     )
     file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.INFO)
+    # Уровень файла задают LOG_LEVEL и LOG_LEVELS через уровни логгеров
+    file_handler.setLevel(logging.NOTSET)
 
     # Консольный обработчик (только ошибки)
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.WARNING)
 
+    # Записи отбрасываются до постановки в очередь, если уровень логгера их не пропускает
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
     # Основная настройка
     logging.basicConfig(
-        level=logging.DEBUG,  # Минимальный уровень
-        handlers=[file_handler, console_handler]
+        level=level,
+        handlers=[_QueueHandler(log_queue)]
     )
+    set_levels(level, levels)
+
+
+def set_levels(level: str = "INFO", levels: Optional[Dict[str, str]] = None):
+    """Меняет общий уровень и уровни модулей (в том числе без перезапуска)"""
+    logging.getLogger().setLevel(level)
+    for name, module_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток логирования"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
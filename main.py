@@ -1,495 +1,1101 @@
+from __future__ import annotations
+
 import os
+import argparse
 import asyncio
+import functools
+import json
+import socket
 import sys
-from typing import Dict, List
-from datetime import datetime
-from dotenv import load_dotenv
-from telegram import Update, Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 import logging
-from logger_config import setup_logging
-import sqlite3
-import json
+from logger_config import setup_logging, set_levels, stop_logging
+import config
 from config import DELAY_MINUTES, ADDITIONAL_TEXT, KEYWORDS, CHECK_INTERVAL
-import pytz
-from pathlib import Path
+from database import db, init_db, archive_path, DuePost, Media, PostCopy, PostManager, RetentionPolicy, RetryPolicy
+from scheduler import DispatchScheduler
+from routes import Route, build_routes
+from album import AlbumAssembler
+from dispatcher import Dispatcher
+from inbound import InboundQueue
+from retention import run_retention
+from leases import reclaim_leases, run_lease_reclaim
+from config_reload import ConfigWatcher
+from report import run_report
+from caption_index import CaptionIndex, rematch, run_search, run_rematch
+from dedup import ContentDeduplicator, fingerprints
+from metrics import (
+    REGISTRY, MetricsServer, HANDLE_MESSAGE_SECONDS, MESSAGES_TOTAL, SEND_SECONDS, CLAIM_CONFLICTS_TOTAL,
+    SEND_RESULTS_TOTAL, EDITS_TOTAL, DISPATCH_LAG_SECONDS, FORWARD_DELAY_SECONDS, POSTS, QUEUE_SIZE, DB_SIZE_BYTES
+)
+
+if TYPE_CHECKING:
+    # telegram импортируется при создании Application: командам и тестам он не нужен
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
 
 
-# Настройка data
-db_path = Path("data") / "posts.db"
-db_path.parent.mkdir(exist_ok=True)
-
-# Настройка логирования
-setup_logging()
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-SOURCE_CHANNEL_ID = int(os.getenv("SOURCE_CHANNEL_ID"))
-TARGET_CHANNEL_ID = int(os.getenv("TARGET_CHANNEL_ID"))
-
-
-# Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            original_message_id INTEGER,
-            media_group_id TEXT,
-            file_ids TEXT,
-            caption TEXT,
-            post_date TEXT,
-            is_processed INTEGER DEFAULT 0,
-            forwarded_message_id INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-
-init_db()
+# Настройка логирования (применяется в configure)
+LOG_LEVEL = getattr(config, "LOG_LEVEL", "INFO")
+LOG_LEVELS = getattr(config, "LOG_LEVELS", {})
+LOG_JSON = getattr(config, "LOG_JSON", False)
+
+# Переменные окружения (.env) читает configure
+BOT_TOKEN: Optional[str] = None
+# Каналы из .env нужны только для маршрута по умолчанию (если ROUTES не задан)
+SOURCE_CHANNEL_ID: Optional[int] = None
+TARGET_CHANNEL_ID: Optional[int] = None
+WEBHOOK_SECRET: Optional[str] = None
+
+# Необязательные настройки (в старых config.py их может не быть)
+EXCLUDE_KEYWORDS = getattr(config, "EXCLUDE_KEYWORDS", [])
+KEYWORDS_WHOLE_WORDS = getattr(config, "KEYWORDS_WHOLE_WORDS", False)
+ALBUM_QUIET_SECONDS = getattr(config, "ALBUM_QUIET_SECONDS", 2)
+DISPATCH_WORKERS = getattr(config, "DISPATCH_WORKERS", 4)
+GLOBAL_RATE_LIMIT = getattr(config, "GLOBAL_RATE_LIMIT", 25)
+CHAT_RATE_LIMIT = getattr(config, "CHAT_RATE_LIMIT", 20)
+MAX_SEND_ATTEMPTS = getattr(config, "MAX_SEND_ATTEMPTS", 5)
+RETRY_MAX_DELAY_MINUTES = getattr(config, "RETRY_MAX_DELAY_MINUTES", 60)
+ROUTES = getattr(config, "ROUTES", [])
+UPDATE_MODE = getattr(config, "UPDATE_MODE", "polling")
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", "")
+WEBHOOK_LISTEN = getattr(config, "WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8443)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "telegram")
+METRICS_LISTEN = getattr(config, "METRICS_LISTEN", "0.0.0.0")
+METRICS_PORT = getattr(config, "METRICS_PORT", 0)
+RETENTION_DAYS = getattr(config, "RETENTION_DAYS", 30)
+RETENTION_ARCHIVE = getattr(config, "RETENTION_ARCHIVE", True)
+RETENTION_INTERVAL_MINUTES = getattr(config, "RETENTION_INTERVAL_MINUTES", 60)
+DB_COMMIT_BATCH = getattr(config, "DB_COMMIT_BATCH", 100)
+DB_COMMIT_DELAY_MS = getattr(config, "DB_COMMIT_DELAY_MS", 2)
+DEDUP_WINDOW_HOURS = getattr(config, "DEDUP_WINDOW_HOURS", 72)
+DEDUP_CACHE_SIZE = getattr(config, "DEDUP_CACHE_SIZE", 100000)
+DUE_PAGE_SIZE = getattr(config, "DUE_PAGE_SIZE", 100)
+DISPATCH_MODE = getattr(config, "DISPATCH_MODE", "send")
+UPDATE_WORKERS = getattr(config, "UPDATE_WORKERS", 8)
+UPDATE_QUEUE_SIZE = getattr(config, "UPDATE_QUEUE_SIZE", 1000)
+CAPTION_INDEX_DAYS = getattr(config, "CAPTION_INDEX_DAYS", 7)
+REMATCH_HOURS = getattr(config, "REMATCH_HOURS", 72)
+
+# send - пост собирается заново из file_id (send_photo, send_media_group, ...);
+# copy/forward - исходные сообщения копируются (пересылаются) пачками copyMessages/forwardMessages
+DISPATCH_MODES = ("send", "copy", "forward")
+
+# Не больше 100 сообщений в одном вызове copyMessages/forwardMessages
+MAX_COPY_MESSAGES = 100
+
+# Несколько процессов с общей базой: all - прием и отправка, ingest - только прием
+# обновлений, dispatch - только отправка. Пост перед отправкой захватывается воркером
+# WORKER_ID на LEASE_SECONDS, поэтому каждый пост отправляет только один процесс
+WORKER_ROLE = getattr(config, "WORKER_ROLE", "all")
+WORKER_ROLES = ("all", "ingest", "dispatch")
+WORKER_ID = ""  # Задается в configure: может прийти из .env
+LEASE_SECONDS = getattr(config, "LEASE_SECONDS", 300)
+SCHEDULE_REFRESH_SECONDS = getattr(config, "SCHEDULE_REFRESH_SECONDS", 10)
+CONFIG_RELOAD_SECONDS = getattr(config, "CONFIG_RELOAD_SECONDS", 5)
+
+# Настройки config.py, которые применяются без перезапуска, и их значения
+# по умолчанию (None - настройка обязательна). Остальные - после перезапуска
+RELOADABLE_SETTINGS = {
+    "KEYWORDS": None,
+    "DELAY_MINUTES": None,
+    "ADDITIONAL_TEXT": None,
+    "CHECK_INTERVAL": None,
+    "EXCLUDE_KEYWORDS": [],
+    "KEYWORDS_WHOLE_WORDS": False,
+    "ROUTES": [],
+    "ALBUM_QUIET_SECONDS": 2,
+    "MAX_SEND_ATTEMPTS": 5,
+    "RETRY_MAX_DELAY_MINUTES": 60,
+    "DISPATCH_MODE": "send",
+    "LOG_LEVEL": "INFO",
+    "LOG_LEVELS": {},
+}
+RESTART_SETTINGS = (
+    "UPDATE_MODE",
+    "WEBHOOK_URL",
+    "WEBHOOK_LISTEN",
+    "WEBHOOK_PORT",
+    "WEBHOOK_PATH",
+    "METRICS_LISTEN",
+    "METRICS_PORT",
+    "LOG_JSON",
+    "DISPATCH_WORKERS",
+    "GLOBAL_RATE_LIMIT",
+    "CHAT_RATE_LIMIT",
+    "RETENTION_DAYS",
+    "RETENTION_ARCHIVE",
+    "RETENTION_INTERVAL_MINUTES",
+    "DB_COMMIT_BATCH",
+    "DB_COMMIT_DELAY_MS",
+    "DEDUP_WINDOW_HOURS",
+    "DEDUP_CACHE_SIZE",
+    "DUE_PAGE_SIZE",
+    "UPDATE_WORKERS",
+    "UPDATE_QUEUE_SIZE",
+    "CAPTION_INDEX_DAYS",
+    "REMATCH_HOURS",
+    "WORKER_ROLE",
+    "LEASE_SECONDS",
+    "SCHEDULE_REFRESH_SECONDS",
+    "CONFIG_RELOAD_SECONDS",
+)
+
+# Повторные отправки: CHECK_INTERVAL удваивается с каждой неудачей
+RETRY_POLICY = RetryPolicy(
+    base_delay=CHECK_INTERVAL * 60,
+    max_delay=RETRY_MAX_DELAY_MINUTES * 60,
+    max_attempts=MAX_SEND_ATTEMPTS
+)
+
+# Отправленные посты и dead letter старше RETENTION_DAYS переносятся в архив
+RETENTION_POLICY = RetentionPolicy(
+    days=RETENTION_DAYS,
+    archive=archive_path if RETENTION_ARCHIVE else None
+)
+
+# Маршруты по id исходного канала; ключевые слова компилируются в configure и при перезагрузке config.py
+routes: Dict[int, Route] = {}
+routes_by_name: Dict[str, Route] = {}
+
+
+def configure():
+    """Настраивает логирование, читает .env, проверяет настройки и строит маршруты
+
+    Вызывается один раз при запуске (main). Импорт модуля ничего из этого
+    не делает, поэтому main можно импортировать в тестах и инструментах
+    без .env и каталога data/.
+    """
+    global BOT_TOKEN, SOURCE_CHANNEL_ID, TARGET_CHANNEL_ID, WEBHOOK_SECRET, WORKER_ID, routes, routes_by_name
+    from dotenv import load_dotenv
+
+    setup_logging(level=LOG_LEVEL, levels=LOG_LEVELS, json_format=LOG_JSON)
+
+    # Загрузка переменных окружения
+    load_dotenv()
+    BOT_TOKEN = os.getenv("BOT_TOKEN")
+    SOURCE_CHANNEL_ID = int(os.getenv("SOURCE_CHANNEL_ID")) if os.getenv("SOURCE_CHANNEL_ID") else None
+    TARGET_CHANNEL_ID = int(os.getenv("TARGET_CHANNEL_ID")) if os.getenv("TARGET_CHANNEL_ID") else None
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+    WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+    if DISPATCH_MODE not in DISPATCH_MODES:
+        raise ValueError(f"DISPATCH_MODE должен быть одним из {DISPATCH_MODES}, задан {DISPATCH_MODE!r}")
+    if WORKER_ROLE not in WORKER_ROLES:
+        raise ValueError(f"WORKER_ROLE должен быть одним из {WORKER_ROLES}, задан {WORKER_ROLE!r}")
+
+    routes = build_routes(
+        ROUTES, SOURCE_CHANNEL_ID, TARGET_CHANNEL_ID,
+        keywords=KEYWORDS,
+        exclude_keywords=EXCLUDE_KEYWORDS,
+        whole_words=KEYWORDS_WHOLE_WORDS,
+        delay_minutes=DELAY_MINUTES,
+        additional_text=ADDITIONAL_TEXT
+    )
+    routes_by_name = {route.name: route for route in routes.values()}
+
+
+async def save_messages(app: Application, messages: List, late: bool = False) -> bool:
+    """Проверяет ключевые слова и сохраняет пост: одиночное сообщение или собранный альбом
+
+    Опоздавшие части уже принятого альбома (late=True) сохраняются без проверки.
+    """
+    first = messages[0]
+    route = routes[first.chat.id]
+    # В индекс подписей попадают и посты, не прошедшие фильтр: их найдут новые ключевые слова
+    caption_index = app.bot_data.get("caption_index")
+    if caption_index:
+        await caption_index.add(messages, route)
+    if not late:
+        caption = next((m.caption or m.text for m in messages if m.caption or m.text), None)
+        keyword = route.matcher.match(caption)
+        if not keyword:
+            logger.info("Ключевые слова не найдены, пропускаем пост %s", first.message_id)
+            MESSAGES_TOTAL.inc(route=route.name, result="skipped")
+            return False
+        logger.info("Найден пост с ключевым словом '%s': %s, маршрут %s, сообщений: %d",
+                    keyword, first.message_id, route.name, len(messages))
+
+        # Повторно выложенные фото/видео и тексты не пересылаем
+        dedup = app.bot_data.get("dedup")
+        if dedup is not None and await dedup.is_duplicate(route.name, fingerprints(messages)):
+            logger.info("Пост %s повторяет уже сохраненное содержимое, пропускаем", first.message_id)
+            MESSAGES_TOTAL.inc(route=route.name, result="duplicate")
+            return False
+    MESSAGES_TOTAL.inc(route=route.name, result="late" if late else "matched")
+
+    created = await PostManager.save_post(messages, route)
+    # В режиме ingest планировщика нет: посты найдут процессы dispatch
+    scheduler = app.bot_data.get("scheduler")
+    if scheduler is not None:
+        for post_id, due_at in created:
+            scheduler.schedule(due_at, post_id)
+    return True
+
+
+async def process_message(app: Application, message):
+    """Обрабатывает входящее сообщение (выполняется очередью входящих)"""
+    try:
+        # Маршрут мог быть удален перезагрузкой config.py, пока сообщение ждало в очереди
+        route = routes.get(message.chat.id)
+        if route is None:
+            return
 
+        with HANDLE_MESSAGE_SECONDS.time(route=route.name):
+            # Части медиагруппы собираются в альбом, ключевые слова проверяются по его подписи
+            if message.media_group_id:
+                logger.info("Получено сообщение медиагруппы: %s", message.message_id)
+                app.bot_data["albums"].add(message)
+                return
 
-class PostManager:
-    @staticmethod
-    def debug_unprocessed_posts():
-        """Экстренная проверка необработанных постов"""
-        try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                SELECT 
-                    media_group_id,
-                    post_date,
-                    datetime('now') as current_time,
-                    datetime(post_date) as post_date_conv,
-                    (strftime('%s','now') - strftime('%s',post_date)) as diff_seconds
-                FROM posts
-                WHERE is_processed = 0
-            ''')
+            await save_messages(app, [message])
 
-        except Exception as e:
-            logger.error(f"DEBUG ошибка: {e}")
-        finally:
-            conn.close()
-
-    @staticmethod
-    def _get_connection():
-        """Возвращает безопасное подключение к БД"""
-        conn = sqlite3.connect(db_path)
-        conn.execute("PRAGMA journal_mode=WAL")  # Улучшенная производительность
-        conn.execute("PRAGMA foreign_keys=ON")   # Включить внешние ключи
-        return conn
-
-    @staticmethod
-    def clear_db():
-        """Очищает базу данных (только для тестов!)"""
-        try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM posts')
-            conn.commit()
-            logger.warning("База данных очищена!")
-        except Exception as e:
-            logger.error(f"Ошибка очистки БД: {type(e).__name__}: {str(e)}", exc_info=True)
-        finally:
-            if conn:
-                conn.close()
-
-    @staticmethod
-    def save_post(message: Message):
-        """Сохраняет пост в базу данных"""
-        conn = None
-        try:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            media_group_id = message.media_group_id or str(message.message_id)
-
-            # Получаем file_id для текущего медиа
-            file_id = None
-            file_type = None  # Добавляем переменную для типа файла
-
-            if message.photo:
-                file_id = message.photo[-1].file_id
-                file_type = 'photo'
-            elif message.video:
-                file_id = message.video.file_id
-                file_type = 'video'
-            elif message.document:
-                file_id = message.document.file_id
-                file_type = 'document'
-            elif message.audio:
-                file_id = message.audio.file_id
-                file_type = 'audio'
-
-            # Для медиагрупп сохраняем caption только из первого сообщения
-            caption = None
-            if not message.media_group_id or (message.caption or message.text):
-                caption = message.caption if message.caption else ""
-                if message.text and not message.caption:
-                    caption = message.text
-
-            # Проверяем существующую запись
-            cursor.execute('SELECT file_ids, caption FROM posts WHERE media_group_id = ?',
-                           (media_group_id,))
-            existing = cursor.fetchone()
-
-            # Инициализируем file_ids, чтобы переменная всегда была определена
-            file_ids = []
-            if file_id:
-                file_ids.append(file_id)
-
-            if existing:
-                # Обновляем существующую запись
-                existing_file_ids = json.loads(existing[0]) if existing[0] else []
-                existing_caption = existing[1] if existing[1] else ""
-
-                if file_id and file_id not in existing_file_ids:
-                    existing_file_ids.append(file_id)
-                    file_ids = existing_file_ids
-
-                # Обновляем caption только если его еще нет
-                update_caption = existing_caption if existing_caption else caption
-                cursor.execute('''
-                    UPDATE posts 
-                    SET file_ids = ?, caption = ?
-                    WHERE media_group_id = ?
-                ''', (json.dumps(existing_file_ids), update_caption, media_group_id))
-            else:
-                # Создаем новую запись
-                cursor.execute('''
-                    INSERT INTO posts 
-                    (original_message_id, media_group_id, file_ids, caption, post_date)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    message.message_id,
-                    media_group_id,
-                    json.dumps(file_ids),
-                    caption,
-                    datetime.now(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
-                ))
-
-            conn.commit()
-            logger.info(
-                f"Сохранен пост {message.message_id}, группа {media_group_id}, "
-                f"файлов: {len(file_ids) if 'file_ids' in locals() else 1}, caption: '{caption}'")
+    except Exception as e:
+        logger.error(f"Ошибка в process_message: {type(e).__name__}: {str(e)}", exc_info=True)
 
-        except Exception as e:
-            logger.error(f"Ошибка сохранения поста {message.message_id}: "
-                         f"{type(e).__name__}: {str(e)}", exc_info=True)
-            if conn:
-                conn.rollback()
-        finally:
-            if conn:
-                conn.close()
-
-    @staticmethod
-    def get_unprocessed_posts() -> List[Dict]:
-        """Возвращает необработанные посты"""
-        try:
-            conn = PostManager._get_connection()
-            cursor = conn.cursor()
-
-            cursor.execute(f'''
-                SELECT 
-                    media_group_id,
-                    file_ids,
-                    caption,
-                    post_date
-                FROM posts
-                WHERE is_processed = 0
-                AND (strftime('%s','now') - strftime('%s',post_date)) >= {DELAY_MINUTES * 60}
-                ORDER BY post_date ASC
-            ''')
-
-            posts = []
-            for row in cursor.fetchall():
-                media_group_id, file_ids_json, caption, post_date = row
-                try:
-                    file_ids = json.loads(file_ids_json) if file_ids_json else []
-                except json.JSONDecodeError:
-                    file_ids = []
-
-                posts.append({
-                    'media_group_id': media_group_id,
-                    'file_ids': file_ids,
-                    'caption': caption if caption else "",
-                    'post_date': post_date
-                })
-
-            return posts
 
-        except Exception as e:
-            logger.error(f"Ошибка при получении постов: {type(e).__name__}: {str(e)}", exc_info=True)
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик входящих сообщений: передает сообщение в очередь входящих"""
+    message = update.effective_message
+
+    # O(1) поиск маршрута по id канала
+    if message.chat.id not in routes:
+        return
+
+    # Части одной медиагруппы обрабатываются по очереди, остальные сообщения - параллельно
+    key = message.media_group_id or (message.chat.id, message.message_id)
+    await context.bot_data["updates"].submit(key, functools.partial(process_message, context.application, message))
+
+
+async def call_api(method, **kwargs):
+    """Вызывает метод Bot API, замеряя его длительность"""
+    with SEND_SECONDS.time(method=method.__name__):
+        return await method(**kwargs)
+
+
+# Одиночное медиа: метод Bot API и имя параметра с файлом
+SEND_METHODS = {
+    "photo": ("send_photo", "photo"),
+    "video": ("send_video", "video"),
+    "document": ("send_document", "document"),
+    "audio": ("send_audio", "audio"),
+    "animation": ("send_animation", "animation"),
+}
+
+# Элементы альбома: классы telegram по имени
+INPUT_MEDIA = {
+    "photo": "InputMediaPhoto",
+    "video": "InputMediaVideo",
+    "document": "InputMediaDocument",
+    "audio": "InputMediaAudio",
+}
+
+# Замена файла в отправленном сообщении (editMessageMedia): GIF не бывает в альбомах, но заменяется
+EDIT_MEDIA = {**INPUT_MEDIA, "animation": "InputMediaAnimation"}
+
+
+async def send_group(bot, chat_id: int, media: List[Media], full_caption: str) -> List[tuple]:
+    """Отправляет пост в чат; возвращает (элемент медиа, отправленное сообщение) по порядку
+
+    У текстового поста элемент - None. Пустой список - отправлять нечего.
+    """
+    # Текстовое сообщение
+    if not media:
+        return [(None, await call_api(
+            bot.send_message,
+            chat_id=chat_id,
+            text=full_caption
+        ))]
+
+    # Одиночное медиа
+    if len(media) == 1:
+        item = media[0]
+        if item.media_type not in SEND_METHODS:
+            logger.warning("Не удалось отправить файл %.10s...: тип %s", item.file_id, item.media_type)
             return []
-        finally:
-            if conn:
-                conn.close()
-
-    @staticmethod
-    def mark_as_processed(media_group_id: str, forwarded_message_id: int):
-        """Помечает пост как обработанный"""
-        conn = None
-        try:
-            conn = PostManager._get_connection()
-            cursor = conn.cursor()
+        method, argument = SEND_METHODS[item.media_type]
+        return [(item, await call_api(
+            getattr(bot, method),
+            chat_id=chat_id,
+            caption=full_caption,
+            parse_mode="Markdown",
+            **{argument: item.file_id}
+        ))]
+
+    # Медиагруппа: подпись у первого отправляемого элемента
+    import telegram
+    media_group = []
+    items = []
+    for item in media:
+        input_media = INPUT_MEDIA.get(item.media_type)
+        if input_media is None:
+            logger.warning("Файл %.10s... типа %s нельзя отправить в альбоме", item.file_id, item.media_type)
+            continue
+        media_group.append(getattr(telegram, input_media)(
+            media=item.file_id,
+            caption=None if media_group else full_caption,
+            parse_mode="Markdown"
+        ))
+        items.append(item)
+
+    if not media_group:
+        return []
+
+    messages = await call_api(
+        bot.send_media_group,
+        chat_id=chat_id,
+        media=media_group
+    )
+    return list(zip(items, messages))
+
+
+async def post_failed(app: Application, post: DuePost, error: Exception):
+    """Отправляет пост в backoff, а после MAX_SEND_ATTEMPTS неудач - в dead letter"""
+    from telegram.error import RetryAfter
+    logger.error(f"Ошибка пересылки поста {post.id}: "
+                 f"{type(error).__name__}: {str(error)}", exc_info=not isinstance(error, RetryAfter))
+    next_attempt_at = await PostManager.mark_as_failed(post.id, error, RETRY_POLICY)
+    SEND_RESULTS_TOTAL.inc(result="retry" if next_attempt_at is not None else "dead",
+                           error=type(error).__name__)
+    if next_attempt_at is not None:
+        app.bot_data["scheduler"].schedule(next_attempt_at, post.id)
+
+
+async def claim_posts(posts: List[DuePost]) -> List[DuePost]:
+    """Захватывает посты перед отправкой; возвращает те, что достались этому воркеру"""
+    claimed = set(await PostManager.claim([post.id for post in posts], WORKER_ID, LEASE_SECONDS))
+    if len(claimed) < len(posts):
+        skipped = [post.id for post in posts if post.id not in claimed]
+        logger.info("Посты %s уже отправлены или отправляются другим воркером", skipped)
+        CLAIM_CONFLICTS_TOTAL.inc(len(skipped))
+    return [post for post in posts if post.id in claimed]
+
+
+async def drop_orphaned(posts: List[DuePost]):
+    """Переносит захваченные посты удаленных маршрутов в dead letter
+
+    Повторные попытки не помогут: пост больше не читается из очереди и
+    попадает в лог и метрики один раз.
+    """
+    dead = await PostManager.mark_as_dead([post.id for post in posts], "RouteRemoved")
+    if dead:
+        SEND_RESULTS_TOTAL.inc(dead, result="dead", error="RouteRemoved")
+        logger.warning("Маршруты %s удалены из config.py: посты %s перенесены в dead letter",
+                       sorted({post.route for post in posts}), [post.id for post in posts])
+
+
+async def post_sent(post: DuePost, forwarded_message_id: Optional[int], copies: List[tuple] = (),
+                    from_snapshot: bool = False) -> List[PostCopy]:
+    """Отмечает пост отправленным и обновляет метрики задержки
+
+    copies - (id исходного сообщения, id копии) для переноса правок и удалений.
+    from_snapshot - пост собран из записи очереди: возвращаются правки, которые пришли
+    после ее чтения и которые нужно перенести в копию.
+    """
+    edits = await PostManager.mark_as_processed(post.id, forwarded_message_id, copies,
+                                                post if from_snapshot else None)
+    logger.info("Пост %s успешно переслан", post.id)
+
+    now = time.time()
+    SEND_RESULTS_TOTAL.inc(result="sent")
+    DISPATCH_LAG_SECONDS.observe(max(0.0, now - post.due_at))
+    if post.created_at:
+        FORWARD_DELAY_SECONDS.observe(now - post.created_at)
+    return edits
+
+
+def full_caption_of(post: DuePost, route) -> str:
+    """Подпись поста с дополнительным текстом маршрута"""
+    return f"{post.caption}\n\n{route.additional_text}" if post.caption else route.additional_text
+
+
+async def forward_group(app: Application, post: DuePost):
+    """Пересылает пост в его целевой чат (выполняется диспетчером)
+
+    При ошибке пост уходит в backoff, а после MAX_SEND_ATTEMPTS неудач - в dead letter.
+    """
+    if not await claim_posts([post]):
+        return
+    try:
+        route = routes_by_name.get(post.route)
+        if route is None:
+            # Маршрут удален перезагрузкой config.py, пока пост ждал в очереди отправки
+            await drop_orphaned([post])
+            return
+        # Записи, созданные до маршрутов, идут в первый целевой канал
+        chat_id = post.target_chat_id or route.targets[0]
 
-            cursor.execute('''
-                UPDATE posts
-                SET is_processed = 1, forwarded_message_id = ?
-                WHERE media_group_id = ? AND is_processed = 0
-            ''', (forwarded_message_id, media_group_id))
+        logger.info(
+            "Пересылка: post_id=%s, route=%s, chat_id=%s, group_id=%s, files=%d, text='%.30s...'",
+            post.id, route.name, chat_id, post.media_group_id, len(post.media),
+            post.caption  # Логируем первые 30 символов
+        )
 
-            conn.commit()
-            logger.info(f"Пост {media_group_id} помечен как обработанный")
+        sent = await send_group(app.bot, chat_id, post.media, full_caption_of(post, route))
+        if not sent:
+            raise ValueError("Нет файлов поддерживаемых типов")
 
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении поста: {type(e).__name__}: {str(e)}", exc_info=True)
-            if conn:
-                conn.rollback()
-        finally:
-            if conn:
-                conn.close()
-
-    @staticmethod
-    def debug_db():
-        """Выводит содержимое базы данных для отладки"""
-        conn = None
-        try:
-            conn = PostManager._get_connection()
-            cursor = conn.cursor()
+    except Exception as e:
+        await post_failed(app, post, e)
+        return
+
+    copies = [(item.message_id if item else post.original_message_id, message.message_id)
+              for item, message in sent]
+    edits = await post_sent(post, sent[0][1].message_id, [(source, copy) for source, copy in copies if source],
+                            from_snapshot=True)
+    if edits:
+        # Правка пришла, пока пост ждал в диспетчере или отправлялся: ушла прежняя версия
+        logger.info("Пост %s изменен во время отправки, правка переносится в копию", post.id)
+        await edit_copies(app.bot, edits, route)
+
+
+def source_message_ids(post: DuePost) -> Optional[List[int]]:
+    """Id исходных сообщений поста для copyMessages
+
+    None - исходные сообщения неизвестны (записи старых версий), пост можно
+    только собрать заново из file_id.
+    """
+    if not post.media:
+        return [post.original_message_id] if post.original_message_id else None
+    message_ids = [item.message_id for item in post.media]
+    return message_ids if all(message_ids) else None
+
+
+def caption_format(bot, caption_entities: Optional[str], has_media: bool) -> Dict[str, Any]:
+    """Разметка подписи в целевом чате: как при отправке в текущем DISPATCH_MODE
+
+    Скопированные сообщения сохраняют исходные entities, собранные заново
+    медиа размечены Markdown, текстовые посты отправляются без разметки.
+    """
+    if DISPATCH_MODE == "send":
+        return {"parse_mode": "Markdown"} if has_media else {}
+    from telegram import MessageEntity
+    return {"entities": MessageEntity.de_list(json.loads(caption_entities), bot) if caption_entities else None}
+
+
+async def edit_caption(bot, chat_id: int, message_id: int, text: str, caption_entities: Optional[str],
+                       has_media: bool):
+    """Заменяет подпись медиа или текст отправленного сообщения"""
+    options = caption_format(bot, caption_entities, has_media)
+    if has_media:
+        if "entities" in options:
+            options["caption_entities"] = options.pop("entities")
+        await call_api(bot.edit_message_caption, chat_id=chat_id, message_id=message_id,
+                       caption=text, **options)
+    else:
+        await call_api(bot.edit_message_text, chat_id=chat_id, message_id=message_id,
+                       text=text, **options)
+
+
+async def append_suffix(bot, chat_id: int, message_id: int, post: DuePost, route):
+    """Дописывает дополнительный текст к подписи скопированного сообщения
+
+    Исходные entities сохраняются: текст добавляется в конец, и их смещения не меняются.
+    """
+    await edit_caption(bot, chat_id, message_id, full_caption_of(post, route), post.caption_entities,
+                       bool(post.media))
+
+
+async def copy_batch(app: Application, chat_id: int, source: int, posts: List[DuePost]):
+    """Копирует пачку постов одного источника в чат одним вызовом (выполняется диспетчером)
+
+    Альбомы при копировании сохраняются. В режиме copy дополнительный текст
+    маршрута дописывается правкой подписи скопированного сообщения; в режиме
+    forward пересланные сообщения не редактируются.
+    """
+    posts = await claim_posts(posts)
+    if not posts:
+        return
+
+    # copyMessages принимает id строго по возрастанию и возвращает копии в том же порядке
+    sources = sorted(((message_id, post) for post in posts for message_id in source_message_ids(post)),
+                     key=lambda pair: pair[0])
+    method = app.bot.copy_messages if DISPATCH_MODE == "copy" else app.bot.forward_messages
+    logger.info("Пересылка пачкой (%s): chat_id=%s, постов: %d, сообщений: %d",
+                DISPATCH_MODE, chat_id, len(posts), len(sources))
+    try:
+        copied = await call_api(method, chat_id=chat_id, from_chat_id=source,
+                                message_ids=[message_id for message_id, _ in sources])
+    except Exception as e:
+        for post in posts:
+            await post_failed(app, post, e)
+        return
+
+    if len(copied) != len(sources):
+        # Удаленные в источнике сообщения пропускаются без ошибки, и соответствие копий
+        # исходным id теряется. Повтор продублировал бы уже скопированные посты
+        logger.warning("Скопировано %d сообщений из %d: посты пачки %s отмечены отправленными",
+                       len(copied), len(sources), [post.id for post in posts])
+        for post in posts:
+            await post_sent(post, None)
+        return
+
+    copies = {message_id: result.message_id for (message_id, _), result in zip(sources, copied)}
+    for post in posts:
+        route = routes_by_name.get(post.route)
+        message_id = copies.get(post.caption_message_id) or copies[source_message_ids(post)[0]]
+        # Правки, пришедшие после чтения поста из очереди, возвращаются для переноса в копию
+        edits = await post_sent(post, message_id, [(source, copies[source]) for source in source_message_ids(post)],
+                                from_snapshot=DISPATCH_MODE == "copy")
+        if DISPATCH_MODE != "copy" or route is None:
+            continue
+
+        if route.additional_text:
+            # Дополнительный текст дописывается к текущей подписи, а не к прочитанной из очереди
+            changed = next((edit for edit in edits if edit.caption_changed), None)
+            if changed is not None:
+                post = post._replace(caption=changed.caption, caption_entities=changed.caption_entities)
+                edits = [edit for edit in edits if edit.media is not None]
+            try:
+                await append_suffix(app.bot, chat_id, message_id, post, route)
+            except Exception as e:
+                # Пост уже в канале: повтор отправил бы его второй раз
+                logger.warning(f"Пост {post.id} скопирован без дополнительного текста: "
+                               f"{type(e).__name__}: {str(e)}")
+        if edits:
+            logger.info("Пост %s изменен во время отправки, правка переносится в копию", post.id)
+            await edit_copies(app.bot, edits, route)
+
+
+class CopyBatches:
+    """Посты, копируемые пачками по (целевой чат, источник)
+
+    Пачка вместе с правками подписи не больше запаса корзины чата (CHAT_RATE_LIMIT)
+    и MAX_COPY_MESSAGES сообщений: одним вызовом в чат уходит не больше, чем
+    допускает его лимит.
+    """
+
+    def __init__(self, app: Application, dispatcher: Dispatcher, snapshot: float):
+        self.app = app
+        self.dispatcher = dispatcher
+        self.snapshot = snapshot
+        self.max_cost = max(1, min(MAX_COPY_MESSAGES, int(CHAT_RATE_LIMIT)))
+        self._batches: Dict[tuple, List[DuePost]] = defaultdict(list)
+        self._costs: Dict[tuple, int] = defaultdict(int)
+        self.posts = 0
+
+    def add(self, chat_id: int, source: int, post: DuePost) -> int:
+        """Добавляет пост в пачку; возвращает число постов, поставленных в очередь"""
+        if not self.dispatcher.accepts(str(post.id), self.snapshot):
+            return 0
+        key = (chat_id, source)
+        # Правки подписи расходуют лимиты чата так же, как сообщения
+        cost = len(source_message_ids(post)) + (1 if DISPATCH_MODE == "copy" else 0)
+        queued = 0
+        if key in self._batches and self._costs[key] + cost > self.max_cost:
+            queued = self._submit(key)
+        self._batches[key].append(post)
+        self._costs[key] += cost
+        self.posts += 1
+        return queued
+
+    def _submit(self, key: tuple) -> int:
+        posts = self._batches.pop(key)
+        cost = self._costs.pop(key)
+        self.posts -= len(posts)
+        chat_id, source = key
+        submitted = self.dispatcher.submit(
+            chat_id, [str(post.id) for post in posts],
+            functools.partial(copy_batch, self.app, chat_id, source, posts),
+            cost=cost, snapshot=self.snapshot
+        )
+        return len(posts) if submitted else 0
 
-            cursor.execute("SELECT * FROM posts")
-            rows = cursor.fetchall()
+    def flush(self) -> int:
+        """Ставит в очередь все неполные пачки"""
+        return sum(self._submit(key) for key in list(self._batches))
 
-            logger.info("Текущее содержимое базы данных:")
-            for row in rows:
-                logger.info(row)
 
+async def process_pending_posts(app: Application):
+    """Передает наступившие посты диспетчеру отправки (вызывается планировщиком)
+
+    Ошибка (например, чтения базы) передается планировщику: он вернет посты в расписание
+    и повторит проход.
+    """
+    logger.info("Запуск проверки отложенных постов...")
+    dispatcher = app.bot_data["dispatcher"]
+    snapshot = dispatcher.snapshot()
+
+    batches = CopyBatches(app, dispatcher, snapshot)
+
+    found = queued = 0
+    orphaned = []
+    # Отправка начинается с первой страницы; следующая читается, когда очередь разгрузится
+    async for post in PostManager.iter_due_posts(DUE_PAGE_SIZE):
+        found += 1
+        route = routes_by_name.get(post.route)
+        if route is None:
+            orphaned.append(post)
+            continue
+        chat_id = post.target_chat_id or route.targets[0]
+        if DISPATCH_MODE != "send" and source_message_ids(post):
+            # Наступившие посты одного чата копируются вместе, вызовов API - по числу пачек
+            queued += batches.add(chat_id, route.source, post)
+        else:
+            # Альбом занимает в лимитах Telegram столько сообщений, сколько в нем файлов
+            queued += dispatcher.submit(
+                chat_id, str(post.id),
+                functools.partial(forward_group, app, post),
+                cost=max(1, len(post.media)),
+                snapshot=snapshot
+            )
+        if len(dispatcher) + batches.posts >= DUE_PAGE_SIZE:
+            queued += batches.flush()
+            await dispatcher.wait_below(DUE_PAGE_SIZE)
+    queued += batches.flush()
+    # Посты удаленных маршрутов не отправляются, а уходят в dead letter одной записью
+    if orphaned:
+        await drop_orphaned(await claim_posts(orphaned))
+
+    logger.info("Найдено %d постов, в очередь отправки добавлено %d, всего в очереди: %d",
+                found, queued, len(dispatcher))
+
+
+async def edit_copy(bot, copy: PostCopy, route):
+    """Переносит правку в отправленную копию поста
+
+    Замененный файл - один вызов editMessageMedia (вместе с подписью, если
+    она в том же сообщении), измененная подпись - один вызов editMessageCaption/Text.
+    """
+    chat_id = copy.target_chat_id or route.targets[0]
+    full_caption = full_caption_of(copy, route)
+    caption_in_message = copy.message_id == copy.caption_message_id
+    if copy.media is not None and copy.message_id is not None:
+        import telegram
+        input_media = EDIT_MEDIA.get(copy.media.media_type)
+        if input_media is None:
+            logger.warning("Файл типа %s нельзя заменить в сообщении %s", copy.media.media_type, copy.message_id)
+        else:
+            options = caption_format(bot, copy.caption_entities, True) if caption_in_message else {}
+            if "entities" in options:
+                options["caption_entities"] = options.pop("entities")
+            # editMessageMedia заменяет и подпись: у сообщения с подписью поста она передается заново
+            media = getattr(telegram, input_media)(
+                media=copy.media.file_id, caption=full_caption if caption_in_message else None, **options
+            )
+            await call_api(bot.edit_message_media, chat_id=chat_id, message_id=copy.message_id, media=media)
+            if caption_in_message:
+                return
+    if copy.caption_changed and copy.caption_message_id is not None:
+        await edit_caption(bot, chat_id, copy.caption_message_id, full_caption, copy.caption_entities,
+                           copy.has_media)
+
+
+async def edit_copies(bot, copies: List[PostCopy], route):
+    """Переносит правки в копии по одной; ошибка одной копии не мешает остальным"""
+    for copy in copies:
+        try:
+            await edit_copy(bot, copy, route)
+            EDITS_TOTAL.inc(action="edit", target="sent")
         except Exception as e:
-            logger.error(f"Ошибка при чтении базы данных: {type(e).__name__}: {str(e)}", exc_info=True)
-        finally:
-            if conn:
-                conn.close()
-
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик входящих сообщений"""
+            if "not modified" in str(e):
+                # copyMessages успел скопировать уже исправленное сообщение
+                logger.debug("Копия поста %s уже совпадает с исходным сообщением", copy.post_id)
+                continue
+            EDITS_TOTAL.inc(action="edit", target="failed")
+            logger.warning(f"Правка поста {copy.post_id} не перенесена в чат {copy.target_chat_id}: "
+                           f"{type(e).__name__}: {str(e)}")
+
+
+async def process_edit(app: Application, message):
+    """Переносит правку поста источника в базу и в отправленные копии (выполняется очередью входящих)
+
+    Неотправленные записи меняются на месте и уйдут уже исправленными. Если пост
+    уже прочитан диспетчером или отправляется, правку после отправки переносят
+    forward_group и copy_batch.
+    """
     try:
-        message = update.effective_message
-
-        if message.chat.id != SOURCE_CHANNEL_ID:
+        route = routes.get(message.chat.id)
+        if route is None:
             return
 
-        # Для медиагрупп - обрабатываем все сообщения, даже без ключевых слов
-        if message.media_group_id:
-            logger.info(f"Получено сообщение медиагруппы: {message.message_id}")
-            PostManager.save_post(message)
-            return
-
-        # Для обычных сообщений проверяем ключевые слова
-        has_keyword = False
-        if message.caption and any(keyword.lower() in message.caption.lower() for keyword in KEYWORDS):
-            has_keyword = True
-        elif message.text and any(keyword.lower() in message.text.lower() for keyword in KEYWORDS):
-            has_keyword = True
-
-        if has_keyword:
-            logger.info(f"Найден пост с ключевым словом: {message.message_id}")
-            PostManager.save_post(message)
-        else:
-            logger.info("Ключевые слова не найдены, пропускаем сообщение")
+        albums = app.bot_data.get("albums")
+        if message.media_group_id and albums is not None:
+            # Альбом еще собирается: он сохранится уже с исправленной частью
+            if albums.replace(message):
+                logger.info("Правка сообщения %s применена к собираемому альбому", message.message_id)
+                return
+            # Собранный альбом может еще сохраняться: правка применяется к записанному посту
+            await albums.settled(message.media_group_id)
+
+        updated, copies = await PostManager.apply_edit(message, route)
+        if updated:
+            EDITS_TOTAL.inc(updated, action="edit", target="pending")
+        if copies and DISPATCH_MODE == "forward":
+            logger.info("Правка сообщения %s не переносится: пересланные сообщения не редактируются",
+                        message.message_id)
+            copies = []
+
+        await edit_copies(app.bot, copies, route)
+        logger.info("Правка сообщения %s: изменено неотправленных записей %d, отправленных копий %d",
+                    message.message_id, updated, len(copies))
 
     except Exception as e:
-        logger.error(f"Ошибка в handle_message: {type(e).__name__}: {str(e)}", exc_info=True)
+        logger.error(f"Ошибка в process_edit: {type(e).__name__}: {str(e)}", exc_info=True)
+
+
+async def handle_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик правок постов исходных каналов: передает правку в очередь входящих"""
+    message = update.effective_message
+    if message.chat.id not in routes:
+        return
+
+    # Ключ тот же, что у самого сообщения: правка применяется после его сохранения
+    key = message.media_group_id or (message.chat.id, message.message_id)
+    await context.bot_data["updates"].submit(key, functools.partial(process_edit, context.application, message))
+
+
+async def delete_copies(bot, route, message_ids: List[int]) -> Tuple[int, int]:
+    """Убирает исходные сообщения из неотправленных постов и удаляет их копии в целевых каналах
+
+    Возвращает число измененных записей и удаленных копий.
+    """
+    updated, copies = await PostManager.apply_delete(route, message_ids)
+    by_chat = defaultdict(list)
+    for chat_id, message_id in copies:
+        by_chat[chat_id or route.targets[0]].append(message_id)
+
+    deleted = 0
+    for chat_id, chat_message_ids in by_chat.items():
+        # deleteMessages удаляет до 100 сообщений за вызов
+        for start in range(0, len(chat_message_ids), MAX_COPY_MESSAGES):
+            part = chat_message_ids[start:start + MAX_COPY_MESSAGES]
+            await call_api(bot.delete_messages, chat_id=chat_id, message_ids=part)
+            deleted += len(part)
+    EDITS_TOTAL.inc(updated, action="delete", target="pending")
+    EDITS_TOTAL.inc(deleted, action="delete", target="sent")
+    return updated, deleted
+
+
+async def run_delete(argv: List[str]):
+    """python main.py delete: удаленные в источнике сообщения убираются из очереди и целевых каналов
+
+    Bot API не сообщает ботам об удалении сообщений в каналах, поэтому
+    удаление переносится командой по id исходных сообщений.
+    """
+    parser = argparse.ArgumentParser(prog="main.py delete", description=run_delete.__doc__)
+    parser.add_argument("message_ids", nargs="+", type=int, help="Id сообщений в исходном канале")
+    parser.add_argument("--route", default=None, help="Маршрут исходного канала (если маршрутов несколько)")
+    args = parser.parse_args(argv)
+
+    if args.route is None and len(routes_by_name) > 1:
+        parser.error(f"укажите --route: {sorted(routes_by_name)}")
+    route = routes_by_name.get(args.route) if args.route else next(iter(routes_by_name.values()))
+    if route is None:
+        parser.error(f"маршрут {args.route} не задан в config.py")
+
+    from telegram import Bot
+    async with Bot(BOT_TOKEN) as bot:
+        updated, deleted = await delete_copies(bot, route, args.message_ids)
+    print(f"{route.name}: изменено неотправленных записей {updated}, удалено сообщений в целевых каналах {deleted}")
+
+
+def create_application(base_url: Optional[str] = None) -> Application:
+    """Создает Application с обработчиком сообщений исходных каналов
+
+    Application еще не инициализирован и к Bot API не обращается, см. start_application.
+    """
+    from telegram.ext import Application, MessageHandler, filters
+
+    # Ограниченная очередь обновлений: пока очередь входящих заполнена, прием приостанавливается
+    builder = Application.builder().token(BOT_TOKEN).update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+    if base_url:
+        builder = builder.base_url(base_url)  # Например, локальный Bot API для бенчмарков
+    app = builder.build()
+
+    # Список каналов меняется при перезагрузке config.py
+    chat_filter = app.bot_data["chat_filter"] = filters.Chat(chat_id=list(routes))
+
+    # Обработчик сообщений
+    app.add_handler(MessageHandler(
+        chat_filter & ~filters.UpdateType.EDITED & (
+                filters.PHOTO | filters.VIDEO | filters.Document.ALL |
+                filters.AUDIO | filters.CAPTION | filters.TEXT
+        ),
+        handle_message
+    ))
+    # Правки постов источников переносятся в очередь и в отправленные копии
+    app.add_handler(MessageHandler(chat_filter & filters.UpdateType.EDITED, handle_edit))
+    return app
+
+
+def prepare_config(new_config) -> Dict[str, Any]:
+    """Проверяет новую версию config.py и готовит значения для подмены настроек
+
+    Исключение означает, что версия отклонена и работают прежние настройки.
+    """
+    values = {}
+    for name, default in RELOADABLE_SETTINGS.items():
+        values[name] = getattr(new_config, name) if default is None else getattr(new_config, name, default)
+
+    for name in ("DELAY_MINUTES", "CHECK_INTERVAL", "MAX_SEND_ATTEMPTS", "RETRY_MAX_DELAY_MINUTES"):
+        if not isinstance(values[name], int) or values[name] < 0:
+            raise ValueError(f"{name} должен быть неотрицательным целым, задан {values[name]!r}")
+    if not isinstance(values["ALBUM_QUIET_SECONDS"], (int, float)) or values["ALBUM_QUIET_SECONDS"] <= 0:
+        raise ValueError(f"ALBUM_QUIET_SECONDS должен быть положительным, задан {values['ALBUM_QUIET_SECONDS']!r}")
+    for name in ("KEYWORDS", "EXCLUDE_KEYWORDS", "ROUTES"):
+        if not isinstance(values[name], (list, tuple)):
+            raise ValueError(f"{name} должен быть списком")
+    if values["DISPATCH_MODE"] not in DISPATCH_MODES:
+        raise ValueError(f"DISPATCH_MODE должен быть одним из {DISPATCH_MODES}, задан {values['DISPATCH_MODE']!r}")
+    for level in (values["LOG_LEVEL"], *values["LOG_LEVELS"].values()):
+        if not isinstance(logging.getLevelName(str(level).upper()), int):
+            raise ValueError(f"Неизвестный уровень логирования {level!r}")
+
+    # Маршруты проверяются так же, как при запуске; матчеры без изменений переиспользуются
+    values["routes"] = build_routes(
+        values["ROUTES"], SOURCE_CHANNEL_ID, TARGET_CHANNEL_ID,
+        keywords=values["KEYWORDS"],
+        exclude_keywords=values["EXCLUDE_KEYWORDS"],
+        whole_words=values["KEYWORDS_WHOLE_WORDS"],
+        delay_minutes=values["DELAY_MINUTES"],
+        additional_text=values["ADDITIONAL_TEXT"],
+        previous=routes
+    )
+    values["routes_by_name"] = {route.name: route for route in values["routes"].values()}
+    values["RETRY_POLICY"] = RetryPolicy(
+        base_delay=values["CHECK_INTERVAL"] * 60,
+        max_delay=values["RETRY_MAX_DELAY_MINUTES"] * 60,
+        max_attempts=values["MAX_SEND_ATTEMPTS"]
+    )
+    return values
+
+
+async def reload_config(app: Application, new_config):
+    """Применяет новую версию config.py без перезапуска (вызывается ConfigWatcher)"""
+    values = prepare_config(new_config)
+    changed = [name for name in RELOADABLE_SETTINGS if values[name] != globals()[name]]
+    restart = [name for name in RESTART_SETTINGS
+               if hasattr(new_config, name) and getattr(new_config, name) != globals()[name]]
+    if restart:
+        logger.warning("config.py: изменения %s вступят в силу после перезапуска", restart)
+    if not changed:
+        return
+
+    old_routes = routes_by_name
+    # Одна синхронная подмена: обработчики видят либо все старые, либо все новые настройки
+    globals().update(values)
+
+    set_levels(LOG_LEVEL, LOG_LEVELS)
+    chat_filter = app.bot_data.get("chat_filter")
+    if chat_filter is not None:
+        chat_filter.remove_chat_ids(set(chat_filter.chat_ids) - set(routes))
+        chat_filter.add_chat_ids(set(routes) - set(chat_filter.chat_ids))
+    if "albums" in app.bot_data:
+        app.bot_data["albums"].quiet_seconds = ALBUM_QUIET_SECONDS
+
+    removed = sorted(set(old_routes) - set(routes_by_name))
+    if removed:
+        logger.warning("config.py: удалены маршруты %s, их неотправленные посты не будут отправлены", removed)
+
+    # Новая задержка применяется и к ожидающим постам: due_at пересчитывается по маршруту
+    rescheduled = 0
+    for route in routes_by_name.values():
+        old = old_routes.get(route.name)
+        if old is not None and old.delay_minutes != route.delay_minutes:
+            rescheduled += await PostManager.reschedule_route(route.name, route.delay_minutes * 60)
+    if rescheduled and "scheduler" in app.bot_data:
+        app.bot_data["scheduler"].load(await PostManager.get_schedule())
+
+    # Новые ключевые слова применяются и к постам за REMATCH_HOURS из индекса подписей
+    rematched = 0
+    if "caption_index" in app.bot_data and REMATCH_HOURS:
+        since = int(time.time()) - REMATCH_HOURS * 3600
+        for route in routes_by_name.values():
+            old = old_routes.get(route.name)
+            if old is not None and old.matcher is route.matcher:
+                continue
+            _, created = await rematch(route, since, dedup=app.bot_data.get("dedup"))
+            rematched += len(created)
+            if "scheduler" in app.bot_data:
+                for post_id, due_at in created:
+                    app.bot_data["scheduler"].schedule(due_at, post_id)
+
+    logger.info("config.py перезагружен: изменены %s, маршрутов: %d, перепланировано постов: %d, "
+                "найдено по индексу подписей: %d", changed, len(routes), rescheduled, rematched)
+
+
+async def prepare_pipeline(app: Application):
+    """Создает сборщик альбомов, диспетчер и планировщик по WORKER_ROLE и загружает их состояние из базы
+
+    Bot API не нужен: выполняется, пока Application инициализируется (см. start_application).
+    """
+    loads = []
+    if WORKER_ROLE != "ingest":
+        # Планировщик отправки: куча due_at восстанавливается из базы. Посты, сохраненные
+        # другим процессом или командой rematch, он находит, перечитывая расписание
+        scheduler = DispatchScheduler(
+            lambda: process_pending_posts(app),
+            refresh=PostManager.get_schedule,
+            refresh_interval=SCHEDULE_REFRESH_SECONDS
+        )
 
+        async def load_schedule():
+            # Посты, захваченные до перезапуска, уходят в dead letter до первой отправки:
+            # неизвестно, дошли ли они до Telegram
+            await reclaim_leases(WORKER_ID)
+            scheduler.load(await PostManager.get_schedule())
+
+        loads.append(load_schedule())
+        app.bot_data["scheduler"] = scheduler
+        app.bot_data["dispatcher"] = Dispatcher(
+            workers=DISPATCH_WORKERS,
+            global_rate=GLOBAL_RATE_LIMIT,
+            chat_rate_per_minute=CHAT_RATE_LIMIT
+        )
 
-async def process_pending_posts(app: Application):
-    PostManager.debug_unprocessed_posts()
-    """Периодическая задача для обработки отложенных постов"""
+    if WORKER_ROLE != "dispatch":
+        if DEDUP_WINDOW_HOURS:
+            dedup = ContentDeduplicator(DEDUP_WINDOW_HOURS * 3600, cache_size=DEDUP_CACHE_SIZE)
+            loads.append(dedup.load())
+            app.bot_data["dedup"] = dedup
+        app.bot_data["albums"] = AlbumAssembler(
+            lambda messages, late: save_messages(app, messages, late),
+            quiet_seconds=ALBUM_QUIET_SECONDS
+        )
+        if CAPTION_INDEX_DAYS:
+            app.bot_data["caption_index"] = CaptionIndex(CAPTION_INDEX_DAYS * 86400)
+        app.bot_data["updates"] = InboundQueue(workers=UPDATE_WORKERS, limit=UPDATE_QUEUE_SIZE)
+
+    # Расписание и отпечатки читаются разными потоками чтения одновременно
+    await asyncio.gather(*loads)
+
+
+async def start_application(app: Application) -> Optional[asyncio.Task]:
+    """Открывает базу и инициализирует Application одновременно, затем запускает планировщик
+
+    Открытие базы, миграции схемы и загрузка состояния конвейера идут в
+    потоках базы, пока Application ждет ответа getMe. Планировщик
+    запускается, когда готово и то и другое. Возвращает его задачу
+    (None в режиме ingest).
+    """
+    async def open_database():
+        db.batch_size = DB_COMMIT_BATCH
+        db.commit_delay = DB_COMMIT_DELAY_MS / 1000
+        await db.open(init_db, DELAY_MINUTES * 60)
+        await prepare_pipeline(app)
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(open_database()), asyncio.create_task(app.initialize())]
     try:
-        logger.info("Запуск проверки отложенных постов...")
-        unprocessed_posts = PostManager.get_unprocessed_posts()
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Вторая половина не должна продолжаться, пока вызывающий закрывает базу и Application
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    logger.info("База и Application готовы за %.2f с", time.perf_counter() - started)
+
+    if "scheduler" not in app.bot_data:
+        return None
+    return asyncio.create_task(app.bot_data["scheduler"].run())
+
+
+async def stop_pipeline(app: Application, scheduler_task: Optional[asyncio.Task]):
+    """Сохраняет принятые сообщения и альбомы и останавливает планировщик и диспетчер"""
+    # Дообрабатываем принятые сообщения: Telegram их уже не пришлет
+    if "updates" in app.bot_data:
+        await app.bot_data["updates"].join()
+
+    # Сохраняем альбомы, которые еще собирались в памяти
+    if "albums" in app.bot_data:
+        await app.bot_data["albums"].flush_all()
+
+    if scheduler_task:
+        scheduler_task.cancel()
+        try:
+            await scheduler_task
+        except asyncio.CancelledError:
+            pass
 
-        # Группируем по media_group_id
-        grouped_posts = {}
-        for post in unprocessed_posts:
-            if post['media_group_id'] not in grouped_posts:
-                grouped_posts[post['media_group_id']] = []
-            grouped_posts[post['media_group_id']].append(post)
+    if "dispatcher" in app.bot_data:
+        await app.bot_data["dispatcher"].close()
 
-        logger.info(f"Найдено {len(grouped_posts)} групп постов для обработки")
+    if "dedup" in app.bot_data:
+        await app.bot_data["dedup"].close()
 
-        bot = app.bot
 
-        for media_group_id, posts in grouped_posts.items():
-            try:
-                # Берем первый пост группы для получения caption
-                main_post = posts[0]
-                original_caption = main_post['caption'] or ""
-
-                # Формируем полную подпись
-                full_caption = f"{original_caption}\n\n{ADDITIONAL_TEXT}" if original_caption else ADDITIONAL_TEXT
-
-                # Собираем все file_ids из группы
-                all_file_ids = []
-                for post in posts:
-                    all_file_ids.extend(post['file_ids'])
-
-                logger.info(
-                    f"Пересылка: group_id={media_group_id}, "
-                    f"files={len(all_file_ids)}, "
-                    f"text='{original_caption[:30]}...'"  # Логируем первые 30 символов
-                )
+async def collect_metrics(app: Application):
+    """Обновляет gauge перед выдачей /metrics"""
+    for state, count in (await PostManager.count_states()).items():
+        POSTS.set(count, state=state)
+    DB_SIZE_BYTES.set(db.size())
+    for queue in ("scheduler", "dispatcher", "albums", "dedup", "updates"):
+        if queue in app.bot_data:
+            QUEUE_SIZE.set(len(app.bot_data[queue]), queue=queue)
+    QUEUE_SIZE.set(app.update_queue.qsize(), queue="update_queue")
 
-                # Текстовое сообщение
-                if not all_file_ids:
-                    msg = await bot.send_message(
-                        chat_id=TARGET_CHANNEL_ID,
-                        text=full_caption
-                    )
-
-                # Одиночное медиа
-                elif len(all_file_ids) == 1:
-                    msg = None  # Инициализируем переменную
-                    try:
-                        file_id = all_file_ids[0]
-                        if file_id.startswith('AgAC'):  # Фото
-                            msg = await bot.send_photo(
-                                chat_id=TARGET_CHANNEL_ID,
-                                photo=file_id,
-                                caption=full_caption,
-                                parse_mode="Markdown"
-                            )
-                        elif file_id.startswith('BAAC'):  # Видео
-                            msg = await bot.send_video(
-                                chat_id=TARGET_CHANNEL_ID,
-                                video=file_id,
-                                caption=full_caption,
-                                parse_mode="Markdown"
-                            )
-                        elif file_id.startswith('BQAC'):  # Документы
-                            msg = await bot.send_document(
-                                chat_id=TARGET_CHANNEL_ID,
-                                document=file_id,
-                                caption=full_caption,
-                                parse_mode="Markdown"
-                            )
-                        elif file_id.startswith('CQAC'):  # Аудио
-                            msg = await bot.send_audio(
-                                chat_id=TARGET_CHANNEL_ID,
-                                audio=file_id,
-                                caption=full_caption,
-                                parse_mode="Markdown"
-                            )
-
-                        if msg:
-                            PostManager.mark_as_processed(media_group_id, msg.message_id)
-                            logger.info(f"Пост {media_group_id} успешно переслан")
-                        else:
-                            logger.warning(f"Не удалось отправить файл {file_id[:10]}...")
-
-                    except Exception as e:
-                        file_id = all_file_ids[0]
-                        logger.error(f"Ошибка отправки файла {file_id[:10] if file_id else 'unknown'}: "
-                                     f"{type(e).__name__}: {str(e)}", exc_info=True)
-
-                # Медиагруппа
-                else:
-                    media_group = []
-                    for i, file_id in enumerate(all_file_ids):
-                        if file_id.startswith('AgAC'):  # Фото
-                            media = InputMediaPhoto(
-                                media=file_id,
-                                caption=full_caption if i == 0 else None,
-                                parse_mode="Markdown"
-                            )
-                        elif file_id.startswith('BAAC'):  # Видео
-                            media = InputMediaVideo(
-                                media=file_id,
-                                caption=full_caption if i == 0 else None,
-                                parse_mode="Markdown"
-                            )
-                        elif file_id.startswith('BQAC'):  # Документы
-                            media = InputMediaDocument(
-                                media=file_id,
-                                caption=full_caption if i == 0 else None,
-                                parse_mode="Markdown"
-                            )
-                        else:
-                            continue  # Пропускаем аудио и неизвестные типы
-
-                        media_group.append(media)
-
-                    if media_group:
-                        try:
-                            messages = await bot.send_media_group(
-                                chat_id=TARGET_CHANNEL_ID,
-                                media=media_group
-                            )
-                            msg = messages[0] if messages else None
-                        except Exception as e:
-                            logger.error(f"Ошибка отправки медиагруппы: "
-                                         f"{type(e).__name__}: {str(e)}", exc_info=True)
-
-                if msg:
-                    try:
-                        if 'msg' in locals():
-                            PostManager.mark_as_processed(media_group_id, msg.message_id)
-                            logger.info(f"Пост {media_group_id} успешно переслан")
-                        else:
-                            logger.error("Сообщение не было отправлено")
-                    except Exception as e:
-                        logger.error(f"Ошибка при пометке поста: "
-                                     f"{type(e).__name__}: {str(e)}", exc_info=True)
-                    logger.info(f"Группа {media_group_id} успешно переслана")
-                else:
-                    logger.error(f"Не удалось отправить группу {media_group_id}")
 
-            except Exception as e:
-                logger.error(f"Ошибка пересылки группы {media_group_id}: "
-                             f"{type(e).__name__}: {str(e)}", exc_info=True)
+async def run_bot(base_url: Optional[str] = None):
+    """Основная асинхронная функция для запуска бота
 
-    except Exception as e:
-        logger.error(f"Ошибка process_pending_posts: {type(e).__name__}: {str(e)}", exc_info=True)
-
-
-async def run_bot():
-    """Основная асинхронная функция для запуска бота"""
+    base_url - другой адрес Bot API (например, локальный для бенчмарков).
+    """
     # Для Windows
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
     app = None
-    periodic_task = None
+    scheduler_task = None
+    retention_task = None
+    lease_task = None
+    config_task = None
+    webhook_server = None
+    metrics_server = None
 
     try:
-        app = Application.builder().token(BOT_TOKEN).build()
-
-        # Обработчик сообщений
-        app.add_handler(MessageHandler(
-            filters.Chat(chat_id=SOURCE_CHANNEL_ID) & (
-                    filters.PHOTO | filters.VIDEO | filters.Document.ALL |
-                    filters.AUDIO | filters.CAPTION | filters.TEXT
-            ),
-            handle_message
-        ))
-
-        # Инициализируем приложение перед запуском
-        await app.initialize()
-
-        # Создаем фоновую задачу
-        periodic_task = asyncio.create_task(run_periodic_check(app))
-
-        logger.info("Бот запущен")
-        logger.info(f"Конфигурация: задержка={DELAY_MINUTES} мин, ключевые слова={KEYWORDS}")
+        app = create_application(base_url)
+
+        # База с миграциями открывается, пока инициализируется приложение
+        scheduler_task = await start_application(app)
+        if "scheduler" in app.bot_data:
+            lease_task = asyncio.create_task(run_lease_reclaim(LEASE_SECONDS / 2))
+        if CONFIG_RELOAD_SECONDS:
+            watcher = ConfigWatcher(Path(config.__file__), functools.partial(reload_config, app),
+                                    interval=CONFIG_RELOAD_SECONDS)
+            config_task = asyncio.create_task(watcher.run())
+        # Архивирует базу один процесс: тот, что принимает обновления
+        if RETENTION_DAYS and WORKER_ROLE != "dispatch":
+            retention_task = asyncio.create_task(
+                run_retention(RETENTION_POLICY, RETENTION_INTERVAL_MINUTES * 60)
+            )
+
+        if METRICS_PORT:
+            REGISTRY.add_collector(functools.partial(collect_metrics, app))
+            metrics_server = MetricsServer(REGISTRY, host=METRICS_LISTEN, port=METRICS_PORT)
+            await metrics_server.start()
+
+        logger.info("Бот запущен: роль %s, воркер %s", WORKER_ROLE, WORKER_ID)
+        for route in routes.values():
+            logger.info(f"Маршрут {route.name}: {route.source} -> {list(route.targets)}, "
+                        f"задержка={route.delay_minutes} мин")
         await app.start()
-        await app.updater.start_polling()
+        if WORKER_ROLE == "dispatch":
+            logger.info("Режим dispatch: обновления получает процесс ingest")
+        elif UPDATE_MODE == "webhook":
+            # Обновления приходят POST-запросами и попадают в ту же очередь, что и при polling
+            from webhook import WebhookServer
+            webhook_server = WebhookServer(
+                app, WEBHOOK_PATH, WEBHOOK_SECRET,
+                host=WEBHOOK_LISTEN, port=WEBHOOK_PORT
+            )
+            await webhook_server.start()
+            if WEBHOOK_URL:
+                await app.bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip("/") + webhook_server.path,
+                    secret_token=WEBHOOK_SECRET or None
+                )
+            else:
+                logger.warning("WEBHOOK_URL не задан: webhook в Telegram не регистрируется")
+        else:
+            await app.updater.start_polling()
 
         # Бесконечный цикл, пока бот работает
         while True:
@@ -501,75 +1107,69 @@ async def run_bot():
         logger.error(f"Ошибка при работе бота: {type(e).__name__}: {str(e)}", exc_info=True)
     finally:
         # Корректное завершение
-        if periodic_task:
-            periodic_task.cancel()
-            try:
-                await periodic_task
-            except asyncio.CancelledError:
-                pass
+        if webhook_server:
+            await webhook_server.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        for task in (retention_task, lease_task, config_task):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
 
         if app:
             try:
-                await app.updater.stop()
-                await app.stop()
+                if app.updater.running:
+                    await app.updater.stop()
+                if app.running:
+                    await app.stop()
+                await stop_pipeline(app, scheduler_task)
                 await app.shutdown()
             except Exception as e:
                 logger.error(f"Ошибка при остановке бота: {type(e).__name__}: {str(e)}", exc_info=True)
 
+        # Дописываем очередь записи: сохраненные альбомы и отметки об отправке
+        try:
+            await db.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи очереди в базу: {type(e).__name__}: {str(e)}", exc_info=True)
+        db.close()
         logger.info("Бот полностью остановлен")
 
 
-async def run_periodic_check(app: Application):
-    """Фоновая задача с периодической проверкой"""
-    while True:
-        try:
-            await process_pending_posts(app)
-            await asyncio.sleep(CHECK_INTERVAL * 60)  # Интервал проверки
-        except asyncio.CancelledError:
-            logger.info("Периодическая проверка остановлена")
-            break
-        except Exception as e:
-            logger.error(f"Ошибка в периодической проверке: {type(e).__name__}: {str(e)}", exc_info=True)
-            await asyncio.sleep(5)  # Задержка при ошибке
+# Команды над базой без запуска бота: python main.py <команда> [параметры]
+COMMANDS = {
+    "report": run_report,                                     # Отчет о задержках по трассе постов
+    "search": run_search,                                     # Поиск по индексу подписей
+    # Старые посты под текущие ключевые слова (повторы отсеиваются, как при приеме)
+    "rematch": lambda argv: run_rematch(argv, routes_by_name, DEDUP_WINDOW_HOURS * 3600),
+    "delete": run_delete,                                     # Удаление постов, удаленных в источнике
+}
 
 
-@staticmethod
-def check_media_groups():
-    """Проверяет целостность медиагрупп в базе"""
+async def run_command(command: str, argv: List[str]):
+    """Выполняет команду из COMMANDS с открытой базой"""
+    await db.open(init_db, DELAY_MINUTES * 60)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT media_group_id, COUNT(*) as cnt 
-            FROM posts 
-            WHERE media_group_id NOT LIKE '%-%' 
-            GROUP BY media_group_id 
-            HAVING cnt > 1
-        ''')
-
-        groups = cursor.fetchall()
-        logger.info(f"Найдено {len(groups)} медиагрупп в базе:")
-        for group_id, count in groups:
-            logger.info(f"Группа {group_id}: {count} элементов")
-
-    except Exception as e:
-        logger.error(f"Ошибка проверки медиагрупп: {type(e).__name__}: {str(e)}", exc_info=True)
+        await COMMANDS[command](argv)
     finally:
-        if conn:
-            conn.close()
+        db.close()
 
 
 def main():
     """Точка входа"""
     # PostManager.clear_db() # Очистка базы данных
     try:
+        configure()
+        if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+            asyncio.run(run_command(sys.argv[1], sys.argv[2:]))
+            return
         asyncio.run(run_bot())
     except KeyboardInterrupt:
         logger.info("Бот остановлен по запросу пользователя")
     except Exception as e:
         logger.error(f"Критическая ошибка: {type(e).__name__}: {str(e)}", exc_info=True)
     finally:
+        stop_logging()
         logging.shutdown()
 
 
@@ -0,0 +1,211 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    # aiohttp импортируется при запуске сервера: метрики нужны и командам без HTTP
+    from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм в секундах: от миллисекунд (база) до минут (задержка пересылки)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Базовая метрика с метками; значения хранятся по кортежу значений меток
+
+    Все обновления происходят в потоке event loop, поэтому блокировки не нужны.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: счетчики по корзинам (+Inf последняя), сумма
+        self._values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1][0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока (в том числе с await внутри)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и функций, обновляющих gauge перед выдачей"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]):
+        """collector вызывается при каждом запросе /metrics"""
+        self._collectors.append(collector)
+
+    async def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {type(e).__name__}: {str(e)}", exc_info=True)
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLE_MESSAGE_SECONDS = REGISTRY.register(Histogram(
+    "tgbot_handle_message_seconds", "Время обработки входящего сообщения", ["route"]))
+MESSAGES_TOTAL = REGISTRY.register(Counter(
+    "tgbot_messages_total", "Входящие посты по результату фильтрации", ["route", "result"]))
+INBOUND_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "tgbot_inbound_wait_seconds", "Ожидание места в очереди входящих сообщений (backpressure)"))
+INBOUND_REJECTED_TOTAL = REGISTRY.register(Counter(
+    "tgbot_inbound_rejected_total", "Обновления webhook, отклоненные из-за заполненной очереди"))
+DEDUP_LOOKUPS_TOTAL = REGISTRY.register(Counter(
+    "tgbot_dedup_lookups_total", "Проверки на повтор: из кэша или с запросом к базе", ["source"]))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "tgbot_db_seconds", "Длительность операций с базой", ["operation"]))
+DB_COMMIT_BATCH = REGISTRY.register(Histogram(
+    "tgbot_db_commit_batch_size", "Операций записи в одном коммите",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)))
+SEND_SECONDS = REGISTRY.register(Histogram(
+    "tgbot_send_seconds", "Длительность вызовов Bot API при пересылке", ["method"]))
+SEND_RESULTS_TOTAL = REGISTRY.register(Counter(
+    "tgbot_send_results_total", "Результаты пересылки постов", ["result", "error"]))
+DISPATCH_LAG_SECONDS = REGISTRY.register(Histogram(
+    "tgbot_dispatch_lag_seconds", "Опоздание отправки относительно due_at", buckets=LAG_BUCKETS))
+FORWARD_DELAY_SECONDS = REGISTRY.register(Histogram(
+    "tgbot_forward_delay_seconds", "Время от получения поста до пересылки", buckets=LAG_BUCKETS))
+EDITS_TOTAL = REGISTRY.register(Counter(
+    "tgbot_edits_total", "Правки и удаления постов источника: в очереди, в отправленных копиях, ошибки",
+    ["action", "target"]))
+CLAIM_CONFLICTS_TOTAL = REGISTRY.register(Counter(
+    "tgbot_claim_conflicts_total", "Посты, которые перед отправкой уже захватил другой воркер"))
+LEASES_RECLAIMED_TOTAL = REGISTRY.register(Counter(
+    "tgbot_leases_reclaimed_total", "Посты с истекшей арендой, перенесенные в dead letter"))
+CONFIG_RELOADS_TOTAL = REGISTRY.register(Counter(
+    "tgbot_config_reloads_total", "Перезагрузки config.py без перезапуска", ["result"]))
+POSTS = REGISTRY.register(Gauge(
+    "tgbot_posts", "Посты в базе по состоянию", ["state"]))
+QUEUE_SIZE = REGISTRY.register(Gauge(
+    "tgbot_queue_size", "Размер очередей в памяти", ["queue"]))
+RETENTION_ARCHIVED_TOTAL = REGISTRY.register(Counter(
+    "tgbot_retention_archived_total", "Посты, перенесенные из posts в архив"))
+RETENTION_RECLAIMED_BYTES_TOTAL = REGISTRY.register(Counter(
+    "tgbot_retention_reclaimed_bytes_total", "Байты, освобожденные сжатием базы"))
+DB_SIZE_BYTES = REGISTRY.register(Gauge(
+    "tgbot_db_size_bytes", "Размер файла базы вместе с WAL"))
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в формате Prometheus"""
+
+    def __init__(self, registry: Registry, host: str = "0.0.0.0", port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional["web.AppRunner"] = None
+
+    async def handle(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+        return web.Response(text=await self.registry.render(), content_type="text/plain",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        from aiohttp import web
+        server = web.Application()
+        server.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на {self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,169 @@
+"""Отчет о задержках постов по трассе post_events
+
+    python main.py report                   # перцентили этапов за последние 24 часа
+    python main.py report --hours 6 --by route
+    python main.py report --by media        # одиночные фото, видео, альбомы, текст
+    python main.py report --slowest 10      # самые долгие посты с разбивкой по этапам
+    python main.py report --post 123        # трасса одного поста
+    python main.py report --pending         # посты, ожидающие отправки
+
+Этапы: ingest - от публикации в источнике до сохранения (для альбома - вместе
+со сборкой), delay - заданная задержка маршрута, lag - опоздание первой попытки
+относительно due, retries - от первой попытки до последней, send - последняя
+попытка до успешной отправки, total - от публикации до отправки.
+"""
+import argparse
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from database import EVENT_NAMES, STATUS_SENDING, PostManager
+
+
+class Trace(NamedTuple):
+    """Этапы одного отправленного поста, в миллисекундах"""
+    post_id: int
+    route: str
+    media: str
+    received: Optional[int]
+    saved: Optional[int]
+    due: Optional[int]
+    first_claimed: Optional[int]
+    last_claimed: Optional[int]
+    sent: int
+    failures: int
+
+    def stages(self) -> Dict[str, Optional[float]]:
+        """Длительность этапов в секундах; None - событие не записано"""
+        def span(start: Optional[int], end: Optional[int]) -> Optional[float]:
+            return (end - start) / 1000 if start is not None and end is not None else None
+
+        # Планировщик работает с due_at в целых секундах и может начать чуть раньше due
+        lag = span(self.due, self.first_claimed)
+        return {
+            "ingest": span(self.received, self.saved),
+            "delay": span(self.saved, self.due),
+            "lag": max(0.0, lag) if lag is not None else None,
+            "retries": span(self.first_claimed, self.last_claimed),
+            "send": span(self.last_claimed, self.sent),
+            "total": span(self.received, self.sent),
+        }
+
+
+STAGES = ("ingest", "delay", "lag", "retries", "send", "total")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def format_seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f"{value * 1000:.0f}ms" if abs(value) < 1 else f"{value:.1f}s"
+
+
+def format_time(at_ms: Optional[int]) -> str:
+    if at_ms is None:
+        return "-"
+    moment = datetime.fromtimestamp(at_ms / 1000, timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S.") + f"{at_ms % 1000:03d}"
+
+
+def print_summary(traces: List[Trace], by: Optional[str]):
+    """Перцентили этапов по группам"""
+    groups: Dict[str, List[Trace]] = defaultdict(list)
+    for trace in traces:
+        groups[getattr(trace, by) if by else "all"].append(trace)
+
+    header = f"{'group':<16} {'stage':<8} {'posts':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'fails':>6}"
+    print(header)
+    print("-" * len(header))
+    for name in sorted(groups):
+        group = groups[name]
+        failures = sum(trace.failures for trace in group)
+        durations = defaultdict(list)
+        for trace in group:
+            for stage, value in trace.stages().items():
+                if value is not None:
+                    durations[stage].append(value)
+        for stage in STAGES:
+            values = sorted(durations[stage])
+            if not values:
+                continue
+            print(f"{name:<16.16} {stage:<8} {len(values):>6} "
+                  f"{format_seconds(percentile(values, 50)):>9} {format_seconds(percentile(values, 90)):>9} "
+                  f"{format_seconds(percentile(values, 99)):>9} {format_seconds(values[-1]):>9} "
+                  f"{failures if stage == 'total' else '':>6}")
+
+
+def print_slowest(traces: List[Trace], limit: int):
+    """Самые долгие посты: на каком этапе ушло время"""
+    slowest = sorted(traces, key=lambda trace: trace.stages()["total"] or 0, reverse=True)[:limit]
+    print(f"{'post':>8} {'route':<12} {'media':<10} " + " ".join(f"{stage:>9}" for stage in STAGES) + "  fails")
+    for trace in slowest:
+        stages = trace.stages()
+        print(f"{trace.post_id:>8} {trace.route:<12.12} {trace.media:<10} "
+              + " ".join(f"{format_seconds(stages[stage]):>9}" for stage in STAGES) + f"  {trace.failures}")
+
+
+async def print_post(post_id: int):
+    """Трасса одного поста"""
+    post, events = await PostManager.get_post_trace(post_id)
+    if post is None:
+        print(f"Пост {post_id} не найден (возможно, перенесен в архив)")
+        return
+    _, route, target_chat_id, media_group_id, status, attempts, last_error, forwarded, claimed_by = post
+    print(f"Пост {post_id}: маршрут {route}, чат {target_chat_id}, группа {media_group_id}, статус {status}, "
+          f"попыток {attempts}, последняя ошибка {last_error or '-'}, "
+          f"сообщение {forwarded or '-'}, воркер {claimed_by or '-'}")
+    previous = None
+    for event, at in events:
+        delta = f"+{format_seconds((at - previous) / 1000)}" if previous is not None else ""
+        print(f"  {format_time(at)}  {EVENT_NAMES.get(event, event):<9} {delta}")
+        previous = at
+
+
+async def print_pending(limit: int):
+    """Посты, ожидающие отправки, и посты в отправке"""
+    now = time.time()
+    rows = await PostManager.get_pending(limit)
+    print(f"{'post':>8} {'route':<12} {'state':<8} {'overdue':>9} {'attempts':>8}  error / worker")
+    for post_id, route, _, status, due_at, next_attempt_at, attempts, last_error, claimed_by in rows:
+        state = "sending" if status == STATUS_SENDING else "backoff" if (next_attempt_at or 0) > now else "pending"
+        overdue = now - max(due_at or 0, next_attempt_at or 0)
+        detail = claimed_by if status == STATUS_SENDING else last_error
+        print(f"{post_id:>8} {route:<12.12} {state:<8} {format_seconds(overdue):>9} {attempts:>8}  {detail or ''}")
+    if len(rows) == limit:
+        print(f"... показаны первые {limit}")
+
+
+async def run_report(argv: List[str]):
+    parser = argparse.ArgumentParser(prog="main.py report", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=24, help="Период по времени отправки")
+    parser.add_argument("--by", choices=("route", "media"), default=None, help="Разбивка перцентилей")
+    parser.add_argument("--slowest", type=int, default=0, help="Показать N самых долгих постов")
+    parser.add_argument("--post", type=int, default=None, help="Трасса одного поста")
+    parser.add_argument("--pending", action="store_true", help="Посты, ожидающие отправки")
+    parser.add_argument("--limit", type=int, default=100, help="Строк в списке ожидающих")
+    args = parser.parse_args(argv)
+
+    if args.post is not None:
+        await print_post(args.post)
+        return
+    if args.pending:
+        await print_pending(args.limit)
+        return
+
+    traces = [Trace(*row) for row in await PostManager.get_traces(time.time() - args.hours * 3600)]
+    print(f"Отправлено за {args.hours:g} ч: {len(traces)} постов")
+    if not traces:
+        return
+    print_summary(traces, args.by)
+    if args.slowest:
+        print()
+        print_slowest(traces, args.slowest)
@@ -0,0 +1,29 @@
+import asyncio
+import logging
+
+from database import PostManager, RetentionPolicy
+from metrics import RETENTION_ARCHIVED_TOTAL, RETENTION_RECLAIMED_BYTES_TOTAL
+
+
+logger = logging.getLogger(__name__)
+
+
+async def run_retention(policy: RetentionPolicy, interval_seconds: float, first_delay: float = 60):
+    """Фоновая задача: периодический перенос старых постов в архив и сжатие базы
+
+    Первый проход откладывается на first_delay, чтобы не мешать запуску бота
+    и отправке накопившихся постов.
+    """
+    await asyncio.sleep(first_delay)
+    while True:
+        try:
+            report = await PostManager.apply_retention(policy)
+            RETENTION_ARCHIVED_TOTAL.inc(report["archived"])
+            RETENTION_RECLAIMED_BYTES_TOTAL.inc(report["reclaimed"])
+            await asyncio.sleep(interval_seconds)
+        except asyncio.CancelledError:
+            logger.info("Очистка базы остановлена")
+            break
+        except Exception as e:
+            logger.error(f"Ошибка очистки базы: {type(e).__name__}: {str(e)}", exc_info=True)
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,70 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from keyword_matcher import KeywordMatcher
+
+
+class Route(NamedTuple):
+    """Маршрут пересылки: один исходный канал и его целевые каналы"""
+    name: str
+    source: int
+    targets: Tuple[int, ...]
+    matcher: KeywordMatcher
+    delay_minutes: int
+    additional_text: str
+
+
+def _matcher(cache: Dict[tuple, KeywordMatcher], keywords: Iterable[str], exclude: Iterable[str],
+             whole_words: bool) -> KeywordMatcher:
+    spec = (tuple(keywords), tuple(exclude), whole_words)
+    if spec not in cache:
+        cache[spec] = KeywordMatcher(*spec)
+    return cache[spec]
+
+
+def build_routes(routes: Iterable[dict], source: Optional[int], target: Optional[int],
+                 keywords: List[str], exclude_keywords: List[str], whole_words: bool,
+                 delay_minutes: int, additional_text: str,
+                 previous: Optional[Dict[int, Route]] = None) -> Dict[int, Route]:
+    """Собирает маршруты из config.ROUTES с индексом по id исходного канала
+
+    Незаданные в маршруте параметры берутся из общих настроек. Если ROUTES
+    пуст, создается один маршрут "default" из SOURCE/TARGET_CHANNEL_ID.
+    previous - маршруты до перезагрузки настроек: матчеры с теми же словами
+    не компилируются заново.
+    """
+    matchers = {route.matcher.spec: route.matcher for route in (previous or {}).values()}
+    routes = list(routes)
+    if not routes:
+        if source is None or target is None:
+            raise ValueError("Не заданы ROUTES в config.py и SOURCE/TARGET_CHANNEL_ID в .env")
+        routes = [{"name": "default", "source": source, "targets": [target]}]
+
+    by_source: Dict[int, Route] = {}
+    names = set()
+    for index, options in enumerate(routes):
+        name = str(options.get("name") or f"route{index + 1}")
+        source_id = int(options["source"])
+        targets = tuple(int(chat_id) for chat_id in options.get("targets") or [])
+
+        if not targets:
+            raise ValueError(f"Маршрут {name}: не заданы целевые каналы")
+        if name in names:
+            raise ValueError(f"Маршрут {name} задан дважды")
+        if source_id in by_source:
+            raise ValueError(f"Канал {source_id} указан источником в нескольких маршрутах")
+        names.add(name)
+
+        by_source[source_id] = Route(
+            name=name,
+            source=source_id,
+            targets=targets,
+            matcher=_matcher(
+                matchers,
+                options.get("keywords", keywords),
+                options.get("exclude_keywords", exclude_keywords),
+                options.get("whole_words", whole_words)
+            ),
+            delay_minutes=int(options.get("delay_minutes", delay_minutes)),
+            additional_text=options.get("additional_text", additional_text)
+        )
+    return by_source
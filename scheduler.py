@@ -0,0 +1,96 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchScheduler:
+    """Планировщик отправки на min-куче времен готовности постов
+
+    Спит ровно до ближайшего due_at, а при сохранении более раннего поста
+    просыпается досрочно. Пока очередь пуста, к базе не обращается.
+
+    О постах, которые сохранил другой процесс (WORKER_ROLE = "ingest") или
+    команда (rematch), планировщик не узнает: их находит refresh, раз в
+    refresh_interval секунд перечитывая расписание из базы.
+
+    Если проход отправки завершился ошибкой, снятые записи возвращаются
+    в кучу, и проход повторяется через retry_delay секунд.
+    """
+
+    def __init__(self, dispatch: Callable[[], Awaitable[None]],
+                 refresh: Optional[Callable[[], Awaitable[Iterable[Tuple[int, int]]]]] = None,
+                 refresh_interval: float = 10, retry_delay: float = 5):
+        self._dispatch = dispatch
+        self._refresh = refresh
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self._heap: List[Tuple[int, int]] = []
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, due_at: int, post_id: int):
+        """Добавляет пост в расписание"""
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due_at, post_id))
+        if earliest is None or due_at < earliest:
+            self._wakeup.set()
+
+    def load(self, entries: Iterable[Tuple[int, int]], quiet: bool = False):
+        """Перестраивает кучу по необработанным постам из базы"""
+        self._heap = [(due_at, post_id) for due_at, post_id in entries]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+        if not quiet:
+            logger.info(f"Планировщик загружен: {len(self._heap)} постов в очереди")
+
+    async def _sleep(self, timeout):
+        """Ждет таймаут или досрочное пробуждение"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def run(self):
+        """Фоновая задача: отправка постов по мере наступления их времени"""
+        refresh_at = time.monotonic() + self.refresh_interval
+        while True:
+            due = []
+            try:
+                if self._refresh and time.monotonic() >= refresh_at:
+                    # Записи, добавленные во время чтения, сохраняются
+                    self.load([*await self._refresh(), *self._heap], quiet=True)
+                    refresh_at = time.monotonic() + self.refresh_interval
+                until_refresh = refresh_at - time.monotonic() if self._refresh else None
+
+                if not self._heap:
+                    await self._sleep(until_refresh)
+                    continue
+
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    await self._sleep(delay if until_refresh is None else min(delay, until_refresh))
+                    continue
+
+                # Снимаем все наступившие записи: один проход отправки обработает их все
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+
+                await self._dispatch()
+            except asyncio.CancelledError:
+                logger.info("Планировщик отправки остановлен")
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в планировщике отправки: {type(e).__name__}: {str(e)}", exc_info=True)
+                # Посты не отправлены: их записи возвращаются, проход повторится после паузы
+                for entry in due:
+                    heapq.heappush(self._heap, entry)
+                await asyncio.sleep(self.retry_delay)
@@ -0,0 +1,155 @@
+"""Перезагрузка config.py без перезапуска: проверка версии и перепланирование постов"""
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from config_reload import ConfigWatcher  # noqa: E402
+from database import Media, PostManager, _claim, _mark_as_failed, _save_post  # noqa: E402
+
+SOURCE_CHAT_ID = -1001000000001
+TARGET_CHAT_ID = -1001000000002
+
+CONFIG = '''
+DELAY_MINUTES = {delay}
+CHECK_INTERVAL = 1
+ADDITIONAL_TEXT = ""
+KEYWORDS = ["test"]
+'''
+
+
+class ConfigWatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.workdir.name) / "config.py"
+        self.path.write_text(CONFIG.format(delay=20), encoding="utf-8")
+        self.loaded = []
+
+        async def on_change(module):
+            if module.DELAY_MINUTES < 0:
+                raise ValueError("DELAY_MINUTES")
+            self.loaded.append(module.DELAY_MINUTES)
+
+        self.watcher = ConfigWatcher(self.path, on_change)
+
+    async def asyncTearDown(self):
+        self.workdir.cleanup()
+
+    def write(self, text: str):
+        self.path.write_text(text, encoding="utf-8")
+        # Новая версия файла - по mtime и размеру; mtime может совпасть на быстрой ФС
+        stat = self.path.stat()
+        self.watcher._version = (stat.st_mtime_ns - 1, stat.st_size)
+
+    async def test_unchanged_file_not_loaded(self):
+        self.assertFalse(await self.watcher.check())
+        self.assertEqual(self.loaded, [])
+
+    async def test_new_version_applied_once(self):
+        self.write(CONFIG.format(delay=5))
+        self.assertTrue(await self.watcher.check())
+        self.assertFalse(await self.watcher.check())
+        self.assertEqual(self.loaded, [5])
+
+    async def test_broken_or_rejected_version_keeps_previous(self):
+        self.write("DELAY_MINUTES = (")
+        self.assertFalse(await self.watcher.check())
+        self.write(CONFIG.format(delay=-1))
+        self.assertFalse(await self.watcher.check())
+        self.assertEqual(self.loaded, [])
+
+        self.write(CONFIG.format(delay=7))
+        self.assertTrue(await self.watcher.check())
+        self.assertEqual(self.loaded, [7])
+
+
+class ReloadConfigTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        database.db.path = Path(self.workdir.name) / "posts.db"
+        await database.db.open(database.init_db, 0)
+
+        names = [*main.RELOADABLE_SETTINGS, "routes", "routes_by_name", "RETRY_POLICY",
+                 "SOURCE_CHANNEL_ID", "TARGET_CHANNEL_ID", "REMATCH_HOURS"]
+        self.saved = {name: getattr(main, name) for name in names}
+        main.SOURCE_CHANNEL_ID, main.TARGET_CHANNEL_ID = SOURCE_CHAT_ID, TARGET_CHAT_ID
+        main.REMATCH_HOURS = 0
+        values = main.prepare_config(self.config())
+        for name, value in values.items():
+            setattr(main, name, value)
+        self.app = SimpleNamespace(bot_data={})
+
+    async def asyncTearDown(self):
+        for name, value in self.saved.items():
+            setattr(main, name, value)
+        database.db.close()
+        self.workdir.cleanup()
+
+    @staticmethod
+    def config(**overrides):
+        settings = dict(KEYWORDS=["test"], DELAY_MINUTES=20, ADDITIONAL_TEXT="", CHECK_INTERVAL=1)
+        settings.update(overrides)
+        return SimpleNamespace(**settings)
+
+    async def save(self, message_id: int) -> int:
+        _, created = await database.db.write(_save_post, "default", (TARGET_CHAT_ID,), message_id,
+                                             str(message_id), [Media("photo", "AgAC", f"u{message_id}", message_id)],
+                                             "test", 20 * 60)
+        return created[0][0]
+
+    async def due_at(self, post_id: int) -> int:
+        return await database.db.read(lambda conn: conn.execute(
+            "SELECT due_at FROM posts WHERE id = ?", (post_id,)).fetchone()[0])
+
+    async def test_delay_change_reschedules_pending_posts(self):
+        post_id = await self.save(1)
+        created_at = await self.due_at(post_id) - 20 * 60
+
+        await main.reload_config(self.app, self.config(DELAY_MINUTES=60))
+
+        self.assertEqual(main.DELAY_MINUTES, 60)
+        self.assertEqual(await self.due_at(post_id), created_at + 60 * 60)
+
+    async def test_shorter_delay_not_scheduled_in_past(self):
+        post_id = await self.save(1)
+        await database.db.write(lambda conn: conn.execute(
+            "UPDATE posts SET created_at = created_at - 7200 WHERE id = ?", (post_id,)))
+
+        started = int(time.time())
+        await main.reload_config(self.app, self.config(DELAY_MINUTES=1))
+        self.assertGreaterEqual(await self.due_at(post_id), started)
+
+    async def test_backoff_post_keeps_its_retry_time(self):
+        post_id = await self.save(1)
+        await database.db.write(_claim, [post_id], "worker", int(time.time()) + 60)
+        await database.db.write(_mark_as_failed, post_id, "TimedOut", None, main.RETRY_POLICY)
+        due_at = await self.due_at(post_id)
+
+        await main.reload_config(self.app, self.config(DELAY_MINUTES=0))
+        self.assertEqual(await self.due_at(post_id), due_at)
+        self.assertEqual([post.id async for post in PostManager.iter_due_posts()], [])
+
+    async def test_invalid_version_rejected_without_changes(self):
+        routes = main.routes
+        with self.assertRaises(ValueError):
+            await main.reload_config(self.app, self.config(DELAY_MINUTES=-5, KEYWORDS=["новое"]))
+
+        self.assertEqual(main.DELAY_MINUTES, 20)
+        self.assertIs(main.routes, routes)
+
+    async def test_new_keywords_applied_to_routes(self):
+        route = main.routes[SOURCE_CHAT_ID]
+        self.assertIsNone(route.matcher.match("новинка"))
+
+        await main.reload_config(self.app, self.config(KEYWORDS=["новинк"]))
+        self.assertIsNotNone(main.routes[SOURCE_CHAT_ID].matcher.match("новинка"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Подавление повторов в save_messages, начиная с пустого кэша отпечатков"""
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from caption_index import CaptionIndex, rematch  # noqa: E402
+from dedup import ContentDeduplicator  # noqa: E402
+from routes import build_routes  # noqa: E402
+
+SOURCE_CHAT_ID = -1001000000001
+TARGET_CHAT_ID = -1001000000002
+
+
+def photo_post(message_id: int, file_unique_id: str, caption: str = "test пост"):
+    photo = [SimpleNamespace(file_id="id-" + file_unique_id, file_unique_id=file_unique_id)]
+    return SimpleNamespace(
+        message_id=message_id, chat=SimpleNamespace(id=SOURCE_CHAT_ID), date=datetime.now(timezone.utc),
+        media_group_id=None, caption=caption, caption_entities=None, text=None, entities=None,
+        photo=photo, video=None, animation=None, document=None, audio=None, effective_attachment=photo
+    )
+
+
+class SaveMessagesDedupTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        database.db.path = Path(self.workdir.name) / "posts.db"
+        await database.db.open(database.init_db, 0)
+
+        self.routes = main.routes
+        main.routes = build_routes(
+            [], SOURCE_CHAT_ID, TARGET_CHAT_ID, keywords=["test"], exclude_keywords=[],
+            whole_words=False, delay_minutes=0, additional_text=""
+        )
+        # Чистая база: кэш пуст, и ContentDeduplicator сам по себе ложен (len == 0)
+        self.dedup = ContentDeduplicator(3600)
+        await self.dedup.load()
+        self.app = SimpleNamespace(bot_data={"dedup": self.dedup, "caption_index": CaptionIndex(3600)})
+
+    async def asyncTearDown(self):
+        await self.dedup.close()
+        database.db.close()
+        main.routes = self.routes
+        self.workdir.cleanup()
+
+    async def test_repost_skipped_with_empty_cache(self):
+        self.assertEqual(len(self.dedup), 0)
+        self.assertTrue(await main.save_messages(self.app, [photo_post(1, "a")]))
+        self.assertFalse(await main.save_messages(self.app, [photo_post(2, "a", caption="test снова")]))
+        self.assertTrue(await main.save_messages(self.app, [photo_post(3, "b")]))
+
+        saved = await database.db.read(lambda conn: conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0])
+        self.assertEqual(saved, 2)
+
+    async def test_fingerprints_persist_for_restart(self):
+        await main.save_messages(self.app, [photo_post(1, "a")])
+        await self.dedup.close()
+
+        restarted = ContentDeduplicator(3600)
+        await restarted.load()
+        self.assertTrue(await restarted.is_duplicate(main.routes[SOURCE_CHAT_ID].name, ["f:a"]))
+
+    async def test_rematch_skips_suppressed_repost(self):
+        await main.save_messages(self.app, [photo_post(1, "a")])
+        # Повтор подавлен при приеме: в posts его нет, но в индексе подписей он есть
+        self.assertFalse(await main.save_messages(self.app, [photo_post(2, "a", caption="test новое")]))
+        await main.save_messages(self.app, [photo_post(3, "c", caption="новое")])
+
+        route = build_routes(
+            [], SOURCE_CHAT_ID, TARGET_CHAT_ID, keywords=["test", "новое"], exclude_keywords=[],
+            whole_words=False, delay_minutes=0, additional_text=""
+        )[SOURCE_CHAT_ID]
+        matched, created = await rematch(route, 0, dedup=self.dedup)
+
+        message_ids = await database.db.read(
+            lambda conn: [row[0] for row in conn.execute("SELECT original_message_id FROM posts ORDER BY id")]
+        )
+        self.assertEqual(message_ids, [1, 3])
+        self.assertEqual(len(matched), 1)
+        self.assertEqual(len(created), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
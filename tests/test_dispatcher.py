@@ -0,0 +1,168 @@
+"""Диспетчер отправки: корзины токенов, пачки copyMessages, порядок в чате и повторная постановка"""
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+from database import DuePost, Media  # noqa: E402
+from dispatcher import Dispatcher, TokenBucket  # noqa: E402
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_up_to_capacity_then_rate(self):
+        loop = asyncio.get_running_loop()
+        bucket = TokenBucket(rate=50, capacity=5)
+
+        started = loop.time()
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertLess(loop.time() - started, 0.02)
+
+        # Шестой токен - через 1 / rate
+        await bucket.acquire()
+        self.assertGreaterEqual(loop.time() - started, 0.015)
+
+    async def test_batch_over_capacity_waits_for_its_cost(self):
+        loop = asyncio.get_running_loop()
+        # Как CHAT_RATE_LIMIT = 20 в минуту, но в 3000 раз быстрее
+        bucket = TokenBucket(rate=1000, capacity=20)
+
+        started = loop.time()
+        await bucket.acquire(100)  # Пачка copyMessages из 100 сообщений
+        self.assertGreaterEqual(loop.time() - started, 0.079)
+
+        # Долг погашен ожиданием: запас capacity не выдается второй раз,
+        # и 120 токенов занимают не меньше (120 - capacity) / rate
+        await bucket.acquire(20)
+        self.assertGreaterEqual(loop.time() - started, 0.099)
+
+    async def test_waiters_served_in_order(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        order = []
+
+        async def take(index):
+            await bucket.acquire()
+            order.append(index)
+
+        await asyncio.gather(*(take(index) for index in range(5)))
+        self.assertEqual(order, list(range(5)))
+
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dispatcher = Dispatcher(workers=2, global_rate=1000, chat_rate_per_minute=60000)
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close()
+
+    async def test_chat_lane_keeps_order(self):
+        sent = []
+
+        def job(index):
+            async def send():
+                await asyncio.sleep(0.001 * (5 - index))
+                sent.append(index)
+            return send
+
+        for index in range(5):
+            self.assertTrue(self.dispatcher.submit(-100, str(index), job(index)))
+        await self.dispatcher.wait_below(1)
+        self.assertEqual(sent, list(range(5)))
+
+    async def test_queued_post_not_submitted_twice(self):
+        release = asyncio.Event()
+
+        async def send():
+            await release.wait()
+
+        self.assertTrue(self.dispatcher.submit(-100, "1", send))
+        self.assertFalse(self.dispatcher.submit(-100, "1", send))
+        self.assertEqual(len(self.dispatcher), 1)
+        release.set()
+        await self.dispatcher.wait_below(1)
+
+    async def test_stale_snapshot_rejected_after_send(self):
+        snapshot = self.dispatcher.snapshot()
+
+        async def send():
+            pass
+
+        self.dispatcher.submit(-100, "1", send)
+        await self.dispatcher.wait_below(1)
+        # Выборка прочитана до завершения отправки: пост еще выглядел неотправленным
+        self.assertFalse(self.dispatcher.accepts("1", snapshot))
+        self.assertTrue(self.dispatcher.accepts("1", self.dispatcher.snapshot()))
+
+    async def test_failed_job_does_not_stop_lane(self):
+        sent = []
+
+        async def fail():
+            raise RuntimeError("Bad Request")
+
+        async def send():
+            sent.append("2")
+
+        self.dispatcher.submit(-100, "1", fail)
+        self.dispatcher.submit(-100, "2", send)
+        await self.dispatcher.wait_below(1)
+        self.assertEqual(sent, ["2"])
+
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.costs = []
+
+    def accepts(self, key, snapshot=None):
+        return True
+
+    def submit(self, chat_id, keys, job, cost=1, snapshot=None):
+        self.costs.append(cost)
+        return True
+
+
+def album(post_id: int, files: int) -> DuePost:
+    media = tuple(Media("photo", f"AgAC{post_id}-{index}", None, 100 * post_id + index) for index in range(files))
+    return DuePost(post_id, "default", None, 100 * post_id, str(post_id), "", None, None, "", 0, 0, media)
+
+
+class CopyBatchesTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = main.CHAT_RATE_LIMIT, main.DISPATCH_MODE
+        main.CHAT_RATE_LIMIT = 20
+
+    def tearDown(self):
+        main.CHAT_RATE_LIMIT, main.DISPATCH_MODE = self.settings
+
+    def batch_costs(self, posts):
+        dispatcher = RecordingDispatcher()
+        batches = main.CopyBatches(None, dispatcher, 0)
+        for post in posts:
+            batches.add(-100, -200, post)
+        batches.flush()
+        return dispatcher.costs
+
+    def test_batches_fit_chat_capacity(self):
+        main.DISPATCH_MODE = "forward"
+        costs = self.batch_costs([album(post_id, 3) for post_id in range(1, 34)])  # 99 сообщений
+
+        self.assertTrue(all(cost <= 20 for cost in costs), costs)
+        self.assertEqual(sum(costs), 99)
+
+    def test_suffix_edits_counted(self):
+        main.DISPATCH_MODE = "copy"
+        costs = self.batch_costs([album(post_id, 1) for post_id in range(1, 21)])
+
+        self.assertEqual(costs, [20, 20])
+
+    def test_album_over_capacity_sent_alone(self):
+        main.DISPATCH_MODE = "forward"
+        main.CHAT_RATE_LIMIT = 5
+
+        self.assertEqual(self.batch_costs([album(1, 2), album(2, 10), album(3, 2)]), [2, 10, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
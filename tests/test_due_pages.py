@@ -0,0 +1,87 @@
+"""Выдача наступивших постов страницами по ключу (due_at, id)"""
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+from database import Media, PostManager, _save_post  # noqa: E402
+
+
+class DuePagesTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        database.db.path = Path(self.workdir.name) / "posts.db"
+        await database.db.open(database.init_db, 0)
+
+    async def asyncTearDown(self):
+        database.db.close()
+        self.workdir.cleanup()
+
+    async def save(self, message_id: int, files: int = 1, due_at: int = None) -> int:
+        media = [Media("photo", f"AgAC{message_id}-{index}", f"u{message_id}-{index}", message_id + index)
+                 for index in range(files)]
+        _, created = await database.db.write(_save_post, "default", (-1001,), message_id, str(message_id),
+                                             media, f"пост {message_id}", 0)
+        post_id = created[0][0]
+        if due_at is not None:
+            await database.db.write(lambda conn: conn.execute(
+                "UPDATE posts SET due_at = ? WHERE id = ?", (due_at, post_id)))
+        return post_id
+
+    async def due(self, page_size: int):
+        return [post async for post in PostManager.iter_due_posts(page_size)]
+
+    async def test_pages_cover_queue_in_due_order(self):
+        now = int(time.time())
+        # Одинаковый due_at у нескольких постов: порядок и граница страницы - по id
+        expected = [await self.save(100 * index, due_at=now - 10 + index // 3) for index in range(10)]
+
+        for page_size in (1, 3, 4, 10, 100):
+            posts = await self.due(page_size)
+            self.assertEqual([post.id for post in posts], expected, page_size)
+
+    async def test_album_not_split_between_pages(self):
+        album = await self.save(1, files=5)
+        single = await self.save(100)
+
+        posts = await self.due(1)
+        self.assertEqual([post.id for post in posts], [album, single])
+        self.assertEqual(len(posts[0].media), 5)
+        self.assertEqual([item.message_id for item in posts[0].media], [1, 2, 3, 4, 5])
+
+    async def test_future_and_backoff_posts_skipped(self):
+        now = int(time.time())
+        due = await self.save(1)
+        await self.save(2, due_at=now + 3600)
+        backoff = await self.save(3)
+        await database.db.write(lambda conn: conn.execute(
+            "UPDATE posts SET next_attempt_at = ? WHERE id = ?", (now + 3600, backoff)))
+
+        self.assertEqual([post.id for post in await self.due(1)], [due])
+
+    async def test_page_read_only_when_previous_consumed(self):
+        for message_id in range(5):
+            await self.save(100 * message_id)
+        reads = []
+        read = database.db.read
+
+        async def counting_read(fn, *args):
+            reads.append(fn)
+            return await read(fn, *args)
+
+        database.db.read = counting_read
+        try:
+            iterator = PostManager.iter_due_posts(2)
+            await iterator.__anext__()
+            self.assertEqual(len(reads), 1)
+            await iterator.aclose()
+        finally:
+            del database.db.read
+
+
+if __name__ == "__main__":
+    unittest.main()
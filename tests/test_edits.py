@@ -0,0 +1,185 @@
+"""Перенос правок и удалений исходных сообщений в записи очереди и отправленные копии"""
+import asyncio
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from album import AlbumAssembler  # noqa: E402
+from database import (  # noqa: E402
+    Media, _apply_delete, _apply_edit, _claim, _get_due_page, _mark_as_processed, _save_post
+)
+from routes import build_routes  # noqa: E402
+from test_dedup import SOURCE_CHAT_ID, TARGET_CHAT_ID, photo_post  # noqa: E402
+
+ROUTE = "default"
+
+
+class EditsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        database.db.path = Path(self.workdir.name) / "posts.db"
+        await database.db.open(database.init_db, 0)
+        self.db = database.db
+
+    async def asyncTearDown(self):
+        self.db.close()
+        self.workdir.cleanup()
+
+    async def save(self, message_id: int, caption: str = "пост") -> int:
+        _, created = await self.db.write(_save_post, ROUTE, (TARGET_CHAT_ID,), message_id, str(message_id),
+                                         [Media("photo", f"AgAC-{message_id}", f"u{message_id}", message_id)],
+                                         caption, 0)
+        return created[0][0]
+
+    async def due(self):
+        return await self.db.read(_get_due_page, int(time.time()), (-1, -1), 10)
+
+    async def edit(self, message_id: int, caption: str, media: Media = None):
+        return await self.db.write(_apply_edit, ROUTE, str(message_id), message_id, media, caption, None)
+
+    async def send(self, post, copy_id: int):
+        await self.db.write(_claim, [post.id], "worker", int(time.time()) + 60)
+        return await self.db.write(_mark_as_processed, post.id, copy_id, [(post.original_message_id, copy_id)], post)
+
+
+class ApplyEditTest(EditsTestCase):
+    async def test_pending_post_edited_in_place(self):
+        await self.save(1)
+        updated, copies = await self.edit(1, "новая подпись")
+
+        self.assertEqual((updated, copies), (1, []))
+        self.assertEqual((await self.due())[0].caption, "новая подпись")
+
+    async def test_sent_copy_returned_for_edit(self):
+        post_id = await self.save(1)
+        await self.send((await self.due())[0], 501)
+
+        updated, copies = await self.edit(1, "новая подпись")
+        self.assertEqual(updated, 0)
+        self.assertEqual([(copy.post_id, copy.caption_message_id, copy.caption, copy.caption_changed, copy.media)
+                          for copy in copies], [(post_id, 501, "новая подпись", True, None)])
+
+    async def test_edit_during_send_returned_after_send(self):
+        await self.save(1)
+        snapshot = (await self.due())[0]
+        media = Media("photo", "AgAC-new", "u-new", 1)
+        await self.edit(1, "новая подпись", media)
+
+        # Пост ушел в прежней версии: правка возвращается для переноса в копию
+        edits = await self.send(snapshot, 501)
+        self.assertEqual(len(edits), 1)
+        self.assertEqual((edits[0].caption, edits[0].caption_changed, edits[0].media.file_id),
+                         ("новая подпись", True, "AgAC-new"))
+
+    async def test_unchanged_edit_ignored(self):
+        await self.save(1)
+        self.assertEqual(await self.edit(1, "пост"), (0, []))
+
+
+class ApplyDeleteTest(EditsTestCase):
+    async def test_pending_post_without_messages_removed(self):
+        await self.save(1)
+        self.assertEqual(await self.db.write(_apply_delete, ROUTE, 1), (1, []))
+        self.assertEqual(await self.due(), [])
+
+    async def test_sent_copy_returned_for_delete(self):
+        await self.save(1)
+        await self.send((await self.due())[0], 501)
+
+        self.assertEqual(await self.db.write(_apply_delete, ROUTE, 1), (0, [(TARGET_CHAT_ID, 501)]))
+
+
+class FakeBot:
+    async def copy_messages(self, chat_id, from_chat_id, message_ids):
+        return [SimpleNamespace(message_id=500 + message_id) for message_id in message_ids]
+
+
+class CopyBatchEditTest(EditsTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.saved = main.routes_by_name, main.DISPATCH_MODE
+        route, = build_routes(
+            [], SOURCE_CHAT_ID, TARGET_CHAT_ID, keywords=["пост"], exclude_keywords=[],
+            whole_words=False, delay_minutes=0, additional_text="Подписывайтесь"
+        ).values()
+        main.routes_by_name = {route.name: route}
+        main.DISPATCH_MODE = "copy"
+
+    async def asyncTearDown(self):
+        main.routes_by_name, main.DISPATCH_MODE = self.saved
+        await super().asyncTearDown()
+
+    async def test_suffix_appended_to_caption_edited_in_queue(self):
+        await self.save(1)
+        snapshot = (await self.due())[0]
+        # Правка пришла, пока пост ждал в диспетчере: copyMessages копирует уже исправленное сообщение
+        await self.edit(1, "новая подпись")
+
+        with mock.patch("main.edit_caption", new=mock.AsyncMock()) as edit_caption:
+            await main.copy_batch(SimpleNamespace(bot=FakeBot()), TARGET_CHAT_ID, SOURCE_CHAT_ID, [snapshot])
+
+        edit_caption.assert_awaited_once()
+        chat_id, message_id, text = edit_caption.await_args.args[1:4]
+        self.assertEqual((chat_id, message_id, text), (TARGET_CHAT_ID, 501, "новая подпись\n\nПодписывайтесь"))
+        # Отправка записана с копией: следующие правки найдут сообщение 501
+        _, copies = await self.edit(1, "еще правка")
+        self.assertEqual([copy.caption_message_id for copy in copies], [501])
+
+
+def album_part(message_id: int, caption: str = None):
+    message = photo_post(message_id, f"u{message_id}", caption=caption)
+    message.media_group_id = "album"
+    return message
+
+
+class AlbumEditTest(EditsTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.saved = main.routes
+        main.routes = build_routes(
+            [], SOURCE_CHAT_ID, TARGET_CHAT_ID, keywords=["test"], exclude_keywords=[],
+            whole_words=False, delay_minutes=0, additional_text=""
+        )
+        self.app = SimpleNamespace(bot=None, bot_data={})
+        self.albums = AlbumAssembler(lambda messages, late: main.save_messages(self.app, messages, late),
+                                     quiet_seconds=60)
+        self.app.bot_data["albums"] = self.albums
+
+    async def asyncTearDown(self):
+        await self.albums.flush_all()
+        main.routes = self.saved
+        await super().asyncTearDown()
+
+    async def receive(self):
+        await main.process_message(self.app, album_part(1))
+        await main.process_message(self.app, album_part(2, caption="test альбом"))
+
+    async def test_edit_of_buffered_part_saved_with_album(self):
+        await self.receive()
+        # Правка пришла раньше паузы ALBUM_QUIET_SECONDS: альбом еще не сохранен
+        await main.process_edit(self.app, album_part(2, caption="test исправлено"))
+        await self.albums.flush_all()
+
+        due = await self.due()
+        self.assertEqual([post.caption for post in due], ["test исправлено"])
+
+    async def test_edit_during_album_save_applied_after_it(self):
+        await self.receive()
+        flushing = asyncio.create_task(self.albums.flush_all())
+        await asyncio.sleep(0)  # Альбом собран и сохраняется
+
+        await main.process_edit(self.app, album_part(2, caption="test исправлено"))
+        await flushing
+        self.assertEqual([post.caption for post in await self.due()], ["test исправлено"])
+
+
+if __name__ == "__main__":
+    unittest.main()
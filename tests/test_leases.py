@@ -0,0 +1,115 @@
+"""Захват постов воркерами: не больше одной пересылки"""
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+from database import STATUS_DEAD, STATUS_SENT, Media, PostManager, _save_post  # noqa: E402
+from dispatcher import Dispatcher  # noqa: E402
+from leases import reclaim_leases  # noqa: E402
+
+
+class LeasesTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        database.db.path = Path(self.workdir.name) / "posts.db"
+        await database.db.open(database.init_db, 0)
+        _, created = await database.db.write(_save_post, "default", (-1001,), 1, "1",
+                                              [Media("photo", "AgAC-1", "u1", 1)], "пост", 0)
+        self.post_id = created[0][0]
+
+    async def asyncTearDown(self):
+        database.db.close()
+        self.workdir.cleanup()
+
+    async def state(self):
+        return await database.db.read(lambda conn: conn.execute(
+            "SELECT is_processed, last_error, claimed_by FROM posts WHERE id = ?", (self.post_id,)).fetchone())
+
+    async def due_ids(self):
+        return [post.id async for post in PostManager.iter_due_posts()]
+
+    async def test_post_claimed_by_one_worker(self):
+        claims = await asyncio.gather(*(PostManager.claim([self.post_id], f"worker-{index}", 60)
+                                        for index in range(5)))
+
+        self.assertEqual(sum(len(claimed) for claimed in claims), 1)
+        self.assertEqual(await self.due_ids(), [])
+
+    async def test_expired_lease_goes_to_dead_letter(self):
+        await PostManager.claim([self.post_id], "crashed", -1)
+
+        self.assertEqual(await reclaim_leases(), [self.post_id])
+        self.assertEqual(await self.state(), (STATUS_DEAD, "LeaseExpired", None))
+        self.assertEqual(await self.due_ids(), [])
+
+    async def test_restarted_worker_drops_its_own_claims(self):
+        await PostManager.claim([self.post_id], "worker-1", 300)
+
+        self.assertEqual(await reclaim_leases("worker-2"), [])
+        self.assertEqual(await reclaim_leases("worker-1"), [self.post_id])
+        self.assertEqual((await self.state())[0], STATUS_DEAD)
+
+    async def test_late_send_still_recorded(self):
+        await PostManager.claim([self.post_id], "slow", -1)
+        await reclaim_leases()
+
+        await PostManager.mark_as_processed(self.post_id, 100)
+        self.assertEqual(await self.state(), (STATUS_SENT, "LeaseExpired", None))
+
+    async def test_failed_commit_retried_then_raised(self):
+        await PostManager.claim([self.post_id], "worker", 60)
+        write = database.db.write
+        failures = []
+
+        async def failing_write(fn, *args):
+            if fn is database._mark_as_processed and len(failures) < database.MARK_PROCESSED_ATTEMPTS:
+                failures.append(fn)
+                raise OSError("disk I/O error")
+            return await write(fn, *args)
+
+        database.db.write = failing_write
+        try:
+            with mock.patch("database.asyncio.sleep", new=mock.AsyncMock()) as pause:
+                with self.assertRaises(OSError):
+                    await PostManager.mark_as_processed(self.post_id, 100)
+                self.assertEqual(len(failures), database.MARK_PROCESSED_ATTEMPTS)
+                self.assertEqual(pause.await_count, database.MARK_PROCESSED_ATTEMPTS - 1)
+
+                # Запись, прошедшая со второй попытки, отмечает пост отправленным
+                failures.pop()
+                await PostManager.mark_as_processed(self.post_id, 100)
+            self.assertEqual((await self.state())[0], STATUS_SENT)
+        finally:
+            del database.db.write
+
+
+class DispatcherCloseTest(unittest.IsolatedAsyncioTestCase):
+    async def test_running_send_finishes_queued_dropped(self):
+        dispatcher = Dispatcher(workers=1, global_rate=1000, chat_rate_per_minute=60000)
+        started = asyncio.Event()
+        sent = []
+
+        def job(key):
+            async def send():
+                started.set()
+                await asyncio.sleep(0.02)
+                sent.append(key)
+            return send
+
+        dispatcher.submit(-100, "1", job("1"))
+        dispatcher.submit(-100, "2", job("2"))
+        await started.wait()
+        await dispatcher.close()
+
+        self.assertEqual(sent, ["1"])
+        self.assertEqual(len(dispatcher), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
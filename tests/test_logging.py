@@ -0,0 +1,47 @@
+"""Логирование: уровни LOG_LEVEL и LOG_LEVELS доходят до файла"""
+import logging
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import logger_config  # noqa: E402
+
+
+class FileLevelsTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.log_path = logger_config.log_path
+        logger_config.log_path = Path(self.workdir.name) / "bot.log"
+        self.root_level = logging.getLogger().level
+
+    def tearDown(self):
+        logger_config.stop_logging()
+        logger_config.log_path = self.log_path
+        logging.getLogger().setLevel(self.root_level)
+        logging.getLogger("database").setLevel(logging.NOTSET)
+        self.workdir.cleanup()
+
+    def write(self, name: str, level: int, text: str):
+        """Запись, прошедшая уровень логгера, как ее получает поток-слушатель"""
+        logger = logging.getLogger(name)
+        if logger.isEnabledFor(level):
+            logger_config._listener.handle(logger.makeRecord(name, level, __file__, 0, text, None, None))
+
+    def test_module_debug_reaches_file(self):
+        logger_config.setup_logging("INFO", {"database": "DEBUG"})
+        self.write("database", logging.DEBUG, "страница due")
+        self.write("main", logging.DEBUG, "пропущено")
+        self.write("main", logging.INFO, "пост сохранен")
+        logger_config.stop_logging()
+
+        text = logger_config.log_path.read_text(encoding="utf-8")
+        self.assertIn("страница due", text)
+        self.assertIn("пост сохранен", text)
+        self.assertNotIn("пропущено", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Миграции схемы: база исходной версии обновляется до текущей без потери постов"""
+import calendar
+import json
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+from database import Database, Media, init_db  # noqa: E402
+
+DELAY_SECONDS = 600
+
+
+def legacy_database(path: Path):
+    """База версии 0: file_ids в JSON, post_date строкой, дубли одной медиагруппы"""
+    conn = sqlite3.connect(path)
+    conn.execute(database.SQL_CREATE_POSTS)
+    conn.executemany(
+        "INSERT INTO posts (original_message_id, media_group_id, file_ids, caption, post_date, is_processed) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (10, "album", json.dumps(["AgAC-1"]), None, "2024-01-01 10:00:00", 0),
+            (11, "album", json.dumps(["AgAC-1", "BAAC-2"]), "подпись", "2024-01-01 10:00:01", 0),
+            (20, "20", json.dumps(["XXXX-3"]), "старый", "2024-01-01 09:00:00", 1),
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+class MigrationsTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.workdir.name) / "posts.db"
+        self.db = None
+
+    async def asyncTearDown(self):
+        if self.db:
+            self.db.close()
+        self.workdir.cleanup()
+
+    async def open(self) -> Database:
+        self.db = Database(self.path)
+        await self.db.open(init_db, DELAY_SECONDS)
+        return self.db
+
+    async def test_legacy_database_migrated_to_current_version(self):
+        legacy_database(self.path)
+        db = await self.open()
+
+        version = await db.read(lambda conn: conn.execute("PRAGMA user_version").fetchone()[0])
+        self.assertEqual(version, len(database.MIGRATIONS))
+
+        rows = await db.read(lambda conn: conn.execute(
+            "SELECT id, route, media_group_id, caption, created_at, due_at FROM posts ORDER BY id").fetchall())
+        # Дубли медиагруппы слиты в самую раннюю запись
+        self.assertEqual([row[2] for row in rows], ["album", "20"])
+        post_id, route, _, caption, created_at, due_at = rows[0]
+        self.assertEqual(route, "default")
+        self.assertEqual(caption, "подпись")
+        self.assertEqual(created_at, calendar.timegm((2024, 1, 1, 10, 0, 0)))
+        self.assertEqual(due_at, created_at + DELAY_SECONDS)
+
+        media = await db.read(lambda conn: conn.execute(
+            "SELECT post_id, position, media_type, file_id FROM post_media ORDER BY post_id, position").fetchall())
+        self.assertEqual(media, [
+            (post_id, 0, "photo", "AgAC-1"),
+            (post_id, 1, "video", "BAAC-2"),
+            (rows[1][0], 0, "unknown", "XXXX-3"),
+        ])
+
+        # У медиа старых записей нет id исходных сообщений: правки к ним не переносятся
+        links = await db.read(lambda conn: conn.execute("SELECT COUNT(*) FROM post_messages").fetchone()[0])
+        self.assertEqual(links, 0)
+
+    async def test_migrated_post_is_due(self):
+        legacy_database(self.path)
+        db = await self.open()
+
+        due = await db.read(database._get_due_page, int(time.time()), (-1, -1), 10)
+        self.assertEqual(len(due), 1)
+        self.assertEqual(due[0].caption, "подпись")
+        self.assertEqual([item.file_id for item in due[0].media], ["AgAC-1", "BAAC-2"])
+
+    async def test_reopen_is_noop(self):
+        db = await self.open()
+        await db.write(database._save_post, "default", (-1001,), 1, "1",
+                       [Media("photo", "AgAC-1", "u1", 1)], "пост", 0)
+        db.close()
+
+        db = await self.open()
+        count = await db.read(lambda conn: conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0])
+        self.assertEqual(count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Команда rematch: посты из индекса подписей доходят до работающего процесса отправки"""
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from caption_index import run_rematch  # noqa: E402
+from routes import build_routes  # noqa: E402
+from test_dedup import SOURCE_CHAT_ID, TARGET_CHAT_ID, photo_post  # noqa: E402
+
+
+def route_with(keywords):
+    return build_routes(
+        [], SOURCE_CHAT_ID, TARGET_CHAT_ID, keywords=keywords, exclude_keywords=[],
+        whole_words=False, delay_minutes=0, additional_text=""
+    )
+
+
+class RematchCommandTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        database.db.path = Path(self.workdir.name) / "posts.db"
+        await database.db.open(database.init_db, 0)
+
+        self.saved = {name: getattr(main, name) for name in
+                      ("routes", "WORKER_ROLE", "SCHEDULE_REFRESH_SECONDS", "DEDUP_WINDOW_HOURS")}
+        main.routes = route_with(["test"])
+        main.WORKER_ROLE = "all"
+        main.SCHEDULE_REFRESH_SECONDS = 0.05
+        main.DEDUP_WINDOW_HOURS = 0
+        self.app = SimpleNamespace(bot_data={})
+        self.task = None
+
+    async def asyncTearDown(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.app.bot_data["dispatcher"].close()
+        for name, value in self.saved.items():
+            setattr(main, name, value)
+        database.db.close()
+        self.workdir.cleanup()
+
+    async def test_running_all_process_picks_up_rematched_posts(self):
+        await main.prepare_pipeline(self.app)
+        # Пост не прошел фильтр при приеме и есть только в индексе подписей
+        self.assertFalse(await main.save_messages(self.app, [photo_post(1, "a", caption="новинка")]))
+
+        scheduler = self.app.bot_data["scheduler"]
+        dispatched = asyncio.Event()
+
+        async def dispatch():
+            dispatched.set()
+
+        scheduler._dispatch = dispatch
+        self.task = asyncio.create_task(scheduler.run())
+
+        # Команда - отдельный процесс: работающему планировщику о постах не сообщает
+        new_routes = route_with(["новинк"])
+        await run_rematch(["--hours", "1"], {route.name: route for route in new_routes.values()})
+
+        await asyncio.wait_for(dispatched.wait(), 1)
+        due = [post.original_message_id async for post in database.PostManager.iter_due_posts()]
+        self.assertEqual(due, [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
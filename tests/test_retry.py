@@ -0,0 +1,87 @@
+"""Повторные попытки отправки: backoff, RetryAfter и dead letter"""
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+from database import (  # noqa: E402
+    STATUS_DEAD, STATUS_PENDING, Database, Media, RetryPolicy, _claim, _get_due_page, _mark_as_failed, _save_post
+)
+
+POLICY = RetryPolicy(base_delay=60, max_delay=600, max_attempts=3)
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_delay_doubles_up_to_max(self):
+        self.assertEqual([POLICY.delay(attempts) for attempts in range(1, 6)], [60, 120, 240, 480, 600])
+
+    def test_retry_after_takes_priority(self):
+        self.assertEqual(POLICY.delay(1, retry_after=300), 301)
+        self.assertEqual(POLICY.delay(3, retry_after=5), 240)
+
+
+class MarkAsFailedTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.db = Database(Path(self.workdir.name) / "posts.db")
+        await self.db.open(database.init_db, 0)
+        _, created = await self.db.write(_save_post, "default", (-1001,), 1, "1",
+                                         [Media("photo", "AgAC-1", "u1", 1)], "пост", 0)
+        self.post_id = created[0][0]
+
+    async def asyncTearDown(self):
+        self.db.close()
+        self.workdir.cleanup()
+
+    async def fail(self, retry_after=None):
+        await self.db.write(_claim, [self.post_id], "worker", int(time.time()) + 60)
+        return await self.db.write(_mark_as_failed, self.post_id, "TimedOut", retry_after, POLICY)
+
+    async def state(self):
+        return await self.db.read(lambda conn: conn.execute(
+            "SELECT is_processed, attempts, next_attempt_at, last_error, claimed_by FROM posts WHERE id = ?",
+            (self.post_id,)).fetchone())
+
+    async def due_ids(self, now):
+        return [post.id for post in await self.db.read(_get_due_page, now, (-1, -1), 10)]
+
+    async def test_failure_backs_off(self):
+        started = int(time.time())
+        status, next_attempt_at = await self.fail()
+
+        self.assertEqual(status, STATUS_PENDING)
+        self.assertGreaterEqual(next_attempt_at, started + 60)
+        self.assertEqual(await self.state(), (STATUS_PENDING, 1, next_attempt_at, "TimedOut", None))
+        # До next_attempt_at пост не выдается, после - снова в очереди
+        self.assertEqual(await self.due_ids(started), [])
+        self.assertEqual(await self.due_ids(next_attempt_at), [self.post_id])
+
+    async def test_flood_wait_not_counted_as_attempt(self):
+        started = int(time.time())
+        _, next_attempt_at = await self.fail(retry_after=30)
+
+        self.assertEqual((await self.state())[1], 0)
+        self.assertGreaterEqual(next_attempt_at, started + 60)
+
+    async def test_dead_letter_after_max_attempts(self):
+        for _ in range(POLICY.max_attempts - 1):
+            await self.fail()
+        status, next_attempt_at = await self.fail()
+
+        self.assertEqual((status, next_attempt_at), (STATUS_DEAD, None))
+        self.assertEqual((await self.state())[:3], (STATUS_DEAD, POLICY.max_attempts, None))
+        self.assertEqual(await self.due_ids(int(time.time()) + 3600), [])
+
+    async def test_unclaimed_post_not_changed(self):
+        status, _ = await self.db.write(_mark_as_failed, self.post_id, "TimedOut", None, POLICY)
+
+        self.assertIsNone(status)
+        self.assertEqual((await self.state())[:2], (STATUS_PENDING, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
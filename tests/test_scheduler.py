@@ -0,0 +1,84 @@
+"""Планировщик отправки: пробуждение по due_at и повтор прохода после ошибки"""
+import asyncio
+import sys
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scheduler import DispatchScheduler  # noqa: E402
+
+
+class DispatchSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.passes = 0
+        self.failures = 0
+        self.dispatched = asyncio.Event()
+        self.scheduler = DispatchScheduler(self.dispatch, retry_delay=0.01)
+        self.task = None
+
+    async def asyncTearDown(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def dispatch(self):
+        self.passes += 1
+        if self.failures:
+            self.failures -= 1
+            raise OSError("database is locked")
+        self.dispatched.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self.scheduler.run())
+
+    async def test_due_entries_dispatched_once(self):
+        now = int(time.time())
+        self.scheduler.load([(now - 10, 1), (now - 5, 2), (now + 3600, 3)])
+        self.start()
+        await asyncio.wait_for(self.dispatched.wait(), 1)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.passes, 1)
+        self.assertEqual(len(self.scheduler), 1)
+
+    async def test_earlier_post_wakes_sleeping_scheduler(self):
+        self.scheduler.load([(int(time.time()) + 3600, 1)])
+        self.start()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.passes, 0)
+
+        self.scheduler.schedule(int(time.time()) - 1, 2)
+        await asyncio.wait_for(self.dispatched.wait(), 1)
+
+    async def test_empty_heap_wakes_on_schedule(self):
+        self.start()
+        await asyncio.sleep(0.05)
+
+        self.scheduler.schedule(int(time.time()) - 1, 1)
+        await asyncio.wait_for(self.dispatched.wait(), 1)
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_failed_pass_restores_entries_and_retries(self):
+        self.failures = 2
+        self.scheduler.load([(int(time.time()) - 1, 1)])
+        self.start()
+        await asyncio.wait_for(self.dispatched.wait(), 1)
+
+        self.assertEqual(self.passes, 3)
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_refresh_picks_up_posts_saved_elsewhere(self):
+        due = [(int(time.time()) - 1, 7)]
+
+        async def refresh():
+            return due
+
+        self.scheduler = DispatchScheduler(self.dispatch, refresh=refresh, refresh_interval=0.05)
+        self.start()
+        await asyncio.wait_for(self.dispatched.wait(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Отправляет записанные Update JSON в локальный webhook бота
+
+Позволяет проверить режим webhook без Telegram: запустите бота с
+UPDATE_MODE = "webhook" (WEBHOOK_URL можно оставить пустым) и выполните
+
+    python tools/replay_updates.py updates.json --url http://127.0.0.1:8443/telegram
+
+Файл может содержать один Update, список Update или по одному Update на строку.
+Секретный токен берется из --secret или из WEBHOOK_SECRET в .env.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+from dotenv import load_dotenv
+
+
+def read_updates(path: Path):
+    text = path.read_text(encoding="utf-8").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+async def replay(updates, url: str, secret: str, delay: float):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        for update in updates:
+            started = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"update_id={update.get('update_id')}: HTTP {response.status}, {elapsed:.1f} мс")
+            if delay:
+                await asyncio.sleep(delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--delay", type=float, default=0, help="Пауза между обновлениями, с")
+    args = parser.parse_args()
+
+    load_dotenv()
+    secret = args.secret if args.secret is not None else os.getenv("WEBHOOK_SECRET", "")
+
+    updates = [update for path in args.files for update in read_updates(path)]
+    if not updates:
+        sys.exit("Нет обновлений для отправки")
+    asyncio.run(replay(updates, args.url, secret, args.delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import asyncio
+import hmac
+import logging
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import INBOUND_REJECTED_TOTAL
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Прием обновлений Telegram через webhook на aiohttp
+
+    Запрос проверяется по секретному токену, обновление кладется в
+    app.update_queue и сразу подтверждается ответом 200. Дальше его
+    обрабатывают те же обработчики (handle_message), что и при polling.
+    Если очередь заполнена, обновление не принимается (503).
+    """
+
+    def __init__(self, app: Application, path: str, secret_token: Optional[str],
+                 host: str = "0.0.0.0", port: int = 8443):
+        self.app = app
+        self.path = "/" + path.strip("/")
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Принимает одно обновление"""
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received, self.secret_token):
+                logger.warning(f"Webhook: неверный секретный токен от {request.remote}")
+                return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.app.bot)
+        except Exception as e:
+            logger.warning(f"Webhook: некорректное обновление: {type(e).__name__}: {str(e)}")
+            return web.Response(status=400)
+
+        # Обработка идет в фоне, Telegram сразу получает подтверждение
+        try:
+            self.app.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Очередь заполнена: Telegram повторит доставку позже
+            INBOUND_REJECTED_TOTAL.inc()
+            return web.Response(status=503)
+        return web.Response()
+
+    async def start(self):
+        """Запускает HTTP-сервер"""
+        server = web.Application()
+        server.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Webhook слушает {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Останавливает HTTP-сервер"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None